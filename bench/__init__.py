@@ -0,0 +1 @@
+"""Локальные замеры агентов CISLink: макет портала (mock_cislink) и прогоны под замером (run_bench)."""
@@ -0,0 +1,60 @@
+"""
+Запуск агента под замером (используется bench/run_bench.py).
+
+    BENCH_STATS_FILE=stats.json python -m bench.agent_entry cislink_agent [аргументы агента]
+
+Считает команды WebDriver, отправленные агентом (обёртка над RemoteConnection.execute,
+через которую идут все команды всех драйверов процесса), и при выходе записывает
+счётчики в BENCH_STATS_FILE.
+"""
+
+import os
+import sys
+import json
+import atexit
+import importlib
+import threading
+from collections import Counter
+
+from selenium.webdriver.remote.remote_connection import RemoteConnection
+
+AGENTS = ('cislink_agent', 'link_products_agent', 'cislink_runner')
+
+commands: Counter = Counter()
+commands_lock = threading.Lock()
+
+
+def count_webdriver_commands():
+    original = RemoteConnection.execute
+
+    def execute(self, command, params):
+        with commands_lock:
+            commands[command] += 1
+        return original(self, command, params)
+
+    RemoteConnection.execute = execute
+
+
+def write_stats(path: str):
+    with commands_lock:
+        stats = {'webdriver_commands': sum(commands.values()), 'by_command': dict(commands.most_common())}
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(stats, f, ensure_ascii=False, indent=2)
+
+
+def main():
+    if len(sys.argv) < 2 or sys.argv[1] not in AGENTS:
+        print(f"Использование: python -m bench.agent_entry {{{'|'.join(AGENTS)}}} [аргументы]", file=sys.stderr)
+        exit(2)
+    name = sys.argv[1]
+    # Агенты читают свои аргументы из sys.argv при импорте (например, --force-full)
+    sys.argv = [f'{name}.py'] + sys.argv[2:]
+    count_webdriver_commands()
+    stats_file = os.getenv('BENCH_STATS_FILE')
+    if stats_file:
+        atexit.register(write_stats, stats_file)
+    importlib.import_module(name).main()
+
+
+if __name__ == '__main__':
+    main()
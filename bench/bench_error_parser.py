@@ -0,0 +1,227 @@
+"""
+Микробенчмарк разбора popup-ов ошибок: cislink_errors.parse_error_details против прежнего
+parse_error_details_legacy.
+
+Корпус - bench/fixtures/errors/*.html (те же тексты отдаёт макет портала) и синтетические
+popup-ы на BENCH_PARSER_ROWS строк таблицы (случай "(список неполный)" с тысячами строк).
+Для каждого случая - лучшее время из BENCH_PARSER_REPEAT повторов и пик памяти (tracemalloc).
+Быстрый разбор корпуса сверяется с прежним по полям, которые тот заполняет
+(step, file, fields и examples первого шага; расхождение - код выхода 1).
+Прежний разбор не раскрывает сущности HTML - при сверке они раскрываются;
+случаи, где он заведомо ошибается, перечислены в LEGACY_KNOWN_GAPS.
+
+Замеры сравниваются с bench/baseline_error_parser.json. Время зависит от машины, поэтому
+сравнивается ускорение относительно legacy на том же прогоне (для случаев, где legacy
+работает дольше GATE_MIN_LEGACY_MS) и пик памяти быстрого разбора: падение ускорения
+или рост памяти больше BENCH_PARSER_TOLERANCE - регрессия (код выхода 1).
+
+    python -m bench.bench_error_parser
+    python -m bench.bench_error_parser --update-baseline   # записать замеры как базовые
+"""
+
+import os
+import sys
+import html
+import json
+import time
+import logging
+import tracemalloc
+from typing import Callable, Dict, List, Any, Tuple
+
+from cislink_agent import CONFIG as AGENT_CONFIG, SELECTORS, parse_element_html
+from cislink_errors import parse_error_details, parse_error_details_legacy
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s [%(levelname)s] %(message)s',
+    datefmt='%Y-%m-%d %H:%M:%S'
+)
+logger = logging.getLogger(__name__)
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ERRORS_DIR = os.path.join(BENCH_DIR, 'fixtures', 'errors')
+
+CONFIG = {
+    'rows': [int(n) for n in os.getenv('BENCH_PARSER_ROWS', '1000,10000,50000').split(',') if n.strip()],
+    'repeat': int(os.getenv('BENCH_PARSER_REPEAT', '20')),
+    'results_dir': os.getenv('BENCH_RESULTS_DIR', os.path.join(BENCH_DIR, 'results')),
+    'baseline': os.getenv('BENCH_PARSER_BASELINE', os.path.join(BENCH_DIR, 'baseline_error_parser.json')),
+    'tolerance': float(os.getenv('BENCH_PARSER_TOLERANCE', '0.5')),
+}
+
+# Поля первого шага, которые прежний разбор заполняет так же
+LEGACY_FIELDS = ('step', 'file', 'fields', 'examples')
+# Случай корпуса -> поля, которые прежний разбор заполняет неверно
+LEGACY_KNOWN_GAPS = {
+    'markup_cells': ('fields', 'examples'),  # ячейки с вложенной разметкой (<b>, <span>) legacy пропускает
+}
+
+# Ускорение на коротких popup-ах (доли миллисекунды) - шум, его не сравниваем
+GATE_MIN_LEGACY_MS = 1.0
+# Рост пика памяти меньше этого (КБ) не считается регрессией
+PEAK_SLACK_KB = 16.0
+
+PARSE_OPTIONS = {
+    'max_examples': AGENT_CONFIG['max_error_examples'],
+    'max_text_length': AGENT_CONFIG['max_error_text_length'],
+}
+
+
+def popup_case(details_html: str) -> Tuple[str, str]:
+    """(raw_text, raw_html) так, как их получает HTTP-бэкенд из ответа с lblDetails."""
+    element_id = SELECTORS['error_details']
+    details = parse_element_html(f'<span id="{element_id}">{details_html}</span>', element_id)
+    return details.text.strip(), details.inner_html
+
+
+def synthetic_popup(rows: int, steps: int = 2) -> str:
+    """Popup с несколькими шагами; у последнего таблица на rows строк."""
+    parts = []
+    for step in range(2, 2 + steps - 1):
+        parts.append(
+            f'Шаг {step}: Ошибка проверки формата файла продаж (pdSales.txt)<br />'
+            '<table border="1"><tr><td>Строка</td><td>Поле</td></tr><tr><td>1</td><td>QTY</td></tr></table><br />'
+        )
+    body = ''.join(
+        f'<tr><td>{i}</td><td>ClientCode</td><td>K{i:06d}</td><td>Не найден в справочнике клиентов</td></tr>'
+        for i in range(1, rows + 1)
+    )
+    parts.append(
+        f'Шаг {steps + 1}: Ошибки в справочнике клиентов (pdClients.txt)<br />'
+        f'Всего ошибок: {rows} (список неполный)<br /><table border="1" cellpadding="2">'
+        f'<tr><td>Строка</td><td>Поле</td><td>Значение</td><td>Описание</td></tr>{body}</table>'
+    )
+    return ''.join(parts)
+
+
+def load_corpus() -> List[Tuple[str, str, str]]:
+    cases = []
+    for name in sorted(os.listdir(ERRORS_DIR)):
+        if name.endswith('.html'):
+            with open(os.path.join(ERRORS_DIR, name), encoding='utf-8') as f:
+                cases.append((name[:-5], *popup_case(f.read().strip())))
+    return cases
+
+
+def measure(parse: Callable, raw_text: str, raw_html: str, repeat: int) -> Dict[str, float]:
+    best = float('inf')
+    for _ in range(repeat):
+        started = time.perf_counter()
+        parse(raw_text, raw_html, **PARSE_OPTIONS)
+        best = min(best, time.perf_counter() - started)
+    tracemalloc.start()
+    parse(raw_text, raw_html, **PARSE_OPTIONS)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {'ms': round(best * 1000, 3), 'peak_kb': round(peak / 1024, 1)}
+
+
+def unescape_legacy(value: Any) -> Any:
+    if isinstance(value, str):
+        return html.unescape(value)
+    if isinstance(value, list):
+        return [unescape_legacy(item) for item in value]
+    if isinstance(value, dict):
+        return {unescape_legacy(key): unescape_legacy(item) for key, item in value.items()}
+    return value
+
+
+def check_legacy(corpus: List[Tuple[str, str, str]]) -> List[str]:
+    """Расхождения быстрого разбора с прежним по LEGACY_FIELDS первого шага: 'случай: поле'."""
+    mismatched = []
+    for name, text, raw_html in corpus:
+        fast = parse_error_details(text, raw_html, **PARSE_OPTIONS)['errors'][0]
+        legacy = parse_error_details_legacy(text, raw_html, **PARSE_OPTIONS)['errors'][0]
+        for field in LEGACY_FIELDS:
+            if field in LEGACY_KNOWN_GAPS.get(name, ()):
+                continue
+            if fast[field] != unescape_legacy(legacy[field]):
+                mismatched.append(f"{name}: {field}")
+    return mismatched
+
+
+def load_baseline() -> Dict[str, Any]:
+    if not os.path.exists(CONFIG['baseline']):
+        return {}
+    with open(CONFIG['baseline'], encoding='utf-8') as f:
+        return json.load(f)
+
+
+def save_baseline(results: List[Dict[str, Any]]):
+    baseline = {
+        'repeat': CONFIG['repeat'],
+        'results': {
+            result['case']: {'speedup': result['speedup'], 'fast_peak_kb': result['fast']['peak_kb']}
+            for result in results
+        },
+    }
+    with open(CONFIG['baseline'], 'w', encoding='utf-8') as f:
+        json.dump(baseline, f, ensure_ascii=False, indent=2)
+        f.write('\n')
+    logger.info(f"Базовые замеры обновлены: {CONFIG['baseline']}")
+
+
+def compare(results: List[Dict[str, Any]], baseline: Dict[str, Any]) -> List[str]:
+    """Регрессии относительно базовых замеров (случаи без базы не сравниваются)."""
+    regressions = []
+    for result in results:
+        base = baseline.get('results', {}).get(result['case'])
+        if not base:
+            continue
+        gated = result['legacy']['ms'] >= GATE_MIN_LEGACY_MS
+        if gated and result['speedup'] < base['speedup'] * (1 - CONFIG['tolerance']):
+            regressions.append(f"{result['case']} ускорение: {result['speedup']}x < {base['speedup']}x")
+        peak = result['fast']['peak_kb']
+        if peak > base['fast_peak_kb'] * (1 + CONFIG['tolerance']) and peak - base['fast_peak_kb'] > PEAK_SLACK_KB:
+            regressions.append(f"{result['case']} память: {peak} КБ > {base['fast_peak_kb']} КБ")
+    return regressions
+
+
+def main(argv: List[str] = None):
+    argv = sys.argv[1:] if argv is None else argv
+    corpus = load_corpus()
+    mismatched = check_legacy(corpus)
+    cases = [(name, text, raw_html, CONFIG['repeat']) for name, text, raw_html in corpus]
+    for rows in CONFIG['rows']:
+        text, raw_html = popup_case(synthetic_popup(rows))
+        cases.append((f'synthetic-{rows}', text, raw_html, max(5, CONFIG['repeat'] // 4)))
+    results = []
+    logger.info(f"{'случай':<22} {'legacy, мс':>11} {'fast, мс':>10} {'ускорение':>10} {'legacy, КБ':>11} {'fast, КБ':>9}")
+    for name, text, raw_html, repeat in cases:
+        legacy = measure(parse_error_details_legacy, text, raw_html, repeat)
+        fast = measure(parse_error_details, text, raw_html, repeat)
+        speedup = legacy['ms'] / fast['ms'] if fast['ms'] else 0.0
+        results.append({
+            'case': name, 'html_bytes': len(raw_html.encode('utf-8')), 'legacy': legacy, 'fast': fast,
+            'speedup': round(speedup, 2),
+        })
+        logger.info(
+            f"{name:<22} {legacy['ms']:>11.3f} {fast['ms']:>10.3f} {speedup:>9.1f}x "
+            f"{legacy['peak_kb']:>11.1f} {fast['peak_kb']:>9.1f}"
+        )
+    os.makedirs(CONFIG['results_dir'], exist_ok=True)
+    path = os.path.join(CONFIG['results_dir'], 'error_parser.json')
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump({'repeat': CONFIG['repeat'], 'results': results}, f, ensure_ascii=False, indent=2)
+    logger.info(f"Результаты: {path}")
+    regressions = []
+    if '--update-baseline' in argv:
+        save_baseline(results)
+    else:
+        baseline = load_baseline()
+        if baseline:
+            regressions = compare(results, baseline)
+            for line in regressions:
+                logger.error(f"Регрессия: {line}")
+            if not regressions:
+                logger.info("Регрессий относительно базовых замеров нет")
+        else:
+            logger.info("Базовых замеров нет - сравнение пропущено (запишите их флагом --update-baseline)")
+    if mismatched:
+        logger.error(f"Разбор расходится с прежним: {', '.join(mismatched)}")
+    if mismatched or regressions:
+        exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,151 @@
+"""
+Проверки доставки без браузера и сети: что остаётся в состоянии агента, когда
+очередь отправки переполнена (OUTBOX_MAX_ENTRIES) или API не настроен.
+
+- link: результаты журнала, не принятые ни API, ни очередью, остаются в журнале
+- sync: отпечаток UploadHistory и время сбора не сохраняются, если отчёты не доставлены
+  и не попали в очередь (иначе следующий запуск пропустил бы сбор)
+
+Доставка подменяется заглушкой, отвечающей ошибкой; состояние - во временном STATE_DIR.
+Код выхода 1 - если какая-то проверка не прошла.
+
+    python -m bench.check_delivery
+"""
+
+import shutil
+import logging
+import tempfile
+from typing import Callable, Dict, List, Any, Tuple
+
+import cislink_agent
+import link_products_agent
+from cislink_state import LinkJournal, StateValues
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s [%(levelname)s] %(message)s',
+    datefmt='%Y-%m-%d %H:%M:%S'
+)
+logger = logging.getLogger(__name__)
+
+
+class FailingDelivery:
+    """Доставка, которая всегда отвечает ошибкой (API недоступен)."""
+
+    def send(self, items, extra=None, items_key: str = 'reports') -> Dict[str, Any]:
+        return {'success': False, 'error': 'http_503'}
+
+
+class StubScraper:
+    """Скрапер с одной строкой UploadHistory; отпечаток таблицы всегда один и тот же."""
+
+    def __init__(self):
+        self.pacer = cislink_agent.get_pacer()
+        self.report_filter = cislink_agent.ReportFilter()
+
+    def navigate_to_reports(self) -> bool:
+        return True
+
+    def probe_fingerprint(self) -> Dict[str, Any]:
+        return {'rows': 1, 'digest': 'stub'}
+
+    def scrape_reports(self) -> List[Dict[str, Any]]:
+        return [{'distr_id': 1, 'distr_name': 'Дистрибьютор', 'status': 'Ошибка', 'errors': None}]
+
+
+def configure(module, state_dir: str, **values):
+    module.CONFIG.update(
+        dict(state_dir=state_dir, api_url='http://api.invalid', api_key='key',
+             outbox_enabled=True, outbox_max_entries=1), **values
+    )
+
+
+def fill_outbox(api):
+    """Очередь на пределе: одна недоставленная запись при OUTBOX_MAX_ENTRIES=1."""
+    api.delivery = FailingDelivery()
+    api.outbox.enqueue([{'id': 0}], {})
+
+
+def check_journal_outbox_full(state_dir: str) -> str:
+    configure(link_products_agent, state_dir)
+    api = link_products_agent.APIClient()
+    journal = LinkJournal(state_dir)
+    try:
+        fill_outbox(api)
+        journal.start_run('check')
+        for index in range(3):
+            journal.append('check', f'item-{index}', {'status': 'linked', 'article': f'A{index}'})
+        result = link_products_agent.flush_journal(journal, api)
+        pending = len(journal.undelivered())
+        if result.get('error') != 'outbox_full' or pending != 3:
+            return f"ошибка {result.get('error')}, в журнале осталось {pending} из 3"
+        return ''
+    finally:
+        journal.close()
+        api.close()
+
+
+def check_journal_api_not_configured(state_dir: str) -> str:
+    configure(link_products_agent, state_dir, api_url='')
+    api = link_products_agent.APIClient()
+    journal = LinkJournal(state_dir)
+    try:
+        journal.start_run('check')
+        journal.append('check', 'item-0', {'status': 'linked', 'article': 'A0'})
+        link_products_agent.flush_journal(journal, api)
+        pending = len(journal.undelivered())
+        return '' if pending == 1 else f"в журнале осталось {pending} из 1"
+    finally:
+        journal.close()
+        api.close()
+
+
+def check_sync_outbox_full(state_dir: str) -> str:
+    configure(
+        cislink_agent, state_dir, delta_sync=False, change_probe=True, scrape_since='last_run',
+        force_full_scrape=False
+    )
+    api = cislink_agent.APIClient()
+    try:
+        fill_outbox(api)
+        ok = cislink_agent.run_sync(StubScraper(), api)
+    finally:
+        api.close()
+    state = StateValues(state_dir)
+    try:
+        saved = [key for key in ('upload_history_fingerprint', 'last_scrape_started_at') if state.get(key)]
+    finally:
+        state.close()
+    if ok or saved:
+        return f"run_sync вернул {ok}, сохранено: {', '.join(saved) or '-'}"
+    return ''
+
+
+CHECKS: List[Tuple[str, Callable[[str], str]]] = [
+    ('link: очередь переполнена - журнал не отмечен', check_journal_outbox_full),
+    ('link: API не настроен - журнал не отмечен', check_journal_api_not_configured),
+    ('sync: очередь переполнена - отпечаток не сохранён', check_sync_outbox_full),
+]
+
+
+def main():
+    failed = 0
+    for title, check in CHECKS:
+        state_dir = tempfile.mkdtemp(prefix='cislink-check-')
+        try:
+            problem = check(state_dir)
+        except Exception as e:
+            problem = f"исключение: {e}"
+        finally:
+            shutil.rmtree(state_dir, ignore_errors=True)
+        if problem:
+            failed += 1
+            logger.error(f"{title}: {problem}")
+        else:
+            logger.info(f"{title}: ok")
+    if failed:
+        exit(1)
+
+
+if __name__ == '__main__':
+    main()
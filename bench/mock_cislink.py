@@ -0,0 +1,512 @@
+"""
+Макет портала CISLink для локальных замеров без обращения к боевому b2b.
+
+Страницы собираются из записанных шаблонов bench/fixtures/ с теми же id элементов,
+именами полей и postback-ами ASP.NET WebForms, что и на настоящем портале:
+- /                               - форма входа (txtLogin, txtPassword, btnEnter)
+- /Dictionary/Default.aspx        - выбор дистрибьюторов (cbDistrs с AutoPostBack)
+- /Reports/UploadHistory.aspx     - gvUploads; postback lnkView открывает popup lblDetails
+- /Dictionary/DGrid.aspx          - gvList с ddlPageSize и числовым пейджером
+- /Dictionary/DItem.aspx          - карточка товара: enter_code проверяет артикул запросом
+                                    к CheckCode.ashx, btnSave привязывает товар
+- /api/sync                       - приёмник выгрузок агентов вместо API ЛК
+Служебные адреса: /__stats (счётчики запросов и принятых данных), /__reset.
+
+Данные детерминированы (MOCK_SEED): каждая MOCK_ERROR_EVERY-я строка UploadHistory
+неудачна и получает текст ошибки из bench/fixtures/errors/; товары делятся на
+распознаваемые, с ошибочным артикулом и без совпадения в справочнике.
+
+    MOCK_UPLOAD_ROWS=1000 MOCK_ITEMS=100 MOCK_LATENCY=0.05 python -m bench.mock_cislink
+"""
+
+import os
+import re
+import gzip
+import json
+import time
+import html
+import base64
+import random
+import logging
+import secrets
+import threading
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Optional, List, Dict, Any, Tuple
+from urllib.parse import urlsplit, parse_qs
+
+logger = logging.getLogger(__name__)
+
+CONFIG = {
+    'host': os.getenv('MOCK_HOST', '127.0.0.1'),
+    'port': int(os.getenv('MOCK_PORT', '8800')),
+    'upload_rows': int(os.getenv('MOCK_UPLOAD_ROWS', '100')),
+    'items': int(os.getenv('MOCK_ITEMS', '100')),
+    # Задержка ответа страниц (GET/POST .aspx) и проверки артикула CheckCode.ashx, секунды
+    'latency': float(os.getenv('MOCK_LATENCY', '0')),
+    'check_latency': float(os.getenv('MOCK_CHECK_LATENCY', '0')),
+    'error_every': int(os.getenv('MOCK_ERROR_EVERY', '4')),
+    # Размер __VIEWSTATE: на настоящем портале это десятки килобайт в каждом ответе и postback-е
+    'viewstate_bytes': int(os.getenv('MOCK_VIEWSTATE_BYTES', '20000')),
+    'seed': int(os.getenv('MOCK_SEED', '1')),
+}
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+
+SESSION_COOKIE = 'ASP.NET_SessionId'
+PAGE_SIZES = (10, 25, 50, 100)
+PAGER_BLOCK = 10
+
+UPLOAD_TARGET = re.compile(r'gvUploads\$ctl(\d+)\$lnkView$')
+PLACEHOLDER = re.compile(r'\{\{(\w+)\}\}')
+
+DISTR_NAMES = ('Фармкомплект', 'Медсервис', 'Аптечная сеть', 'Здоровье', 'Витафарм', 'Норд-Фарм', 'Радуга')
+CITIES = ('Москва', 'Санкт-Петербург', 'Казань', 'Екатеринбург', 'Новосибирск', 'Самара', 'Ростов-на-Дону')
+FILE_TYPES = ('pdSales', 'pdStock', 'pdClients')
+CONNECTIONS = ('FTP', 'E-mail', 'API')
+PRODUCTS = ('Крем для рук', 'Шампунь', 'Бальзам', 'Гель для душа', 'Сыворотка', 'Тоник', 'Маска для волос')
+
+# Исход проверки артикула по номеру товара: распознан, ошибка артикула, нет совпадения
+ITEM_OUTCOMES = ('valid',) * 6 + ('invalid',) * 2 + ('no_match',) * 2
+
+
+def load_fixtures(directory: str = FIXTURES_DIR) -> Tuple[Dict[str, str], List[str]]:
+    """Шаблоны страниц (*.html) и тексты ошибок UploadHistory (errors/*.html)."""
+    templates = {}
+    for name in os.listdir(directory):
+        if name.endswith('.html'):
+            with open(os.path.join(directory, name), encoding='utf-8') as f:
+                templates[name[:-5]] = f.read()
+    errors = []
+    errors_dir = os.path.join(directory, 'errors')
+    for name in sorted(os.listdir(errors_dir)):
+        if name.endswith('.html'):
+            with open(os.path.join(errors_dir, name), encoding='utf-8') as f:
+                errors.append(f.read().strip())
+    return templates, errors
+
+
+def render(template: str, **values) -> str:
+    return PLACEHOLDER.sub(lambda m: str(values.get(m.group(1), '')), template)
+
+
+def generate_upload_rows(count: int, error_every: int, error_texts: int, seed: int) -> List[Dict[str, Any]]:
+    rng = random.Random(seed)
+    started = datetime(2026, 10, 1, 18, 0)
+    rows = []
+    for i in range(count):
+        uploaded = started - timedelta(minutes=17 * i + rng.randint(0, 9))
+        failed = error_every > 0 and i % error_every == 0
+        rows.append({
+            'uploaded': uploaded.strftime('%d.%m.%Y %H:%M'),
+            'failed': failed,
+            'file_type': rng.choice(FILE_TYPES),
+            'distr_id': 1000 + i,
+            'distr_code': f'D{1000 + i}',
+            'distr_name': f'{rng.choice(DISTR_NAMES)} {i + 1}',
+            'city': rng.choice(CITIES),
+            'doc_date': (uploaded - timedelta(days=rng.randint(0, 3))).strftime('%d.%m.%Y'),
+            'doc_period': rng.randint(1, 31),
+            'stock_date': (uploaded - timedelta(days=rng.randint(0, 5))).strftime('%d.%m.%Y'),
+            'stock_period': rng.randint(1, 7),
+            'connection': rng.choice(CONNECTIONS),
+            'error': rng.randrange(error_texts) if failed and error_texts else None,
+        })
+    return rows
+
+
+def generate_items(count: int, seed: int) -> List[Dict[str, Any]]:
+    rng = random.Random(seed + 1)
+    items = []
+    for i in range(count):
+        outcome = ITEM_OUTCOMES[i % len(ITEM_OUTCOMES)]
+        prefix = {'valid': 'ART', 'invalid': 'X', 'no_match': 'NM'}[outcome]
+        items.append({
+            'id': i + 1,
+            'product_name': f'{rng.choice(PRODUCTS)} {rng.choice((30, 50, 75, 100, 250))} мл №{i + 1}',
+            'article': f'{prefix}-{i + 1:05d}',
+            'barcode': f'46{rng.randrange(10 ** 10):010d}',
+            'distr_code': f'P{rng.randrange(10 ** 6):06d}',
+            'outcome': outcome,
+            'nomenclature_id': str(50000 + i) if outcome == 'valid' else '',
+        })
+    return items
+
+
+class MockPortal:
+    """Состояние макета: данные страниц, сессии, привязанные товары и счётчики запросов."""
+
+    def __init__(self, upload_rows: int = CONFIG['upload_rows'], items: int = CONFIG['items'],
+                 latency: float = CONFIG['latency'], check_latency: float = CONFIG['check_latency'],
+                 error_every: int = CONFIG['error_every'], viewstate_bytes: int = CONFIG['viewstate_bytes'],
+                 seed: int = CONFIG['seed']):
+        self.templates, self.error_texts = load_fixtures()
+        self.latency = latency
+        self.check_latency = check_latency
+        self.viewstate_padding = 'A' * max(0, viewstate_bytes)
+        self.upload_rows = generate_upload_rows(upload_rows, error_every, len(self.error_texts), seed)
+        self.items = generate_items(items, seed)
+        self.by_article = {item['article']: item for item in self.items}
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.sessions: Dict[str, Dict[str, Any]] = {}
+            self.linked: Dict[int, str] = {}
+            self.requests: Dict[str, int] = {}
+            self.api_batches = 0
+            self.api_items = 0
+            self.api_reports_with_errors = 0
+
+    def count(self, route: str):
+        with self.lock:
+            self.requests[route] = self.requests.get(route, 0) + 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self.lock:
+            return {
+                'requests': dict(self.requests),
+                'total_requests': sum(self.requests.values()),
+                'linked': len(self.linked),
+                'api_batches': self.api_batches,
+                'api_items': self.api_items,
+                'api_reports_with_errors': self.api_reports_with_errors,
+            }
+
+    def expected(self) -> Dict[str, int]:
+        """Что должен получить API после полного прогона агентов."""
+        return {
+            'reports': len(self.upload_rows),
+            'reports_with_errors': sum(1 for row in self.upload_rows if row['failed']),
+            'linkable': sum(1 for item in self.items if item['outcome'] == 'valid'),
+        }
+
+    def new_session(self) -> str:
+        sid = secrets.token_hex(12)
+        with self.lock:
+            self.sessions[sid] = {'distrs': False}
+        return sid
+
+    def session(self, sid: Optional[str]) -> Optional[Dict[str, Any]]:
+        with self.lock:
+            return self.sessions.get(sid or '')
+
+    def viewstate(self, state: Dict[str, Any]) -> str:
+        data = json.dumps(state, separators=(',', ':')) + '|' + self.viewstate_padding
+        return base64.b64encode(data.encode('utf-8')).decode('ascii')
+
+    @staticmethod
+    def read_viewstate(value: str) -> Dict[str, Any]:
+        try:
+            return json.loads(base64.b64decode(value).decode('utf-8').split('|', 1)[0])
+        except (ValueError, UnicodeDecodeError):
+            return {}
+
+    def page(self, title: str, action: str, body: str, state: Optional[Dict[str, Any]] = None,
+             user: str = '') -> str:
+        return render(
+            self.templates['layout'], title=title, action=html.escape(action), body=body, user=html.escape(user),
+            viewstate=self.viewstate(state or {}), eventvalidation=self.viewstate({'v': 1})[:64]
+        )
+
+    # Страницы
+
+    def login_page(self, error: str = '') -> str:
+        return self.page('Вход', './', render(self.templates['login'], error=html.escape(error)))
+
+    def dictionary_page(self, session: Dict[str, Any]) -> str:
+        body = render(
+            self.templates['dictionary'],
+            checked='checked="checked" ' if session['distrs'] else '',
+            selected=len(self.upload_rows) if session['distrs'] else 0
+        )
+        return self.page('Дистрибьюторы', './Default.aspx', body, user='bench')
+
+    def upload_history_page(self, session: Dict[str, Any], popup_row: Optional[int] = None) -> str:
+        rows = self.upload_rows if session['distrs'] else []
+        parts = []
+        for index, row in enumerate(rows):
+            row_id = str(index + 2).zfill(2)
+            parts.append(render(
+                self.templates['upload_row'],
+                css='alt' if index % 2 else 'row',
+                status='Неудачно' if row['failed'] else 'Удачно',
+                link=render(self.templates['upload_link'], row_id=row_id) if row['failed'] else '&nbsp;',
+                **{k: html.escape(str(v)) for k, v in row.items() if k not in ('failed', 'error')}
+            ))
+        popup = ''
+        if popup_row is not None and 0 <= popup_row < len(rows) and rows[popup_row]['error'] is not None:
+            popup = render(self.templates['popup'], details=self.error_texts[rows[popup_row]['error']])
+        body = render(self.templates['upload_history'], rows=''.join(parts), popup=popup)
+        return self.page('История загрузок', './UploadHistory.aspx', body, user='bench')
+
+    def unlinked_items(self) -> List[Dict[str, Any]]:
+        with self.lock:
+            return [item for item in self.items if item['id'] not in self.linked]
+
+    def dgrid_page(self, session: Dict[str, Any], action: str, page_size: int, page_index: int) -> str:
+        items = self.unlinked_items() if session['distrs'] else []
+        pages = max(1, (len(items) + page_size - 1) // page_size)
+        page_index = min(max(1, page_index), pages)
+        start = (page_index - 1) * page_size
+        rows = [
+            render(
+                self.templates['dgrid_row'], number=start + offset + 1, row_id=str(offset + 2).zfill(2),
+                item_id=item['id'], product_name=html.escape(item['product_name']),
+                article=item['article'], barcode=item['barcode'], distr_code=item['distr_code']
+            )
+            for offset, item in enumerate(items[start:start + page_size])
+        ]
+        pager = ''
+        if pages > 1:
+            pager = render(self.templates['dgrid_pager'], pages=self.pager_cells(page_index, pages))
+        selected = ' selected="selected"'
+        sizes = ''.join(
+            f'\n\t\t<option{selected if size == page_size else ""} value="{size}">{size}</option>'
+            for size in PAGE_SIZES
+        )
+        body = render(
+            self.templates['dgrid'], rows=''.join(rows), pager=pager, page_sizes=sizes, total=len(items)
+        )
+        return self.page('Непривязанные товары', action, body, {'size': page_size, 'page': page_index}, 'bench')
+
+    @staticmethod
+    def pager_cells(page_index: int, pages: int) -> str:
+        """Числовой пейджер GridView: блок из 10 номеров и '...' на соседние блоки."""
+        target = 'ctl00$ContentPlaceHolder1$ucDGrid$gvList'
+        first = (page_index - 1) // PAGER_BLOCK * PAGER_BLOCK + 1
+        last = min(pages, first + PAGER_BLOCK - 1)
+
+        def link(argument: int, text: str) -> str:
+            return f'<td><a href="javascript:__doPostBack(&#39;{target}&#39;,&#39;Page${argument}&#39;)">{text}</a></td>'
+
+        cells = [link(first - 1, '...')] if first > 1 else []
+        for number in range(first, last + 1):
+            cells.append(f'<td><span>{number}</span></td>' if number == page_index else link(number, str(number)))
+        if last < pages:
+            cells.append(link(last + 1, '...'))
+        return ''.join(cells)
+
+    def card_page(self, action: str, item: Dict[str, Any], save_result: str = '') -> str:
+        body = render(
+            self.templates['card'], product_name=html.escape(item['product_name']),
+            article=html.escape(item['article']), barcode=item['barcode'], save_result=html.escape(save_result)
+        )
+        return self.page('Карточка товара', action, body, {'id': item['id']}, 'bench')
+
+    def check_code(self, code: str) -> Dict[str, str]:
+        item = self.by_article.get(code.strip())
+        if not item or item['outcome'] == 'invalid':
+            return {'error': 'Артикул не найден в справочнике производителя'}
+        if item['outcome'] == 'no_match':
+            return {}
+        return {'id': item['nomenclature_id'], 'name': html.escape(item['product_name'])}
+
+    def link_item(self, item_id: int, article: str) -> str:
+        check = self.check_code(article)
+        if not check.get('id'):
+            return 'Не выбрана номенклатура'
+        with self.lock:
+            self.linked[item_id] = check['id']
+        return 'Сохранено'
+
+    def accept_api(self, payload: Dict[str, Any]):
+        items = payload.get('reports') or payload.get('results') or []
+        with self.lock:
+            self.api_batches += 1
+            self.api_items += len(items)
+            self.api_reports_with_errors += sum(1 for item in items if item.get('errors'))
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    portal: MockPortal = None
+    protocol_version = 'HTTP/1.1'
+
+    # Ответы
+
+    def _send(self, code: int, body: bytes, content_type: str, headers: Optional[Dict[str, str]] = None):
+        self.send_response(code)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        if self.command != 'HEAD':
+            self.wfile.write(body)
+
+    def _html(self, text: str, headers: Optional[Dict[str, str]] = None):
+        self._send(200, text.encode('utf-8'), 'text/html; charset=utf-8', headers)
+
+    def _json(self, data: Any, code: int = 200):
+        self._send(code, json.dumps(data, ensure_ascii=False).encode('utf-8'), 'application/json; charset=utf-8')
+
+    def _redirect(self, location: str, headers: Optional[Dict[str, str]] = None):
+        self._send(302, b'', 'text/html; charset=utf-8', dict(headers or {}, Location=location))
+
+    def _session(self) -> Optional[Dict[str, Any]]:
+        for part in (self.headers.get('Cookie') or '').split(';'):
+            name, _, value = part.strip().partition('=')
+            if name == SESSION_COOKIE:
+                return self.portal.session(value)
+        return None
+
+    def _form(self) -> Dict[str, str]:
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length) if length else b''
+        return {k: v[-1] for k, v in parse_qs(body.decode('utf-8'), keep_blank_values=True).items()}
+
+    # Маршрутизация
+
+    def do_GET(self):
+        self._dispatch({})
+
+    def do_POST(self):
+        if urlsplit(self.path).path == '/api/sync':
+            return self._api()
+        self._dispatch(self._form())
+
+    def _dispatch(self, form: Dict[str, str]):
+        url = urlsplit(self.path)
+        path = url.path.rstrip('/') or '/'
+        query = {k: v[-1] for k, v in parse_qs(url.query).items()}
+        action = '.' + path[path.rfind('/'):] + (f'?{url.query}' if url.query else '')
+        if path.startswith('/__'):
+            return self._service(path)
+        if path.endswith(('.css', '.png', '.js')):
+            return self._static(path)
+        self.portal.count(path)
+        latency = self.portal.check_latency if path.endswith('.ashx') else self.portal.latency
+        if latency:
+            time.sleep(latency)
+        if path in ('/', '/Default.aspx'):
+            return self._login(form)
+        session = self._session()
+        if session is None:
+            return self._redirect(f'/?ReturnUrl={path}')
+        if path == '/Dictionary/Default.aspx':
+            if form.get('__EVENTTARGET') == 'cbDistrs':
+                session['distrs'] = 'cbDistrs' in form
+            return self._html(self.portal.dictionary_page(session))
+        if path == '/Reports/UploadHistory.aspx':
+            match = UPLOAD_TARGET.search(form.get('__EVENTTARGET', ''))
+            return self._html(self.portal.upload_history_page(session, int(match.group(1)) - 2 if match else None))
+        if path == '/Dictionary/DGrid.aspx':
+            return self._dgrid(session, action, form)
+        if path == '/Dictionary/DItem.aspx':
+            return self._card(action, query, form)
+        if path == '/Dictionary/CheckCode.ashx':
+            return self._json(self.portal.check_code(query.get('code', '')))
+        self._send(404, 'Страница не найдена'.encode('utf-8'), 'text/plain; charset=utf-8')
+
+    def _login(self, form: Dict[str, str]):
+        if 'btnEnter' not in form:
+            return self._html(self.portal.login_page())
+        if not form.get('txtLogin') or not form.get('txtPassword'):
+            return self._html(self.portal.login_page('Неверный логин или пароль'))
+        sid = self.portal.new_session()
+        self._redirect('/Dictionary/Default.aspx', {'Set-Cookie': f'{SESSION_COOKIE}={sid}; path=/; HttpOnly'})
+
+    def _dgrid(self, session: Dict[str, Any], action: str, form: Dict[str, str]):
+        state = MockPortal.read_viewstate(form.get('__VIEWSTATE', ''))
+        page_size = int(state.get('size', PAGE_SIZES[0]))
+        page_index = int(state.get('page', 1))
+        target = form.get('__EVENTTARGET', '')
+        if target.endswith('ddlPageSize'):
+            value = form.get(target, '')
+            page_size = int(value) if value.isdigit() and int(value) in PAGE_SIZES else page_size
+            page_index = 1
+        elif target.endswith('gvList') and form.get('__EVENTARGUMENT', '').startswith('Page$'):
+            argument = form['__EVENTARGUMENT'][5:]
+            page_index = int(argument) if argument.isdigit() else page_index
+        self._html(self.portal.dgrid_page(session, action, page_size, page_index))
+
+    def _card(self, action: str, query: Dict[str, str], form: Dict[str, str]):
+        item_id = int(query['id']) if query.get('id', '').isdigit() else 0
+        item = next((i for i in self.portal.items if i['id'] == item_id), None)
+        if not item:
+            return self._send(404, 'Товар не найден'.encode('utf-8'), 'text/plain; charset=utf-8')
+        save_result = ''
+        if 'btnSave' in form:
+            save_result = self.portal.link_item(item_id, form.get('inpTextCode', ''))
+        self._html(self.portal.card_page(action, item, save_result))
+
+    def _api(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length) if length else b''
+        if self.headers.get('Content-Encoding') == 'gzip':
+            body = gzip.decompress(body)
+        try:
+            payload = json.loads(body.decode('utf-8'))
+        except ValueError:
+            return self._json({'success': False, 'error': 'invalid json'}, 400)
+        self.portal.accept_api(payload)
+        self._json({'success': True})
+
+    def _static(self, path: str):
+        if path.endswith('.css'):
+            return self._send(200, b'body{font-family:Arial;font-size:12px}.grid td{padding:2px 4px}', 'text/css')
+        if path.endswith('.js'):
+            return self._send(200, b'', 'application/javascript')
+        # Прозрачный PNG 1x1
+        png = base64.b64decode(
+            'iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAQAAAC1HAwCAAAAC0lEQVR42mNkYAAAAAYAAjCB0C8AAAAASUVORK5CYII='
+        )
+        self._send(200, png, 'image/png')
+
+    def _service(self, path: str):
+        if path == '/__stats':
+            return self._json(dict(self.portal.stats(), expected=self.portal.expected()))
+        if path == '/__reset':
+            self.portal.reset()
+            return self._json({'success': True})
+        self._send(404, b'', 'text/plain')
+
+    def log_message(self, format, *args):
+        logger.debug(f"{self.address_string()} {format % args}")
+
+
+class MockServer:
+    """Макет в фоновом потоке: start() возвращает базовый адрес для CISLINK_URL."""
+
+    def __init__(self, portal: MockPortal, host: str = CONFIG['host'], port: int = 0):
+        handler = type('Handler', (MockHandler,), {'portal': portal})
+        self.portal = portal
+        self.httpd = ThreadingHTTPServer((host, port), handler)
+        self.httpd.daemon_threads = True
+        self.thread = threading.Thread(target=self.httpd.serve_forever, name='mock-cislink', daemon=True)
+
+    @property
+    def url(self) -> str:
+        host, port = self.httpd.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def start(self) -> str:
+        self.thread.start()
+        return self.url
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+def main():
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s [%(levelname)s] %(message)s',
+                        datefmt='%Y-%m-%d %H:%M:%S')
+    portal = MockPortal()
+    server = MockServer(portal, CONFIG['host'], CONFIG['port'])
+    logger.info(
+        f"Макет CISLink: {server.url} (строк UploadHistory {len(portal.upload_rows)}, товаров {len(portal.items)}, "
+        f"задержка {portal.latency} с)"
+    )
+    logger.info(f"CISLINK_URL={server.url} API_URL={server.url}/api/sync")
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.httpd.server_close()
+
+
+if __name__ == '__main__':
+    main()
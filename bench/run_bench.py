@@ -0,0 +1,291 @@
+"""
+Сквозные замеры агентов CISLink на локальном макете портала (bench/mock_cislink.py).
+
+Для каждого сценария и размера данных (по умолчанию 10/100/1000 строк) поднимается
+макет, агент запускается отдельным процессом (bench/agent_entry.py) с CISLINK_URL
+и API_URL на макет и чистым STATE_DIR. Записываются:
+- wall_seconds       - время работы процесса агента от запуска до выхода
+- webdriver_commands - число команд WebDriver
+- peak_rss_mb        - пик RSS агента вместе с chromedriver и всеми процессами Chrome
+- server_requests    - число запросов к страницам портала
+Прогон засчитывается, только если API получил все отчёты с деталями ошибок (sync)
+или привязаны все распознаваемые товары (link).
+
+Результаты (вместе с разбивкой по фазам из профиля запуска, см. cislink_metrics)
+пишутся в bench/results/latest.json (логи агентов - рядом) и сравниваются
+с bench/baseline.json: рост времени или памяти больше BENCH_TOLERANCE, числа команд
+или запросов больше BENCH_COUNT_TOLERANCE считается регрессией (код выхода 1).
+
+    python -m bench.run_bench                          # все сценарии на 10/100/1000 строк
+    python -m bench.run_bench sync-http --sizes=10,100
+    python -m bench.run_bench --update-baseline        # записать результаты как базовые
+
+Сценарии: sync (Selenium), sync-http (SCRAPER_BACKEND=http), link.
+Запускать из корня репозитория; для Selenium-сценариев нужны Chrome и chromedriver.
+
+В репозитории хранятся базовые замеры сценария без Chrome (sync-http на 10/100 строк);
+их проверяет workflow .github/workflows/bench.yml, тот же прогон локально:
+
+    python -m bench.run_bench sync-http --sizes=10,100
+"""
+
+import os
+import sys
+import json
+import time
+import signal
+import shutil
+import logging
+import platform
+import tempfile
+import subprocess
+from datetime import datetime
+from typing import Optional, List, Dict, Any
+
+from bench.mock_cislink import MockPortal, MockServer
+from cislink_browser import process_tree_pids, process_tree_rss
+
+logger = logging.getLogger(__name__)
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(BENCH_DIR)
+
+CONFIG = {
+    'sizes': [int(size) for size in os.getenv('BENCH_SIZES', '10,100,1000').split(',') if size.strip()],
+    'scenarios': [name.strip() for name in os.getenv('BENCH_SCENARIOS', 'sync,sync-http,link').split(',')
+                  if name.strip()],
+    # Задержка макета на страницу и на проверку артикула, секунды
+    'latency': float(os.getenv('BENCH_LATENCY', '0.05')),
+    'check_latency': float(os.getenv('BENCH_CHECK_LATENCY', '0.02')),
+    # Допустимый рост относительно базовых замеров
+    'tolerance': float(os.getenv('BENCH_TOLERANCE', '0.2')),
+    'count_tolerance': float(os.getenv('BENCH_COUNT_TOLERANCE', '0.05')),
+    'timeout': float(os.getenv('BENCH_TIMEOUT', '3600')),
+    'baseline': os.getenv('BENCH_BASELINE', os.path.join(BENCH_DIR, 'baseline.json')),
+    'results_dir': os.getenv('BENCH_RESULTS_DIR', os.path.join(BENCH_DIR, 'results')),
+}
+
+RSS_SAMPLE_INTERVAL = 0.2
+
+
+def check_sync(stats: Dict[str, Any], expected: Dict[str, int]) -> str:
+    if stats['api_items'] != expected['reports']:
+        return f"API получил {stats['api_items']} отчётов из {expected['reports']}"
+    if stats['api_reports_with_errors'] != expected['reports_with_errors']:
+        return f"деталей ошибок {stats['api_reports_with_errors']} из {expected['reports_with_errors']}"
+    return ''
+
+
+def check_link(stats: Dict[str, Any], expected: Dict[str, int]) -> str:
+    if stats['linked'] != expected['linkable']:
+        return f"привязано {stats['linked']} товаров из {expected['linkable']}"
+    return ''
+
+
+# agent - модуль для bench.agent_entry, data - что из макета масштабируется числом строк
+SCENARIOS: Dict[str, Dict[str, Any]] = {
+    'sync': {'agent': 'cislink_agent', 'data': 'upload_rows', 'env': {'SCRAPER_BACKEND': 'selenium'},
+             'check': check_sync},
+    'sync-http': {'agent': 'cislink_agent', 'data': 'upload_rows', 'env': {'SCRAPER_BACKEND': 'http'},
+                  'check': check_sync},
+    'link': {'agent': 'link_products_agent', 'data': 'items', 'env': {}, 'check': check_link},
+}
+
+# Метрика -> (порог относительного роста из CONFIG, абсолютный рост, меньше которого не считается)
+GATED_METRICS = {
+    'wall_seconds': ('tolerance', 1.0),
+    'peak_rss_mb': ('tolerance', 20.0),
+    'webdriver_commands': ('count_tolerance', 5),
+    'server_requests': ('count_tolerance', 2),
+}
+
+
+def result_key(result: Dict[str, Any]) -> str:
+    return f"{result['scenario']}/{result['rows']}"
+
+
+def kill_tree(pid: int):
+    for child in reversed(process_tree_pids(pid) or [pid]):
+        try:
+            os.kill(child, signal.SIGKILL)
+        except OSError:
+            pass
+
+
+def wait_sampling_rss(process: subprocess.Popen, timeout: float) -> Optional[int]:
+    """Ждёт завершения процесса, замеряя пик RSS его дерева. None - превышен таймаут."""
+    deadline = time.monotonic() + timeout
+    peak = 0
+    while process.poll() is None:
+        peak = max(peak, process_tree_rss(process.pid) or 0)
+        if time.monotonic() > deadline:
+            kill_tree(process.pid)
+            process.wait()
+            return None
+        time.sleep(RSS_SAMPLE_INTERVAL)
+    return peak
+
+
+def run_scenario(name: str, rows: int) -> Dict[str, Any]:
+    scenario = SCENARIOS[name]
+    data = {'upload_rows': 0, 'items': 0, scenario['data']: rows}
+    portal = MockPortal(latency=CONFIG['latency'], check_latency=CONFIG['check_latency'], **data)
+    server = MockServer(portal)
+    url = server.start()
+    workdir = tempfile.mkdtemp(prefix='cislink-bench-')
+    stats_file = os.path.join(workdir, 'stats.json')
+    profile_file = os.path.join(workdir, 'profile.json')
+    env = dict(
+        os.environ,
+        CISLINK_URL=url, API_URL=f'{url}/api/sync', API_KEY='bench',
+        CISLINK_LOGIN='bench', CISLINK_PASSWORD='bench',
+        STATE_DIR=os.path.join(workdir, 'state'), BENCH_STATS_FILE=stats_file, PROFILE_JSON=profile_file,
+        MAX_ITEMS_PER_RUN=str(max(rows, 1)),
+        **scenario['env']
+    )
+    env.pop('CHROME_PROFILE_DIR', None)
+    log_path = os.path.join(CONFIG['results_dir'], f'{name}-{rows}.log')
+    logger.info(f"{name}: {rows} строк...")
+    try:
+        started = time.monotonic()
+        with open(log_path, 'w', encoding='utf-8') as log:
+            process = subprocess.Popen(
+                [sys.executable, '-m', 'bench.agent_entry', scenario['agent']],
+                cwd=ROOT_DIR, env=env, stdout=log, stderr=subprocess.STDOUT
+            )
+            peak = wait_sampling_rss(process, CONFIG['timeout'])
+        wall = time.monotonic() - started
+        stats = portal.stats()
+        agent_stats = {}
+        if os.path.exists(stats_file):
+            with open(stats_file, encoding='utf-8') as f:
+                agent_stats = json.load(f)
+        phases = {}
+        if os.path.exists(profile_file):
+            with open(profile_file, encoding='utf-8') as f:
+                phases = json.load(f).get('phases', {})
+    finally:
+        server.stop()
+        shutil.rmtree(workdir, ignore_errors=True)
+    if peak is None:
+        problem = f"превышен таймаут {CONFIG['timeout']:.0f} с"
+    elif process.returncode:
+        problem = f"код выхода {process.returncode}"
+    else:
+        problem = scenario['check'](stats, portal.expected())
+    return {
+        'scenario': name,
+        'rows': rows,
+        'ok': not problem,
+        'problem': problem,
+        'wall_seconds': round(wall, 2),
+        'webdriver_commands': agent_stats.get('webdriver_commands', 0),
+        'peak_rss_mb': round((peak or 0) / 1024 / 1024, 1),
+        'server_requests': stats['total_requests'],
+        'requests': stats['requests'],
+        'by_command': agent_stats.get('by_command', {}),
+        'phases': phases,
+        'log': os.path.relpath(log_path, ROOT_DIR),
+    }
+
+
+def load_baseline() -> Optional[Dict[str, Any]]:
+    if not os.path.exists(CONFIG['baseline']):
+        return None
+    with open(CONFIG['baseline'], encoding='utf-8') as f:
+        return json.load(f)
+
+
+def save_baseline(results: List[Dict[str, Any]], baseline: Optional[Dict[str, Any]]):
+    """Дописывает удачные прогоны в базовые замеры (остальные сценарии сохраняются)."""
+    if not baseline or (baseline.get('latency'), baseline.get('check_latency')) != (
+            CONFIG['latency'], CONFIG['check_latency']):
+        baseline = {'results': {}}
+    baseline.update(
+        updated_at=datetime.now().strftime('%Y-%m-%d %H:%M:%S'), platform=platform.platform(),
+        python=platform.python_version(), latency=CONFIG['latency'], check_latency=CONFIG['check_latency']
+    )
+    for result in results:
+        if result['ok']:
+            baseline['results'][result_key(result)] = {metric: result[metric] for metric in GATED_METRICS}
+    with open(CONFIG['baseline'], 'w', encoding='utf-8') as f:
+        json.dump(baseline, f, ensure_ascii=False, indent=2)
+        f.write('\n')
+    logger.info(f"Базовые замеры обновлены: {os.path.relpath(CONFIG['baseline'], ROOT_DIR)}")
+
+
+def compare(results: List[Dict[str, Any]], baseline: Dict[str, Any]) -> List[str]:
+    """Регрессии относительно базовых замеров (сценарии без базы не сравниваются)."""
+    if (baseline.get('latency'), baseline.get('check_latency')) != (CONFIG['latency'], CONFIG['check_latency']):
+        logger.warning("Базовые замеры сняты с другой задержкой макета - сравнение пропущено")
+        return []
+    regressions = []
+    for result in results:
+        base = baseline['results'].get(result_key(result))
+        if not base or not result['ok']:
+            continue
+        for metric, (tolerance, slack) in GATED_METRICS.items():
+            limit = base[metric] * (1 + CONFIG[tolerance])
+            if result[metric] > limit and result[metric] - base[metric] > slack:
+                regressions.append(
+                    f"{result_key(result)} {metric}: {result[metric]} > {base[metric]} "
+                    f"(+{(result[metric] / base[metric] - 1) * 100 if base[metric] else 100:.0f}%)"
+                )
+    return regressions
+
+
+def log_results(results: List[Dict[str, Any]]):
+    logger.info("=" * 78)
+    logger.info(f"{'сценарий':<10} {'строк':>6} {'время, с':>9} {'команд WD':>10} {'RSS, МБ':>8} "
+                f"{'запросов':>9}  статус")
+    for r in results:
+        logger.info(
+            f"{r['scenario']:<10} {r['rows']:>6} {r['wall_seconds']:>9.1f} {r['webdriver_commands']:>10} "
+            f"{r['peak_rss_mb']:>8.0f} {r['server_requests']:>9}  {'ok' if r['ok'] else r['problem']}"
+        )
+    logger.info("=" * 78)
+
+
+def main(argv: Optional[List[str]] = None):
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s [%(levelname)s] %(message)s',
+                        datefmt='%Y-%m-%d %H:%M:%S')
+    argv = sys.argv[1:] if argv is None else argv
+    names = [a for a in argv if not a.startswith('--')] or CONFIG['scenarios']
+    sizes = CONFIG['sizes']
+    for arg in argv:
+        if arg.startswith('--sizes='):
+            sizes = [int(size) for size in arg.split('=', 1)[1].split(',') if size.strip()]
+    unknown = [name for name in names if name not in SCENARIOS]
+    if unknown:
+        logger.error(f"Неизвестные сценарии: {', '.join(unknown)} (доступны: {', '.join(SCENARIOS)})")
+        exit(2)
+    os.makedirs(CONFIG['results_dir'], exist_ok=True)
+
+    results = [run_scenario(name, rows) for name in names for rows in sizes]
+    log_results(results)
+    with open(os.path.join(CONFIG['results_dir'], 'latest.json'), 'w', encoding='utf-8') as f:
+        json.dump({'latency': CONFIG['latency'], 'check_latency': CONFIG['check_latency'], 'results': results},
+                  f, ensure_ascii=False, indent=2)
+
+    failed = [r for r in results if not r['ok']]
+    for r in failed:
+        logger.error(f"{result_key(r)}: {r['problem']} (лог: {r['log']})")
+    baseline = load_baseline()
+    if '--update-baseline' in argv:
+        save_baseline(results, baseline)
+        regressions = []
+    elif baseline:
+        regressions = compare(results, baseline)
+        for line in regressions:
+            logger.error(f"Регрессия: {line}")
+        if not regressions:
+            logger.info("Регрессий относительно базовых замеров нет")
+    else:
+        logger.info("Базовых замеров нет - сравнение пропущено (запишите их флагом --update-baseline)")
+        regressions = []
+    if failed or regressions:
+        exit(1)
+
+
+if __name__ == '__main__':
+    main()
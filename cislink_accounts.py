@@ -0,0 +1,195 @@
+"""
+Сбор UploadHistory по нескольким аккаунтам CISLink (разные производители) параллельно.
+
+Аккаунты задаются в CISLINK_ACCOUNTS - JSON-списком или путём к JSON-файлу:
+
+    [
+        {"name": "brand-a", "cislink_login": "...", "cislink_password": "...",
+         "api_url": "https://...", "api_key": "..."},
+        {"name": "brand-b", "cislink_login": "...", "cislink_password": "...",
+         "api_url": "https://...", "api_key": "...", "scraper_backend": "http"}
+    ]
+
+Остальные ключи аккаунта переопределяют одноимённые ключи CONFIG cislink_agent
+(session_key, delta_sync, distr_include и т.п.). Каждый аккаунт выполняется в отдельном
+процессе (spawn, по процессу на аккаунт), одновременно - не больше ACCOUNTS_MAX_BROWSERS.
+У аккаунта свои каталог состояния (STATE_DIR/accounts/<name>: очередь, снимок, сессия,
+кэш ошибок), профиль Chrome (CHROME_PROFILE_DIR/<name>) и порт DevTools
+(CHROME_DEBUGGING_PORT + номер аккаунта). Итоги и время по аккаунтам выводятся одной
+сводкой, ACCOUNTS_SUMMARY=path - та же сводка в JSON.
+
+    CISLINK_ACCOUNTS=accounts.json ACCOUNTS_MAX_BROWSERS=3 python cislink_agent.py
+"""
+
+import os
+import re
+import json
+import time
+import logging
+import multiprocessing
+from datetime import datetime
+from typing import Optional, Dict, List, Any
+
+import cislink_agent
+from cislink_browser import resolve_driver_path
+from cislink_metrics import get_profile, write_atomic
+
+logger = logging.getLogger(__name__)
+
+CONFIG = {
+    # Сколько аккаунтов (браузеров) работает одновременно
+    'max_browsers': int(os.getenv('ACCOUNTS_MAX_BROWSERS', '2')),
+    'summary_path': os.getenv('ACCOUNTS_SUMMARY', ''),
+}
+
+REQUIRED_KEYS = ('name', 'cislink_login', 'cislink_password', 'api_url', 'api_key')
+# Ключи CONFIG, которые задаются только на уровне всего запуска
+RESERVED_KEYS = ('accounts', 'state_dir', 'chrome_profile_dir', 'debugging_port')
+
+# Фазы профиля запуска, которые попадают в сводку
+SUMMARY_PHASES = (('login', 'вход'), ('scrape_reports', 'сбор'), ('send_reports', 'отправка'))
+
+
+def load_accounts(value: str) -> List[Dict[str, Any]]:
+    """Список аккаунтов из JSON-строки или JSON-файла. ValueError - если список некорректен."""
+    if value.lstrip().startswith('['):
+        accounts = json.loads(value)
+    else:
+        with open(value, encoding='utf-8') as f:
+            accounts = json.load(f)
+    if not isinstance(accounts, list) or not accounts:
+        raise ValueError("ожидается непустой JSON-список аккаунтов")
+    names = set()
+    for index, account in enumerate(accounts):
+        if not isinstance(account, dict):
+            raise ValueError(f"аккаунт #{index + 1}: ожидается JSON-объект")
+        missing = [key for key in REQUIRED_KEYS if not account.get(key)]
+        if missing:
+            raise ValueError(f"аккаунт #{index + 1}: не заданы {', '.join(missing)}")
+        unknown = [key for key in account if key != 'name' and key not in cislink_agent.CONFIG]
+        reserved = [key for key in account if key in RESERVED_KEYS]
+        if unknown or reserved:
+            raise ValueError(f"аккаунт {account['name']}: недопустимые ключи {', '.join(unknown + reserved)}")
+        if account['name'] in names:
+            raise ValueError(f"аккаунт {account['name']} указан дважды")
+        names.add(account['name'])
+    return accounts
+
+
+def account_slug(name: str) -> str:
+    return re.sub(r'[^\w.-]+', '_', name)
+
+
+def configure_account(index: int, account: Dict[str, Any]):
+    """Переводит CONFIG cislink_agent этого процесса на аккаунт: учётные данные и свои каталоги/порт."""
+    config = cislink_agent.CONFIG
+    slug = account_slug(account['name'])
+    config.update({key: value for key, value in account.items() if key != 'name'})
+    config['state_dir'] = os.path.join(config['state_dir'], 'accounts', slug)
+    if config['chrome_profile_dir']:
+        config['chrome_profile_dir'] = os.path.join(config['chrome_profile_dir'], slug)
+    if config['debugging_port']:
+        config['debugging_port'] += index
+    formatter = logging.Formatter(
+        f'%(asctime)s [%(levelname)s] [{account["name"]}] %(message)s', datefmt='%Y-%m-%d %H:%M:%S'
+    )
+    for handler in logging.getLogger().handlers:
+        handler.setFormatter(formatter)
+
+
+def run_account(index: int, account: Dict[str, Any]) -> Dict[str, Any]:
+    """Точка входа процесса аккаунта. Исключения не пробрасываются - они попадают в итог."""
+    configure_account(index, account)
+    started = time.monotonic()
+    ok = False
+    error = ''
+    try:
+        ok = cislink_agent.sync_account(f"cislink_agent-{account_slug(account['name'])}")
+    except Exception as e:
+        logger.error(f"Аккаунт завершился с ошибкой: {e}")
+        error = str(e)
+    return {
+        'name': account['name'],
+        'ok': ok,
+        'error': error,
+        'seconds': round(time.monotonic() - started, 1),
+        'profile': get_profile().compact(),
+    }
+
+
+def prepare_driver(accounts: List[Dict[str, Any]]):
+    """
+    Находит chromedriver один раз до запуска процессов и передаёт им через CHROMEDRIVER_PATH,
+    чтобы процессы не скачивали драйвер одновременно.
+    """
+    backend = cislink_agent.CONFIG['scraper_backend']
+    if os.getenv('CHROMEDRIVER_PATH') or all(a.get('scraper_backend', backend) == 'http' for a in accounts):
+        return
+    try:
+        os.environ['CHROMEDRIVER_PATH'] = resolve_driver_path(cislink_agent.CONFIG['state_dir'])
+    except Exception as e:
+        logger.warning(f"chromedriver не найден заранее, процессы аккаунтов ищут его сами: {e}")
+
+
+def log_summary(results: List[Dict[str, Any]], wall: float):
+    logger.info("=" * 78)
+    header = ''.join(f'{title + ", с":>12}' for _, title in SUMMARY_PHASES)
+    logger.info(f"{'аккаунт':<20} {'статус':<7} {'время, с':>9}{header} {'команд WD':>10}")
+    for result in results:
+        phases = result['profile'].get('phases', {})
+        cells = ''.join(
+            f"{phases[name]['sec']:>12.1f}" if name in phases else f"{'-':>12}" for name, _ in SUMMARY_PHASES
+        )
+        status = 'ok' if result['ok'] else 'ошибка'
+        logger.info(
+            f"{result['name']:<20} {status:<7} {result['seconds']:>9.1f}{cells} "
+            f"{result['profile'].get('webdriver_commands', 0):>10}"
+        )
+        if result['error']:
+            logger.info(f"  {result['name']}: {result['error']}")
+    total = sum(result['seconds'] for result in results)
+    failed = sum(1 for result in results if not result['ok'])
+    logger.info("=" * 78)
+    logger.info(
+        f"Аккаунтов: {len(results)}, с ошибкой: {failed}. Общее время {wall:.1f} с, "
+        f"сумма по аккаунтам {total:.1f} с"
+    )
+
+
+def run_accounts(value: str, max_browsers: Optional[int] = None) -> bool:
+    """Запускает все аккаунты из CISLINK_ACCOUNTS. False - если хотя бы один не удался."""
+    try:
+        accounts = load_accounts(value)
+    except Exception as e:
+        logger.error(f"Не удалось прочитать CISLINK_ACCOUNTS: {e}")
+        return False
+    workers = max(1, min(max_browsers or CONFIG['max_browsers'], len(accounts)))
+    logger.info(f"Аккаунтов: {len(accounts)}, одновременно: {workers}")
+    prepare_driver(accounts)
+    started_at = datetime.now()
+    started = time.monotonic()
+    # spawn: у каждого процесса свои CONFIG, регулятор темпа запросов и профиль запуска
+    context = multiprocessing.get_context('spawn')
+    with context.Pool(processes=workers, maxtasksperchild=1) as pool:
+        pending = [pool.apply_async(run_account, (index, account)) for index, account in enumerate(accounts)]
+        results = []
+        for account, task in zip(accounts, pending):
+            try:
+                results.append(task.get())
+            except Exception as e:
+                logger.error(f"Процесс аккаунта {account['name']} упал: {e}")
+                results.append({'name': account['name'], 'ok': False, 'error': str(e), 'seconds': 0.0, 'profile': {}})
+    wall = time.monotonic() - started
+    log_summary(results, wall)
+    if CONFIG['summary_path']:
+        summary = {
+            'started_at': started_at.strftime('%Y-%m-%d %H:%M:%S'),
+            'wall_seconds': round(wall, 1),
+            'max_browsers': workers,
+            'accounts': results,
+        }
+        try:
+            write_atomic(CONFIG['summary_path'], json.dumps(summary, ensure_ascii=False, indent=2))
+        except Exception as e:
+            logger.warning(f"Не удалось записать сводку {CONFIG['summary_path']}: {e}")
+    return all(result['ok'] for result in results)
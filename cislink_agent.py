@@ -5,17 +5,18 @@
 
 import os
 import re
+import sys
 import json
 import time
+import hashlib
 import logging
-from datetime import datetime
-from typing import Optional, Dict, List, Any
+from datetime import datetime, timedelta
+from html.parser import HTMLParser
+from typing import Optional, Dict, List, Any, Iterable, Tuple
+from urllib.parse import urljoin
 
 import requests
-from selenium import webdriver
 from selenium.webdriver.common.by import By
-from selenium.webdriver.chrome.service import Service
-from selenium.webdriver.chrome.options import Options
 from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
 from selenium.common.exceptions import (
@@ -24,7 +25,18 @@ from selenium.common.exceptions import (
     StaleElementReferenceException,
     ElementClickInterceptedException
 )
-from webdriver_manager.chrome import ChromeDriverManager
+
+from cislink_browser import create_driver
+from cislink_delivery import DeliveryClient, drain_outbox
+from cislink_errors import PARSERS, parse_error_details
+from cislink_metrics import PROFILE_PAYLOAD, get_profile, profiled
+from cislink_pacing import get_pacer
+from cislink_session import (
+    ENCRYPTION_AVAILABLE, SessionStore, apply_browser_cookies, apply_session_cookies,
+    check_browser_session, restore_session, save_session, session_cookies
+)
+from cislink_state import ErrorDetailsCache, Outbox, OutboxFull, ReportSnapshot, StateValues
+from cislink_waits import PageWaiter
 
 logging.basicConfig(
     level=logging.INFO,
@@ -34,7 +46,8 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 CONFIG = {
-    'cislink_url': 'https://b2b.cislinkdts.com',
+    # Другой адрес портала, например локальный макет bench/mock_cislink.py
+    'cislink_url': os.getenv('CISLINK_URL', 'https://b2b.cislinkdts.com').rstrip('/'),
     'cislink_login': os.getenv('CISLINK_LOGIN'),
     'cislink_password': os.getenv('CISLINK_PASSWORD'),
     'api_url': os.getenv('API_URL'),
@@ -42,7 +55,66 @@ CONFIG = {
     'debug_mode': os.getenv('DEBUG_MODE', 'False').lower() == 'true',
     'timeout': 30,
     'max_error_text_length': 2000,
-    'max_error_examples': 5
+    'max_error_examples': 5,
+    # fast - однопроходный разбор всех шагов popup-а, legacy - прежний (только первый шаг)
+    'error_parser': os.getenv('ERROR_PARSER', 'fast').lower(),
+    # Способ чтения таблицы gvUploads: js (один execute_script), source (разбор page_source)
+    # или elements (старый поэлементный обход, остаётся запасным вариантом)
+    'table_extraction': os.getenv('TABLE_EXTRACTION', 'js').lower(),
+    # harvest - все popup-ы ошибок за одну загрузку страницы, reload - перезагрузка перед каждым
+    'error_popup_mode': os.getenv('ERROR_POPUP_MODE', 'harvest').lower(),
+    # Локальное состояние между запусками (кэш ошибок и т.п.)
+    'state_dir': os.getenv('STATE_DIR', '.cislink_state'),
+    'error_cache_enabled': os.getenv('ERROR_CACHE', 'True').lower() == 'true',
+    'error_cache_ttl_hours': float(os.getenv('ERROR_CACHE_TTL_HOURS', '72')),
+    'error_cache_max_entries': int(os.getenv('ERROR_CACHE_MAX_ENTRIES', '5000')),
+    # Сколько ждать замены содержимого lblDetails после клика по lnkView
+    'popup_refresh_timeout': 2,
+    # Доставка в API: размер пакета, сжатие, число попыток
+    'api_batch_bytes': int(os.getenv('API_BATCH_BYTES', '1000000')),
+    # gzip тела запроса - только если API его разжимает (иначе сервер ответит 400/422 или success: false)
+    'api_gzip': os.getenv('API_GZIP', 'False').lower() == 'true',
+    'api_max_attempts': int(os.getenv('API_MAX_ATTEMPTS', '5')),
+    # Локальная очередь отправок: отчёты не теряются при недоступности API
+    'outbox_enabled': os.getenv('OUTBOX', 'True').lower() == 'true',
+    # Предел неотправленных записей в очереди (0 - без ограничения); при переполнении
+    # новая отправка не ставится в очередь и запуск завершается ошибкой
+    'outbox_max_entries': int(os.getenv('OUTBOX_MAX_ENTRIES', '0')),
+    # Дельта-синхронизация: отправляются только новые/изменённые/исчезнувшие дистрибьюторы,
+    # полная выгрузка - раз в FULL_SYNC_INTERVAL_HOURS или по FULL_SYNC=true
+    'delta_sync': os.getenv('DELTA_SYNC', 'False').lower() == 'true',
+    'full_sync_interval_hours': float(os.getenv('FULL_SYNC_INTERVAL_HOURS', '24')),
+    'force_full_sync': os.getenv('FULL_SYNC', 'False').lower() == 'true',
+    # Быстрая проверка UploadHistory перед полным сбором: без изменений - выход сразу после навигации.
+    # FORCE_FULL_SCRAPE=true или аргумент --force-full отключают пропуск
+    'change_probe': os.getenv('CHANGE_PROBE', 'True').lower() == 'true',
+    'force_full_scrape': (
+        os.getenv('FORCE_FULL_SCRAPE', 'False').lower() == 'true' or '--force-full' in sys.argv[1:]
+    ),
+    'probe_top_rows': 5,
+    # selenium - Chrome через WebDriver, http - прямые запросы к ASP.NET-формам без браузера
+    'scraper_backend': os.getenv('SCRAPER_BACKEND', 'selenium').lower(),
+    # Повторное использование сессии CISLink (куки + выбор дистрибьюторов) между запусками
+    'session_reuse': os.getenv('SESSION_REUSE', 'True').lower() == 'true',
+    'session_max_age_hours': float(os.getenv('SESSION_MAX_AGE_HOURS', '12')),
+    'session_key': os.getenv('SESSION_KEY'),
+    # Постоянный профиль Chrome (--user-data-dir): кэш статики и куки между запусками
+    'chrome_profile_dir': os.getenv('CHROME_PROFILE_DIR', ''),
+    # Порт DevTools Chrome (0 - не задавать); у аккаунтов CISLINK_ACCOUNTS - свой у каждого
+    'debugging_port': int(os.getenv('CHROME_DEBUGGING_PORT', '9222')),
+    # Несколько аккаунтов CISLink: JSON-список или путь к JSON-файлу (см. cislink_accounts)
+    'accounts': os.getenv('CISLINK_ACCOUNTS', '').strip(),
+    # Ограничение сбора UploadHistory. SCRAPE_SINCE: дата загрузки (ДД.ММ.ГГГГ [ЧЧ:ММ] или
+    # ГГГГ-ММ-ДД [ЧЧ:ММ]), окно в часах ("6h") или last_run - с начала последнего успешного
+    # сбора минус SCRAPE_OVERLAP_MINUTES (запас на расхождение часов агента и портала).
+    # DISTR_INCLUDE/DISTR_EXCLUDE - distr_id или коды дистрибьюторов через запятую,
+    # MAX_REPORT_ROWS - сколько строк собрать (0 - без лимита).
+    # Когда пора делать полную выгрузку или задан FORCE_FULL_SCRAPE, ограничения не действуют
+    'scrape_since': os.getenv('SCRAPE_SINCE', '').strip(),
+    'scrape_overlap_minutes': float(os.getenv('SCRAPE_OVERLAP_MINUTES', '30')),
+    'distr_include': os.getenv('DISTR_INCLUDE', ''),
+    'distr_exclude': os.getenv('DISTR_EXCLUDE', ''),
+    'max_report_rows': int(os.getenv('MAX_REPORT_ROWS', '0')),
 }
 
 SELECTORS = {
@@ -52,51 +124,582 @@ SELECTORS = {
     'close_button_xpath': "//input[@type='button' and @value='Закрыть']"
 }
 
+# Отпечаток таблицы для быстрой проверки изменений: число строк, даты верхних строк, HTML таблицы
+PROBE_TABLE_SCRIPT = """
+    var table = document.getElementById(arguments[0]);
+    if (!table) return null;
+    var top = [];
+    for (var i = 1; i < table.rows.length && top.length < arguments[1]; i++) {
+        var cell = table.rows[i].cells[0];
+        top.push(cell ? (cell.innerText || '').trim() : '');
+    }
+    return {rows: table.rows.length - 1, top: top, html: table.outerHTML};
+"""
+
+# Минимальное число ячеек в строке данных gvUploads
+MIN_REPORT_CELLS = 10
+
+# Снимает всю таблицу за один round trip: тексты ячеек (innerText, как у WebElement.text)
+# и id ссылок в каждой строке. Первая строка (заголовок) пропускается так же,
+# как в поэлементном обходе.
+EXTRACT_TABLE_SCRIPT = """
+    var table = document.getElementById(arguments[0]);
+    if (!table) return null;
+    var result = [];
+    var rows = table.rows;
+    for (var i = 1; i < rows.length; i++) {
+        var row = rows[i];
+        var cells = [];
+        for (var j = 0; j < row.cells.length; j++) {
+            cells.push(row.cells[j].innerText || '');
+        }
+        var links = [];
+        var anchors = row.getElementsByTagName('a');
+        for (var k = 0; k < anchors.length; k++) {
+            links.push({id: anchors[k].id || '', text: anchors[k].innerText || ''});
+        }
+        result.push({cells: cells, links: links});
+    }
+    return result;
+"""
+
+
+class GridHTMLParser(HTMLParser):
+    """
+    Разбирает HTML таблицы по её id: для каждой строки (tr) собирает тексты ячеек
+    и ссылки (id, href, текст). Вложенные таблицы внутри ячеек не порождают новых строк.
+    """
+
+    def __init__(self, table_id: str):
+        super().__init__(convert_charrefs=True)
+        self.table_id = table_id
+        self.rows: List[Dict[str, Any]] = []
+        self.found = False
+        self._depth = 0
+        self._row = None
+        self._cell = None
+        self._link = None
+
+    def handle_starttag(self, tag, attrs):
+        attrs = dict(attrs)
+        if tag == 'table':
+            if self._depth:
+                self._depth += 1
+            elif attrs.get('id') == self.table_id:
+                self.found = True
+                self._depth = 1
+            return
+        if not self._depth:
+            return
+        if tag == 'tr' and self._depth == 1:
+            self._row = {'cells': [], 'links': []}
+        elif tag in ('td', 'th') and self._depth == 1 and self._row is not None:
+            self._cell = []
+        elif tag == 'a' and self._row is not None:
+            self._link = {'id': attrs.get('id') or '', 'href': attrs.get('href') or '', 'text': []}
+        elif tag == 'br' and self._cell is not None:
+            self._cell.append('\n')
+
+    def handle_endtag(self, tag):
+        if not self._depth:
+            return
+        if tag == 'table':
+            self._depth -= 1
+        elif tag == 'a' and self._link is not None:
+            self._link['text'] = ' '.join(''.join(self._link['text']).split())
+            self._row['links'].append(self._link)
+            self._link = None
+        elif tag in ('td', 'th') and self._depth == 1 and self._cell is not None:
+            self._row['cells'].append(' '.join(''.join(self._cell).split()))
+            self._cell = None
+        elif tag == 'tr' and self._depth == 1 and self._row is not None:
+            self.rows.append(self._row)
+            self._row = None
+
+    def handle_data(self, data):
+        if self._cell is not None:
+            self._cell.append(data)
+        if self._link is not None:
+            self._link['text'].append(data)
+
+
+def parse_grid_html(html: str, table_id: str) -> Optional[List[Dict[str, Any]]]:
+    """Возвращает строки таблицы без заголовка или None, если таблицы нет в HTML."""
+    parser = GridHTMLParser(table_id)
+    parser.feed(html)
+    parser.close()
+    if not parser.found:
+        return None
+    return parser.rows[1:]
+
+
+def grid_fingerprint(row_count: int, top: List[str], html: str) -> Dict[str, Any]:
+    return {
+        'rows': row_count,
+        'top': top,
+        'hash': hashlib.sha256(html.encode('utf-8')).hexdigest(),
+    }
+
+
+def has_error_link(links: List[Dict[str, Any]]) -> bool:
+    return any(
+        'lnkView' in (link.get('id') or '') or
+        (link.get('text') or '').strip().lower() == 'error'
+        for link in links
+    )
+
+
+# Цель postback-ссылки: __doPostBack('target','arg') (в т.ч. с экранированными кавычками
+# внутри setTimeout у AutoPostBack-чекбоксов) или WebForm_PostBackOptions("target", "arg", ...)
+POSTBACK_PATTERN = re.compile(
+    r"""(?:__doPostBack\(\s*\\?'([^'\\]*)\\?'\s*,\s*\\?'([^'\\]*)\\?'"""
+    r"""|WebForm_PostBackOptions\(\s*"([^"]*)"\s*,\s*"([^"]*)")"""
+)
+
+# Теги, после которых innerText переносит строку
+BLOCK_TAGS = {'br', 'p', 'div', 'tr', 'table', 'li', 'h1', 'h2', 'h3', 'h4'}
+
+
+def parse_postback(href: str) -> Optional[Tuple[str, str]]:
+    """Достаёт (__EVENTTARGET, __EVENTARGUMENT) из href/onclick postback-ссылки."""
+    match = POSTBACK_PATTERN.search(href or '')
+    if not match:
+        return None
+    if match.group(1) is not None:
+        return match.group(1), match.group(2)
+    return match.group(3), match.group(4)
+
+
+class FormStateParser(HTMLParser):
+    """
+    Собирает состояние первой формы страницы так, как его отправил бы браузер:
+    hidden/text-поля (включая __VIEWSTATE, __EVENTVALIDATION), отмеченные чекбоксы,
+    выбранные значения select. Кнопки в fields не попадают - их добавляет вызывающий код.
+    """
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.action = ''
+        self.fields: Dict[str, str] = {}
+        self.elements: Dict[str, Dict[str, str]] = {}
+        self._in_form = False
+        self._form_done = False
+        self._select = None
+        self._select_value = None
+        self._option = None
+
+    def handle_starttag(self, tag, attrs):
+        attrs = {k: (v if v is not None else '') for k, v in attrs}
+        if tag == 'form' and not self._form_done:
+            self._in_form = True
+            self.action = attrs.get('action', '')
+            return
+        if not self._in_form:
+            return
+        if tag in ('input', 'button', 'select', 'textarea', 'a') and attrs.get('id'):
+            self.elements[attrs['id']] = dict(attrs, tag=tag)
+        name = attrs.get('name')
+        if tag == 'input' and name:
+            input_type = attrs.get('type', 'text').lower()
+            if input_type in ('submit', 'button', 'image', 'reset', 'file'):
+                return
+            if input_type in ('checkbox', 'radio'):
+                if 'checked' in attrs:
+                    self.fields[name] = attrs.get('value') or 'on'
+                return
+            self.fields[name] = attrs.get('value', '')
+        elif tag == 'select' and name:
+            self._select = name
+            self._select_value = None
+        elif tag == 'option' and self._select:
+            value = attrs.get('value')
+            self._option = {'value': value, 'text': [], 'selected': 'selected' in attrs}
+
+    def handle_endtag(self, tag):
+        if tag == 'form' and self._in_form:
+            self._in_form = False
+            self._form_done = True
+        elif tag == 'option' and self._option is not None:
+            value = self._option['value']
+            if value is None:
+                value = ''.join(self._option['text']).strip()
+            if self._option['selected'] or self._select_value is None:
+                self._select_value = value
+                self.fields[self._select] = value
+            self._option = None
+        elif tag == 'select':
+            self._select = None
+
+    def handle_data(self, data):
+        if self._option is not None:
+            self._option['text'].append(data)
+
+
+def parse_form_state(html: str) -> FormStateParser:
+    parser = FormStateParser()
+    parser.feed(html)
+    parser.close()
+    return parser
+
+
+class ElementHTMLParser(HTMLParser):
+    """Достаёт innerHTML и приближённый innerText элемента с заданным id."""
+
+    def __init__(self, element_id: str):
+        super().__init__(convert_charrefs=True)
+        self.element_id = element_id
+        self.found = False
+        self._depth = 0
+        self._html: List[str] = []
+        self._text: List[str] = []
+
+    def handle_starttag(self, tag, attrs):
+        if self._depth:
+            self._html.append(self.get_starttag_text())
+            if tag not in ('br', 'img', 'input', 'hr', 'meta', 'link'):
+                self._depth += 1
+            if tag == 'br':
+                self._text.append('\n')
+            elif tag in ('td', 'th'):
+                self._text.append(' ')
+        elif dict(attrs).get('id') == self.element_id:
+            self.found = True
+            self._depth = 1
+
+    def handle_startendtag(self, tag, attrs):
+        if self._depth:
+            self._html.append(self.get_starttag_text())
+            if tag == 'br':
+                self._text.append('\n')
+
+    def handle_endtag(self, tag):
+        if not self._depth:
+            return
+        self._depth -= 1
+        if self._depth:
+            self._html.append(f'</{tag}>')
+            if tag in BLOCK_TAGS:
+                self._text.append('\n')
+
+    def handle_data(self, data):
+        if self._depth:
+            self._html.append(data.replace('&', '&amp;').replace('<', '&lt;').replace('>', '&gt;'))
+            self._text.append(data)
+
+    @property
+    def inner_html(self) -> str:
+        return ''.join(self._html)
+
+    @property
+    def text(self) -> str:
+        lines = (' '.join(line.split()) for line in ''.join(self._text).split('\n'))
+        return '\n'.join(line for line in lines if line)
+
+
+def parse_element_html(html: str, element_id: str) -> Optional[ElementHTMLParser]:
+    """Возвращает разобранный элемент или None, если элемента с таким id нет."""
+    parser = ElementHTMLParser(element_id)
+    parser.feed(html)
+    parser.close()
+    return parser if parser.found else None
+
+
+def parse_id_list(value: str) -> set:
+    return {item.strip() for item in re.split(r'[,;\s]+', value or '') if item.strip()}
+
+
+def parse_since(value: str, last_run: Optional[str] = None) -> Optional[datetime]:
+    """
+    Начало окна сбора из SCRAPE_SINCE. None - без ограничения по дате
+    (в том числе для last_run, пока не было ни одного успешного сбора).
+    """
+    if not value:
+        return None
+    if value.lower() == 'last_run':
+        if not last_run:
+            return None
+        return datetime.fromisoformat(last_run) - timedelta(minutes=CONFIG['scrape_overlap_minutes'])
+    hours = re.fullmatch(r'(\d+(?:\.\d+)?)\s*h', value.lower())
+    if hours:
+        return datetime.now() - timedelta(hours=float(hours.group(1)))
+    for date_format in ('%d.%m.%Y %H:%M', '%d.%m.%Y', '%Y-%m-%d %H:%M', '%Y-%m-%d'):
+        try:
+            return datetime.strptime(value, date_format)
+        except ValueError:
+            continue
+    logger.warning(f"Не удалось разобрать SCRAPE_SINCE='{value}' - сбор без ограничения по дате")
+    return None
+
+
+class ReportFilter:
+    """
+    Ограничение первого прохода по gvUploads: окно по дате загрузки, белый/чёрный список
+    дистрибьюторов (distr_id или код) и лимит строк. Отфильтрованные строки не попадают
+    в выгрузку и не открываются во втором проходе. Таблица отсортирована по дате загрузки,
+    новые сверху: когда это подтверждено первыми строками, первая строка старше окна
+    завершает обход. Если порядок нарушен, строки просто отфильтровываются до конца таблицы.
+    """
+
+    def __init__(self, since: Optional[datetime] = None, include: Iterable[str] = (),
+                 exclude: Iterable[str] = (), max_rows: int = 0):
+        self.since = since
+        self.include = set(include)
+        self.exclude = set(exclude)
+        self.max_rows = max_rows
+        self.reset()
+
+    def reset(self):
+        self.kept = 0
+        self.skipped = 0
+        self.stopped = False
+        self._previous: Optional[datetime] = None
+        self._descending: Optional[bool] = None
+
+    @property
+    def active(self) -> bool:
+        return bool(self.since or self.include or self.exclude or self.max_rows)
+
+    @property
+    def partial(self) -> bool:
+        """Собрана не вся таблица: по такому сбору нельзя судить об исчезнувших дистрибьюторах."""
+        return self.skipped > 0 or self.stopped
+
+    def describe(self) -> str:
+        parts = []
+        if self.since:
+            parts.append(f"с {self.since:%d.%m.%Y %H:%M}")
+        if self.include:
+            parts.append(f"только {len(self.include)} дистрибьюторов")
+        if self.exclude:
+            parts.append(f"кроме {len(self.exclude)} дистрибьюторов")
+        if self.max_rows:
+            parts.append(f"не больше {self.max_rows} строк")
+        return ', '.join(parts) or 'без ограничений'
+
+    @staticmethod
+    def _uploaded(report: Dict[str, Any]) -> Optional[datetime]:
+        return datetime.fromisoformat(report['upload_datetime']) if report.get('upload_datetime') else None
+
+    def exhausted(self, report: Dict[str, Any]) -> bool:
+        """Дальше по таблице подходящих строк нет (лимит набран или начались старые загрузки)."""
+        if self.max_rows and self.kept >= self.max_rows:
+            self.stopped = True
+            return True
+        uploaded = self._uploaded(report)
+        if self.since is None or uploaded is None:
+            return False
+        if self._previous is not None and self._descending is not False:
+            self._descending = uploaded <= self._previous
+        self._previous = uploaded
+        if self._descending and uploaded < self.since:
+            self.stopped = True
+        return self.stopped
+
+    def matches(self, report: Dict[str, Any]) -> bool:
+        keys = {str(report['distr_id']), report['distr_code']}
+        uploaded = self._uploaded(report)
+        if (
+            (self.include and not keys & self.include) or keys & self.exclude or
+            (self.since and uploaded and uploaded < self.since)
+        ):
+            self.skipped += 1
+            return False
+        self.kept += 1
+        return True
+
+
+class BaseCISLinkScraper:
+    """Общая для всех бэкендов часть: разбор строк gvUploads, текста ошибок и кэш ошибок."""
+
+    def __init__(self):
+        self.error_cache = None
+        self.distributors_selected = False
+        self.pacer = get_pacer()
+        self.profile = get_profile()
+        self.report_filter = ReportFilter()
+        if CONFIG['error_cache_enabled']:
+            try:
+                self.error_cache = ErrorDetailsCache(
+                    CONFIG['state_dir'],
+                    ttl_seconds=CONFIG['error_cache_ttl_hours'] * 3600,
+                    max_entries=CONFIG['error_cache_max_entries']
+                )
+            except Exception as e:
+                logger.warning(f"Кэш ошибок недоступен: {e}")
+
+    def apply_error_cache(self, reports: list, error_rows: List[Tuple[int, int]]) -> List[Tuple[int, int]]:
+        """
+        Заполняет report['errors'] из кэша. Возвращает строки, которых в кэше нет -
+        только для них нужно открывать popup.
+        """
+        if not self.error_cache or not error_rows:
+            return error_rows
+        pending = []
+        for report_index, row_index in error_rows:
+            cached = self.error_cache.get(reports[report_index])
+            if cached:
+                reports[report_index]['errors'] = cached
+            else:
+                pending.append((report_index, row_index))
+        logger.info(
+            f"Кэш ошибок: попаданий {self.error_cache.hits}, промахов {self.error_cache.misses}"
+        )
+        return pending
+
+    def store_error_cache(self, reports: list, error_rows: List[Tuple[int, int]]):
+        if not self.error_cache:
+            return
+        try:
+            for report_index, _ in error_rows:
+                if reports[report_index]['errors']:
+                    self.error_cache.put(reports[report_index], reports[report_index]['errors'])
+            removed = self.error_cache.evict()
+            if removed:
+                logger.info(f"Кэш ошибок: удалено устаревших записей {removed}")
+        except Exception as e:
+            logger.warning(f"Не удалось обновить кэш ошибок: {e}")
+
+    def close_error_cache(self):
+        if self.error_cache:
+            self.error_cache.close()
+            self.error_cache = None
+
+    def parse_date(self, date_str: str) -> Optional[str]:
+        if not date_str or date_str.strip() == '':
+            return None
+        try:
+            date_str = date_str.strip()
+            if ' ' in date_str:
+                dt = datetime.strptime(date_str, '%d.%m.%Y %H:%M')
+                return dt.strftime('%Y-%m-%d %H:%M:%S')
+            else:
+                dt = datetime.strptime(date_str, '%d.%m.%Y')
+                return dt.strftime('%Y-%m-%d')
+        except ValueError:
+            return None
+
+    def parse_int(self, value: str) -> Optional[int]:
+        if not value or value.strip() == '':
+            return None
+        try:
+            return int(value.strip())
+        except ValueError:
+            return None
+
+    def parse_error_structure(self, raw_text: str, raw_html: str) -> Dict[str, Any]:
+        parse = PARSERS.get(CONFIG['error_parser'], parse_error_details)
+        return parse(
+            raw_text, raw_html,
+            max_examples=CONFIG['max_error_examples'],
+            max_text_length=CONFIG['max_error_text_length']
+        )
+
+    def build_report(self, cells: List[str]) -> Tuple[Optional[Dict[str, Any]], bool]:
+        """
+        Собирает словарь отчёта из текстов ячеек строки gvUploads.
+        Возвращает (report, is_error); report = None, если в строке нет distr_id.
+        """
+        upload_status_text = cells[1].strip().lower()
+        is_error = 'неудачн' in upload_status_text
+        is_success = 'удачн' in upload_status_text and not is_error
+        upload_status = 'success' if is_success else 'error'
+        distr_id = self.parse_int(cells[4])
+        if not distr_id:
+            return None, is_error
+        report = {
+            'distr_id': distr_id,
+            'distr_code': cells[3].strip(),
+            'distr_name': cells[5].strip(),
+            'city': cells[6].strip(),
+            'upload_datetime': self.parse_date(cells[0]),
+            'upload_status': upload_status,
+            'connection_type': cells[11].strip() if len(cells) > 11 else '',
+            'error_file_type': cells[2].strip() if is_error else '',
+            'doc_max_date': self.parse_date(cells[7]),
+            'doc_period': self.parse_int(cells[8]),
+            'stock_max_date': self.parse_date(cells[9]),
+            'stock_period': self.parse_int(cells[10]) if len(cells) > 10 else None,
+            'errors': None
+        }
+        return report, is_error
 
-class CISLinkScraper:
+    def collect_reports(self, rows: List[Dict[str, Any]]) -> Tuple[list, List[Tuple[int, int]]]:
+        """
+        Первый проход: строки таблицы -> отчёты (с учётом self.report_filter).
+        Возвращает (reports, error_rows), где error_rows - пары (индекс отчёта, индекс строки)
+        для строк с ссылкой на popup ошибки.
+        """
+        reports = []
+        error_rows = []
+        report_filter = self.report_filter
+        report_filter.reset()
+        for row_index, row in enumerate(rows):
+            try:
+                cells = row['cells']
+                if len(cells) < MIN_REPORT_CELLS:
+                    continue
+                report, is_error = self.build_report(cells)
+                if report and report_filter.active:
+                    if report_filter.exhausted(report):
+                        logger.info(f"Обход таблицы остановлен на строке {row_index} из {len(rows)}")
+                        break
+                    if not report_filter.matches(report):
+                        continue
+                if report:
+                    reports.append(report)
+                    if is_error and has_error_link(row['links']):
+                        error_rows.append((len(reports) - 1, row_index))
+            except Exception as e:
+                logger.debug(f"Ошибка обработки строки {row_index}: {e}")
+                continue
+        if report_filter.active:
+            logger.info(
+                f"Ограничение сбора ({report_filter.describe()}): собрано {report_filter.kept}, "
+                f"пропущено {report_filter.skipped}"
+            )
+        return reports, error_rows
+
+
+class CISLinkScraper(BaseCISLinkScraper):
     def __init__(self):
+        super().__init__()
         self.driver = None
         self.wait = None
+        self.waiter = None
+        self.owns_driver = True
 
     def init_browser(self):
         logger.info("Инициализация браузера...")
-        options = Options()
-        if not CONFIG['debug_mode']:
-            options.add_argument('--headless=new')
-        options.add_argument('--no-sandbox')
-        options.add_argument('--disable-dev-shm-usage')
-        options.add_argument('--disable-gpu')
-        options.add_argument('--window-size=1920,1080')
-        options.add_argument('--disable-blink-features=AutomationControlled')
-        options.add_experimental_option('excludeSwitches', ['enable-automation'])
-        options.add_experimental_option('useAutomationExtension', False)
-        options.add_argument('--lang=ru-RU')
-        options.add_argument('--disable-extensions')
-        options.add_argument('--disable-infobars')
-        options.add_argument('--remote-debugging-port=9222')
-
-        service = Service(ChromeDriverManager().install())
-        self.driver = webdriver.Chrome(service=service, options=options)
-        self.driver.execute_script("Object.defineProperty(navigator, 'webdriver', {get: () => undefined})")
+        self.use_driver(create_driver(
+            headless=not CONFIG['debug_mode'], debugging_port=CONFIG['debugging_port'],
+            profile_dir=CONFIG['chrome_profile_dir'], state_dir=CONFIG['state_dir']
+        ))
+        logger.info(f"Браузер запущен (профиль ожиданий: {self.waiter.profile})")
+
+    def use_driver(self, driver, owned: bool = True):
+        """Работа на готовом драйвере; owned=False - драйвер общий и close() его не закрывает."""
+        self.driver = driver
+        self.owns_driver = owned
         self.wait = WebDriverWait(self.driver, CONFIG['timeout'])
-        logger.info("Браузер запущен")
+        self.waiter = PageWaiter(self.driver)
 
+    @profiled('login')
     def login(self) -> bool:
         logger.info("Авторизация в CISLink...")
         try:
             self.driver.get(CONFIG['cislink_url'])
-            time.sleep(3)
+            self.waiter.page_ready(legacy=3)
             login_field = self.wait.until(EC.presence_of_element_located((By.ID, "txtLogin")))
             password_field = self.driver.find_element(By.ID, "txtPassword")
             login_field.clear()
-            time.sleep(0.5)
+            self.waiter.pause(0.5)
             login_field.send_keys(CONFIG['cislink_login'])
             password_field.clear()
-            time.sleep(0.5)
+            self.waiter.pause(0.5)
             password_field.send_keys(CONFIG['cislink_password'])
             login_button = self.driver.find_element(By.ID, "btnEnter")
             login_button.click()
-            time.sleep(5)
+            self.waiter.postback_complete(login_button, legacy=5)
             current_url = self.driver.current_url
             logger.info(f"URL после входа: {current_url}")
             if "Default.aspx" in current_url or "Dictionary" in current_url:
@@ -107,20 +710,37 @@ class CISLinkScraper:
             logger.error(f"Ошибка авторизации: {e}")
             return False
 
+    def apply_cookies(self, cookies: List[Dict[str, Any]]):
+        apply_browser_cookies(self.driver, cookies, CONFIG['cislink_url'])
+
+    def export_cookies(self) -> List[Dict[str, Any]]:
+        return self.driver.get_cookies()
+
+    def check_session(self) -> Optional[bool]:
+        return check_browser_session(
+            self.driver, self.waiter, f"{CONFIG['cislink_url']}/Dictionary/Default.aspx", "cbDistrs"
+        )
+
+    @profiled('navigate_to_reports')
     def navigate_to_reports(self) -> bool:
         logger.info("Переход на страницу отчетов...")
         try:
-            self.driver.get(f"{CONFIG['cislink_url']}/Dictionary/Default.aspx")
-            time.sleep(3)
-            try:
-                select_all = self.driver.find_element(By.ID, "cbDistrs")
-                if not select_all.is_selected():
-                    select_all.click()
-                    time.sleep(1)
-            except NoSuchElementException:
-                pass
+            # В восстановленной сессии дистрибьюторы уже выбраны - страница выбора не нужна
+            if not self.distributors_selected:
+                if '/Dictionary/Default.aspx' not in self.driver.current_url:
+                    self.driver.get(f"{CONFIG['cislink_url']}/Dictionary/Default.aspx")
+                    self.waiter.page_ready(legacy=3)
+                try:
+                    select_all = self.driver.find_element(By.ID, "cbDistrs")
+                    if not select_all.is_selected():
+                        self.waiter.watch_navigation()
+                        select_all.click()
+                        self.waiter.checkbox_applied(select_all, "cbDistrs", True, legacy=1)
+                    self.distributors_selected = True
+                except NoSuchElementException:
+                    pass
             self.driver.get(f"{CONFIG['cislink_url']}/Reports/UploadHistory.aspx")
-            time.sleep(3)
+            self.waiter.page_ready(legacy=3)
             return True
         except Exception as e:
             logger.error(f"Ошибка навигации: {e}")
@@ -129,79 +749,13 @@ class CISLinkScraper:
     def reload_reports_page(self) -> bool:
         try:
             self.driver.get(f"{CONFIG['cislink_url']}/Reports/UploadHistory.aspx")
-            time.sleep(3)
+            self.waiter.page_ready(legacy=3)
             self.wait.until(EC.presence_of_element_located((By.ID, SELECTORS['table'])))
             return True
         except Exception as e:
             logger.error(f"Ошибка перезагрузки страницы: {e}")
             return False
 
-    def parse_date(self, date_str: str) -> Optional[str]:
-        if not date_str or date_str.strip() == '':
-            return None
-        try:
-            date_str = date_str.strip()
-            if ' ' in date_str:
-                dt = datetime.strptime(date_str, '%d.%m.%Y %H:%M')
-                return dt.strftime('%Y-%m-%d %H:%M:%S')
-            else:
-                dt = datetime.strptime(date_str, '%d.%m.%Y')
-                return dt.strftime('%Y-%m-%d')
-        except ValueError:
-            return None
-
-    def parse_int(self, value: str) -> Optional[int]:
-        if not value or value.strip() == '':
-            return None
-        try:
-            return int(value.strip())
-        except ValueError:
-            return None
-
-    def parse_error_structure(self, raw_text: str, raw_html: str) -> Dict[str, Any]:
-        result = {
-            'raw_text': raw_text[:CONFIG['max_error_text_length']] if raw_text else '',
-            'errors': []
-        }
-        if not raw_text:
-            return result
-        step_pattern = r'Шаг\s+(\d+):\s*(.+?)(?=\(pd|$)'
-        file_pattern = r'\((pd\w+)(?:\.txt|\.dbf)?\)'
-        step_match = re.search(step_pattern, raw_text)
-        file_matches = re.findall(file_pattern, raw_text)
-        error_info = {
-            'step': f"Шаг {step_match.group(1)}" if step_match else None,
-            'file': file_matches[0] if file_matches else None,
-            'message': step_match.group(2).strip() if step_match else raw_text[:200],
-            'fields': [],
-            'count': 0,
-            'is_truncated': '(список неполный)' in raw_text or '...' in raw_text,
-            'examples': []
-        }
-        if raw_html and '<table' in raw_html:
-            try:
-                headers = re.findall(r'<td[^>]*>([^<]+)</td>', raw_html.split('</tr>')[0] if '</tr>' in raw_html else '')
-                if headers:
-                    error_info['fields'] = [h.strip() for h in headers if h.strip()]
-                rows = raw_html.split('</tr>')[1:]
-                example_count = 0
-                for row in rows:
-                    if example_count >= CONFIG['max_error_examples']:
-                        break
-                    cells = re.findall(r'<td[^>]*>([^<]*)</td>', row)
-                    if cells and len(cells) == len(error_info['fields']):
-                        example = {}
-                        for i, field in enumerate(error_info['fields']):
-                            example[field] = cells[i].strip()
-                        if any(example.values()):
-                            error_info['examples'].append(example)
-                            example_count += 1
-                error_info['count'] = len(rows) - 1
-            except Exception as e:
-                logger.debug(f"Ошибка парсинга таблицы: {e}")
-        result['errors'].append(error_info)
-        return result
-
     def fetch_error_details(self, row_index: int) -> Optional[Dict[str, Any]]:
         try:
             row_id = str(row_index + 2).zfill(2)
@@ -233,11 +787,11 @@ class CISLinkScraper:
                 return None
             try:
                 self.driver.execute_script("arguments[0].scrollIntoView(true);", error_link)
-                time.sleep(0.5)
+                self.waiter.pause(0.5)
                 error_link.click()
             except ElementClickInterceptedException:
                 self.driver.execute_script("arguments[0].click();", error_link)
-            time.sleep(2)
+            self.waiter.element_visible(SELECTORS['error_details'], legacy=2)
             try:
                 details_element = WebDriverWait(self.driver, 10).until(
                     EC.presence_of_element_located((By.ID, SELECTORS['error_details']))
@@ -256,11 +810,89 @@ class CISLinkScraper:
             self.close_error_popup()
             return None
 
+    def read_error_popup(self, row_index: int) -> Optional[Dict[str, Any]]:
+        """
+        Открывает popup ошибки строки без перезагрузки страницы и читает lblDetails.
+        Ссылка ищется заново по стабильному id ctl{NN}_lnkView, поэтому устаревшие
+        после postback-а элементы не мешают. Исключения Selenium пробрасываются наружу:
+        по ним вызывающий код понимает, что DOM сломан и нужна перезагрузка.
+        """
+        row_id = str(row_index + 2).zfill(2)
+        error_link = self.driver.find_element(By.ID, SELECTORS['error_link_template'].format(row_id=row_id))
+        previous = self.driver.find_elements(By.ID, SELECTORS['error_details'])
+        previous_text = previous[0].text if previous else None
+        try:
+            self.driver.execute_script("arguments[0].scrollIntoView(true);", error_link)
+            error_link.click()
+        except ElementClickInterceptedException:
+            self.driver.execute_script("arguments[0].click();", error_link)
+        if previous:
+            try:
+                WebDriverWait(self.driver, CONFIG['popup_refresh_timeout']).until(
+                    lambda d: self._popup_refreshed(previous[0], previous_text)
+                )
+            except TimeoutException:
+                # Текст ошибки совпал с предыдущим popup-ом - читаем как есть
+                pass
+        details_element = WebDriverWait(self.driver, 10).until(
+            EC.visibility_of_element_located((By.ID, SELECTORS['error_details']))
+        )
+        raw_text = details_element.text.strip()
+        raw_html = details_element.get_attribute('innerHTML')
+        logger.info(f"Получены детали ошибки для строки {row_index}: {raw_text[:100]}...")
+        self.close_error_popup()
+        return self.parse_error_structure(raw_text, raw_html)
+
+    @staticmethod
+    def _popup_refreshed(previous_element, previous_text: str) -> bool:
+        try:
+            return previous_element.text != previous_text
+        except StaleElementReferenceException:
+            return True
+
+    def harvest_error_details(self, reports: list, error_rows: List[Tuple[int, int]]) -> int:
+        """
+        Второй проход в режиме harvest: все popup-ы за одну загрузку UploadHistory.
+        Страница перезагружается только если DOM действительно сломался
+        (ссылка пропала, элемент устарел, popup не открылся), после чего строка
+        повторяется один раз. Возвращает число избежанных перезагрузок.
+        """
+        reloads = 0
+        for report_index, row_index in error_rows:
+            for attempt in range(2):
+                self.pacer.pause()
+                started = time.monotonic()
+                try:
+                    error_details = self.read_error_popup(row_index)
+                    self.pacer.observe(time.monotonic() - started)
+                    if error_details:
+                        reports[report_index]['errors'] = error_details
+                        logger.info(f"Ошибка для {reports[report_index]['distr_name']}: получена")
+                    break
+                except (NoSuchElementException, StaleElementReferenceException, TimeoutException) as e:
+                    self.pacer.observe(time.monotonic() - started, ok=False)
+                    self.close_error_popup()
+                    if attempt:
+                        logger.warning(f"Не удалось получить детали для строки {row_index}: {type(e).__name__}")
+                        break
+                    logger.debug(f"DOM изменился на строке {row_index} ({type(e).__name__}), перезагружаем страницу")
+                    reloads += 1
+                    if not self.reload_reports_page():
+                        logger.warning(f"Не удалось перезагрузить страницу для строки {row_index}")
+                        break
+                except Exception as e:
+                    logger.error(f"Ошибка парсинга деталей для строки {row_index}: {e}")
+                    self.close_error_popup()
+                    break
+        avoided = len(error_rows) - reloads
+        logger.info(f"Перезагрузок страницы: {reloads}, избежано: {avoided} из {len(error_rows)}")
+        return avoided
+
     def close_error_popup(self):
         try:
             close_button = self.driver.find_element(By.XPATH, SELECTORS['close_button_xpath'])
             close_button.click()
-            time.sleep(1)
+            self.waiter.element_hidden(SELECTORS['error_details'], legacy=1)
             return
         except NoSuchElementException:
             pass
@@ -269,147 +901,651 @@ class CISLinkScraper:
             for btn in buttons:
                 if btn.get_attribute('value') in ['Закрыть', 'Close', 'OK']:
                     btn.click()
-                    time.sleep(1)
+                    self.waiter.element_hidden(SELECTORS['error_details'], legacy=1)
                     return
         except Exception:
             pass
         try:
             from selenium.webdriver.common.keys import Keys
             self.driver.find_element(By.TAG_NAME, 'body').send_keys(Keys.ESCAPE)
-            time.sleep(1)
+            self.waiter.element_hidden(SELECTORS['error_details'], legacy=1)
         except Exception:
             pass
 
+    def extract_rows_js(self) -> Optional[List[Dict[str, Any]]]:
+        """Вся таблица за один execute_script."""
+        return self.driver.execute_script(EXTRACT_TABLE_SCRIPT, SELECTORS['table'])
+
+    def extract_rows_source(self) -> Optional[List[Dict[str, Any]]]:
+        """Вся таблица разбором page_source без обращений к элементам."""
+        return parse_grid_html(self.driver.page_source, SELECTORS['table'])
+
+    def extract_rows_elements(self) -> Optional[List[Dict[str, Any]]]:
+        """Поэлементный обход: по запросу WebDriver на каждую ячейку и ссылку."""
+        try:
+            main_table = self.driver.find_element(By.ID, SELECTORS['table'])
+        except NoSuchElementException:
+            tables = self.driver.find_elements(By.TAG_NAME, "table")
+            main_table = max(tables, key=lambda t: len(t.find_elements(By.TAG_NAME, "tr")), default=None)
+        if not main_table:
+            return None
+        rows = []
+        for row_index, row in enumerate(main_table.find_elements(By.TAG_NAME, "tr")[1:]):
+            try:
+                cells = row.find_elements(By.TAG_NAME, "td")
+                if len(cells) < MIN_REPORT_CELLS:
+                    rows.append({'cells': [], 'links': []})
+                    continue
+                links = []
+                if 'неудачн' in cells[1].text.lower():
+                    links = [
+                        {'id': link.get_attribute('id') or '', 'text': link.text}
+                        for link in row.find_elements(By.TAG_NAME, "a")
+                    ]
+                rows.append({'cells': [cell.text for cell in cells], 'links': links})
+            except Exception as e:
+                logger.debug(f"Ошибка обработки строки {row_index}: {e}")
+                rows.append({'cells': [], 'links': []})
+        return rows
+
+    def extract_rows(self) -> Optional[List[Dict[str, Any]]]:
+        """
+        Читает строки gvUploads способом из CONFIG['table_extraction'].
+        При ошибке или отсутствии таблицы откатывается на поэлементный обход.
+        """
+        mode = CONFIG['table_extraction']
+        extractors = {'js': self.extract_rows_js, 'source': self.extract_rows_source}
+        if mode in extractors:
+            try:
+                rows = extractors[mode]()
+                if rows is not None:
+                    return rows
+                logger.warning(f"Таблица не найдена в режиме '{mode}', переходим к поэлементному обходу")
+            except Exception as e:
+                logger.warning(f"Ошибка чтения таблицы в режиме '{mode}': {e}, переходим к поэлементному обходу")
+        return self.extract_rows_elements()
+
+    def probe_fingerprint(self) -> Optional[Dict[str, Any]]:
+        """Отпечаток gvUploads одним execute_script (None - таблица не найдена)."""
+        self.waiter.page_ready(legacy=2)
+        probe = self.driver.execute_script(PROBE_TABLE_SCRIPT, SELECTORS['table'], CONFIG['probe_top_rows'])
+        if not probe:
+            return None
+        return grid_fingerprint(probe['rows'], probe['top'], probe['html'])
+
+    @profiled('scrape_reports')
     def scrape_reports(self) -> list:
         logger.info("Сбор данных из таблицы...")
         reports = []
         error_rows = []
         try:
-            time.sleep(2)
-            try:
-                main_table = self.driver.find_element(By.ID, SELECTORS['table'])
-            except NoSuchElementException:
-                tables = self.driver.find_elements(By.TAG_NAME, "table")
-                main_table = max(tables, key=lambda t: len(t.find_elements(By.TAG_NAME, "tr")), default=None)
-            if not main_table:
-                logger.error("Таблица отчётов не найдена")
-                return []
-            rows = main_table.find_elements(By.TAG_NAME, "tr")[1:]
-            logger.info(f"Найдено {len(rows)} строк в таблице")
-            for row_index, row in enumerate(rows):
-                try:
-                    cells = row.find_elements(By.TAG_NAME, "td")
-                    if len(cells) < 10:
-                        continue
-                    upload_status_text = cells[1].text.strip().lower()
-                    is_error = 'неудачн' in upload_status_text
-                    is_success = 'удачн' in upload_status_text and not is_error
-                    upload_status = 'success' if is_success else 'error'
-                    stock_max_date = self.parse_date(cells[9].text)
-                    distr_id = self.parse_int(cells[4].text)
-                    if distr_id:
-                        report = {
-                            'distr_id': distr_id,
-                            'distr_code': cells[3].text.strip(),
-                            'distr_name': cells[5].text.strip(),
-                            'city': cells[6].text.strip(),
-                            'upload_datetime': self.parse_date(cells[0].text),
-                            'upload_status': upload_status,
-                            'connection_type': cells[11].text.strip() if len(cells) > 11 else '',
-                            'error_file_type': cells[2].text.strip() if is_error else '',
-                            'doc_max_date': self.parse_date(cells[7].text),
-                            'doc_period': self.parse_int(cells[8].text),
-                            'stock_max_date': stock_max_date,
-                            'stock_period': self.parse_int(cells[10].text) if len(cells) > 10 else None,
-                            'errors': None
-                        }
-                        reports.append(report)
-                        if is_error:
-                            try:
-                                links = row.find_elements(By.TAG_NAME, "a")
-                                has_error_link = any(
-                                    'lnkView' in (link.get_attribute('id') or '') or
-                                    link.text.strip().lower() == 'error'
-                                    for link in links
-                                )
-                                if has_error_link:
-                                    error_rows.append((len(reports) - 1, row_index))
-                            except Exception:
-                                pass
-                except Exception as e:
-                    logger.debug(f"Ошибка обработки строки {row_index}: {e}")
-                    continue
-            logger.info(f"Первый проход: собрано {len(reports)} записей, {len(error_rows)} с ошибками")
-            if error_rows:
-                logger.info(f"Второй проход: парсинг {len(error_rows)} ошибок...")
-                for report_index, row_index in error_rows:
-                    try:
-                        if not self.reload_reports_page():
-                            logger.warning(f"Не удалось перезагрузить страницу для строки {row_index}")
+            with self.profile.phase('scrape_reports.pass1'):
+                self.waiter.page_ready(legacy=2)
+                rows = self.extract_rows()
+                if rows is None:
+                    logger.error("Таблица отчётов не найдена")
+                    return []
+                logger.info(f"Найдено {len(rows)} строк в таблице")
+                reports, error_rows = self.collect_reports(rows)
+                logger.info(f"Первый проход: собрано {len(reports)} записей, {len(error_rows)} с ошибками")
+                error_rows = self.apply_error_cache(reports, error_rows)
+                self.profile.switch('scrape_reports.pass2')
+                if error_rows and CONFIG['error_popup_mode'] == 'harvest':
+                    logger.info(f"Второй проход: парсинг {len(error_rows)} ошибок без перезагрузок...")
+                    self.harvest_error_details(reports, error_rows)
+                    logger.info(f"Второй проход завершён")
+                elif error_rows:
+                    logger.info(f"Второй проход: парсинг {len(error_rows)} ошибок...")
+                    for report_index, row_index in error_rows:
+                        try:
+                            if not self.reload_reports_page():
+                                logger.warning(f"Не удалось перезагрузить страницу для строки {row_index}")
+                                continue
+                            error_details = self.fetch_error_details(row_index)
+                            if error_details:
+                                reports[report_index]['errors'] = error_details
+                                logger.info(f"Ошибка для {reports[report_index]['distr_name']}: получена")
+                            else:
+                                logger.debug(f"Детали ошибки не найдены для строки {row_index}")
+                        except Exception as e:
+                            logger.error(f"Ошибка парсинга деталей для строки {row_index}: {e}")
                             continue
+                    logger.info(f"Второй проход завершён")
+                self.store_error_cache(reports, error_rows)
+                logger.info(f"Всего собрано {len(reports)} записей")
+        except Exception as e:
+            logger.error(f"Ошибка сбора данных: {e}")
+        return reports
+
+    def close(self):
+        self.close_error_cache()
+        if self.driver and self.owns_driver:
+            self.driver.quit()
+
+
+class CISLinkHTTPScraper(BaseCISLinkScraper):
+    """
+    Бэкенд без браузера: те же шаги, что и у CISLinkScraper, но ASP.NET-формы
+    (логин, выбор дистрибьюторов, postback-и lnkView) отправляются напрямую
+    через requests.Session с переносом __VIEWSTATE/__EVENTVALIDATION между страницами.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.session = None
+        self.page_url = ''
+        self.page_html = ''
+        self.rows: List[Dict[str, Any]] = []
+
+    def init_browser(self):
+        """Браузер не нужен - создаём HTTP-сессию (имя метода общее с CISLinkScraper)."""
+        logger.info("Инициализация HTTP-сессии...")
+        self.session = requests.Session()
+        self.session.headers.update({
+            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 '
+                          '(KHTML, like Gecko) Chrome/120.0 Safari/537.36',
+            'Accept-Language': 'ru-RU,ru;q=0.9',
+        })
+        logger.info("HTTP-сессия создана")
+
+    def _get(self, url: str) -> requests.Response:
+        response = self.session.get(url, timeout=CONFIG['timeout'])
+        response.raise_for_status()
+        self.page_url, self.page_html = response.url, response.text
+        return response
+
+    def _post_form(self, overrides: Dict[str, str], event_target: str = '',
+                   event_argument: str = '') -> requests.Response:
+        """Отправляет форму текущей страницы с переопределёнными полями (postback)."""
+        form = parse_form_state(self.page_html)
+        data = dict(form.fields)
+        data['__EVENTTARGET'] = event_target
+        data['__EVENTARGUMENT'] = event_argument
+        data.update(overrides)
+        url = urljoin(self.page_url, form.action or self.page_url)
+        response = self.session.post(url, data=data, headers={'Referer': self.page_url},
+                                     timeout=CONFIG['timeout'])
+        response.raise_for_status()
+        return response
+
+    def _submit_overrides(self, form: FormStateParser, element_id: str) -> Tuple[Dict[str, str], str]:
+        """Поля и __EVENTTARGET для нажатия кнопки/ссылки с заданным id."""
+        element = form.elements.get(element_id, {})
+        name = element.get('name') or element_id
+        input_type = element.get('type', '').lower()
+        if element.get('tag') == 'input' and input_type == 'image':
+            return {f'{name}.x': '1', f'{name}.y': '1'}, ''
+        postback = parse_postback(element.get('href', '') + element.get('onclick', ''))
+        if postback:
+            return {}, postback[0]
+        if element.get('tag') in ('input', 'button'):
+            return {name: element.get('value', '')}, ''
+        return {}, name
+
+    @profiled('login')
+    def login(self) -> bool:
+        logger.info("Авторизация в CISLink (HTTP)...")
+        try:
+            self._get(CONFIG['cislink_url'])
+            form = parse_form_state(self.page_html)
+            if 'txtLogin' not in form.elements or 'txtPassword' not in form.elements:
+                logger.error("Форма входа не найдена")
+                return False
+            overrides, event_target = self._submit_overrides(form, 'btnEnter')
+            overrides[form.elements['txtLogin'].get('name', 'txtLogin')] = CONFIG['cislink_login']
+            overrides[form.elements['txtPassword'].get('name', 'txtPassword')] = CONFIG['cislink_password']
+            response = self._post_form(overrides, event_target)
+            self.page_url, self.page_html = response.url, response.text
+            logger.info(f"URL после входа: {response.url}")
+            if "Default.aspx" in response.url or "Dictionary" in response.url:
+                logger.info("Авторизация успешна!")
+                return True
+            return False
+        except Exception as e:
+            logger.error(f"Ошибка авторизации: {e}")
+            return False
+
+    def apply_cookies(self, cookies: List[Dict[str, Any]]):
+        apply_session_cookies(self.session, cookies)
+
+    def export_cookies(self) -> List[Dict[str, Any]]:
+        return session_cookies(self.session)
+
+    def check_session(self) -> Optional[bool]:
+        self._get(f"{CONFIG['cislink_url']}/Dictionary/Default.aspx")
+        form = parse_form_state(self.page_html)
+        if 'txtLogin' in form.elements or 'Dictionary' not in self.page_url:
+            return None
+        checkbox = form.elements.get('cbDistrs')
+        return bool(checkbox) and 'checked' in checkbox
+
+    @profiled('navigate_to_reports')
+    def navigate_to_reports(self) -> bool:
+        logger.info("Переход на страницу отчетов (HTTP)...")
+        try:
+            if not self.distributors_selected:
+                # Страница уже открыта проверкой восстановленной сессии
+                if '/Dictionary/Default.aspx' not in self.page_url:
+                    self._get(f"{CONFIG['cislink_url']}/Dictionary/Default.aspx")
+                form = parse_form_state(self.page_html)
+                checkbox = form.elements.get('cbDistrs')
+                if checkbox and 'checked' not in checkbox:
+                    name = checkbox.get('name', 'cbDistrs')
+                    postback = parse_postback(checkbox.get('onclick', ''))
+                    response = self._post_form({name: checkbox.get('value') or 'on'},
+                                               postback[0] if postback else name)
+                    self.page_url, self.page_html = response.url, response.text
+                self.distributors_selected = bool(checkbox)
+            return self.reload_reports_page()
+        except Exception as e:
+            logger.error(f"Ошибка навигации: {e}")
+            return False
+
+    def reload_reports_page(self) -> bool:
+        try:
+            self._get(f"{CONFIG['cislink_url']}/Reports/UploadHistory.aspx")
+            return True
+        except Exception as e:
+            logger.error(f"Ошибка перезагрузки страницы: {e}")
+            return False
+
+    def fetch_error_details(self, row_index: int) -> Optional[Dict[str, Any]]:
+        """
+        Отправляет postback ссылки lnkView строки и читает lblDetails из ответа.
+        Состояние формы берётся со страницы UploadHistory, поэтому перезагрузка между
+        строками не нужна: каждый postback выполняется от одной и той же страницы.
+        """
+        try:
+            links = self.rows[row_index]['links'] if row_index < len(self.rows) else []
+            postback = None
+            for link in links:
+                if 'lnkView' in link.get('id', '') or link.get('text', '').strip().lower() == 'error':
+                    postback = parse_postback(link.get('href', ''))
+                    if postback:
+                        break
+            if not postback:
+                logger.debug(f"Postback ссылки Error не найден для строки {row_index}")
+                return None
+            self.pacer.pause()
+            started = time.monotonic()
+            try:
+                response = self._post_form({}, *postback)
+            except Exception:
+                self.pacer.observe(time.monotonic() - started, ok=False)
+                raise
+            self.pacer.observe(time.monotonic() - started)
+            details = parse_element_html(response.text, SELECTORS['error_details'])
+            if not details or not details.text:
+                logger.warning(f"Popup с ошибкой не найден в ответе для строки {row_index}")
+                return None
+            raw_text = details.text.strip()
+            logger.info(f"Получены детали ошибки для строки {row_index}: {raw_text[:100]}...")
+            return self.parse_error_structure(raw_text, details.inner_html)
+        except Exception as e:
+            logger.error(f"Ошибка получения деталей для строки {row_index}: {e}")
+            return None
+
+    def probe_fingerprint(self) -> Optional[Dict[str, Any]]:
+        """Отпечаток gvUploads по уже загруженной странице (None - таблица не найдена)."""
+        table = parse_element_html(self.page_html, SELECTORS['table'])
+        rows = parse_grid_html(self.page_html, SELECTORS['table'])
+        if not table or rows is None:
+            return None
+        top = [row['cells'][0] if row['cells'] else '' for row in rows[:CONFIG['probe_top_rows']]]
+        return grid_fingerprint(len(rows), top, table.inner_html)
+
+    @profiled('scrape_reports')
+    def scrape_reports(self) -> list:
+        logger.info("Сбор данных из таблицы (HTTP)...")
+        reports = []
+        try:
+            with self.profile.phase('scrape_reports.pass1'):
+                rows = parse_grid_html(self.page_html, SELECTORS['table'])
+                if rows is None:
+                    logger.error("Таблица отчётов не найдена")
+                    return []
+                self.rows = rows
+                logger.info(f"Найдено {len(rows)} строк в таблице")
+                reports, error_rows = self.collect_reports(rows)
+                logger.info(f"Первый проход: собрано {len(reports)} записей, {len(error_rows)} с ошибками")
+                error_rows = self.apply_error_cache(reports, error_rows)
+                self.profile.switch('scrape_reports.pass2')
+                if error_rows:
+                    logger.info(f"Второй проход: парсинг {len(error_rows)} ошибок...")
+                    for report_index, row_index in error_rows:
                         error_details = self.fetch_error_details(row_index)
                         if error_details:
                             reports[report_index]['errors'] = error_details
                             logger.info(f"Ошибка для {reports[report_index]['distr_name']}: получена")
-                        else:
-                            logger.debug(f"Детали ошибки не найдены для строки {row_index}")
-                    except Exception as e:
-                        logger.error(f"Ошибка парсинга деталей для строки {row_index}: {e}")
-                        continue
-                logger.info(f"Второй проход завершён")
-            logger.info(f"Всего собрано {len(reports)} записей")
+                    logger.info(f"Второй проход завершён")
+                self.store_error_cache(reports, error_rows)
+                logger.info(f"Всего собрано {len(reports)} записей")
         except Exception as e:
             logger.error(f"Ошибка сбора данных: {e}")
         return reports
 
     def close(self):
-        if self.driver:
-            self.driver.quit()
+        self.close_error_cache()
+        if self.session:
+            self.session.close()
+
+
+def open_session_store(name: str = 'cislink_agent') -> Optional[SessionStore]:
+    if not CONFIG['session_reuse']:
+        return None
+    if not ENCRYPTION_AVAILABLE:
+        logger.info("Пакет cryptography не установлен - сессия между запусками не сохраняется")
+        return None
+    try:
+        return SessionStore(
+            CONFIG['state_dir'], name, CONFIG['cislink_login'],
+            CONFIG['session_key'] or CONFIG['cislink_password'],
+            max_age_seconds=CONFIG['session_max_age_hours'] * 3600
+        )
+    except Exception as e:
+        logger.warning(f"Хранилище сессии недоступно: {e}")
+        return None
+
+
+def create_scraper() -> BaseCISLinkScraper:
+    """Выбирает бэкенд по CONFIG['scraper_backend'] (переменная SCRAPER_BACKEND)."""
+    if CONFIG['scraper_backend'] == 'http':
+        return CISLinkHTTPScraper()
+    return CISLinkScraper()
+
+
+def report_hashes(reports: list) -> Dict[int, str]:
+    """Хэш содержимого отчётов по distr_id (строки одного дистрибьютора хэшируются вместе)."""
+    grouped: Dict[int, list] = {}
+    for report in reports:
+        grouped.setdefault(report['distr_id'], []).append(report)
+    return {
+        distr_id: hashlib.sha256(
+            json.dumps(items, ensure_ascii=False, sort_keys=True, default=str).encode('utf-8')
+        ).hexdigest()
+        for distr_id, items in grouped.items()
+    }
 
 
 class APIClient:
-    def __init__(self):
+    def __init__(self, session: Optional[requests.Session] = None):
         self.url = CONFIG['api_url']
         self.api_key = CONFIG['api_key']
+        self.delivery = DeliveryClient(
+            self.url, self.api_key, source='cislink_agent', session=session,
+            max_batch_bytes=CONFIG['api_batch_bytes'],
+            max_attempts=CONFIG['api_max_attempts'],
+            use_gzip=CONFIG['api_gzip']
+        )
+        self.outbox = None
+        if CONFIG['outbox_enabled']:
+            try:
+                self.outbox = Outbox(CONFIG['state_dir'], 'cislink_agent', CONFIG['outbox_max_entries'])
+            except Exception as e:
+                logger.warning(f"Очередь отправки недоступна, отправляем напрямую: {e}")
+        self.snapshot = None
+        self.state = None
+        if CONFIG['delta_sync']:
+            try:
+                self.snapshot = ReportSnapshot(CONFIG['state_dir'])
+                self.state = StateValues(CONFIG['state_dir'])
+            except Exception as e:
+                logger.warning(f"Снимок отчётов недоступен, отправляем полностью: {e}")
+                self.snapshot = None
+
+    def full_sync_due(self, acked: Optional[Dict[int, str]] = None) -> bool:
+        """Пора ли делать полную выгрузку (всегда False без дельта-синхронизации)."""
+        if not self.snapshot:
+            return False
+        if acked is None:
+            acked = self.snapshot.hashes()
+        last_full = self.state.get('last_full_sync_at', 0)
+        return (
+            CONFIG['force_full_sync'] or not acked or
+            time.time() - last_full > CONFIG['full_sync_interval_hours'] * 3600
+        )
+
+    def build_delta(self, reports: list, partial: bool = False) -> Tuple[list, Dict[str, Any], Dict[str, Any]]:
+        """
+        Сравнивает отчёты с последним подтверждённым снимком.
+        Возвращает (отчёты к отправке, поля запроса, meta для подтверждения после доставки).
+        partial - собрана не вся таблица: выгрузка только дельтой и без исчезнувших.
+        """
+        hashes = report_hashes(reports)
+        acked = self.snapshot.hashes()
+        if not partial and self.full_sync_due(acked):
+            return reports, {'sync_mode': 'full'}, {'full': True, 'hashes': hashes, 'removed': []}
+        changed_ids = {distr_id for distr_id, value in hashes.items() if acked.get(distr_id) != value}
+        removed = [] if partial else sorted(distr_id for distr_id in acked if distr_id not in hashes)
+        changed = [r for r in reports if r['distr_id'] in changed_ids]
+        extra = {'sync_mode': 'delta', 'removed_distr_ids': removed, 'total_reports': len(reports)}
+        meta = {'full': False, 'hashes': {d: hashes[d] for d in changed_ids}, 'removed': removed}
+        return changed, extra, meta
 
-    def send_reports(self, reports: list) -> dict:
+    def acknowledge(self, meta: Optional[Dict[str, Any]]):
+        """Переносит доставленную выгрузку в снимок."""
+        if not self.snapshot or not meta or 'hashes' not in meta:
+            return
+        self.snapshot.apply(meta['hashes'], meta['removed'], full=meta['full'])
+        if meta['full']:
+            self.state.set('last_full_sync_at', time.time())
+
+    @profiled('send_reports')
+    def send_reports(self, reports: list, partial: bool = False) -> dict:
+        """
+        Фиксирует отчёты (или их дельту) в очереди и отправляет всю очередь по порядку.
+        partial - сбор был ограничен (ReportFilter), в запрос добавляется partial_scrape.
+        queued в результате - выгрузка сохранена в очереди (или отправлять нечего):
+        даже если доставка не удалась, она будет дослана следующими запусками.
+        """
+        extra: Dict[str, Any] = {}
+        meta: Dict[str, Any] = {}
+        if self.snapshot:
+            total = len(reports)
+            reports, extra, meta = self.build_delta(reports, partial)
+            if extra['sync_mode'] == 'full':
+                logger.info(f"Полная выгрузка: {total} записей")
+            else:
+                logger.info(
+                    f"Дельта: изменено {len(reports)} из {total}, исчезло {len(extra['removed_distr_ids'])}"
+                )
+                if not reports and not extra['removed_distr_ids']:
+                    logger.info("Изменений с последней доставки нет")
+                    return dict(self.drain(), queued=True)
+        if partial:
+            extra['partial_scrape'] = True
+        if PROFILE_PAYLOAD:
+            extra['run_profile'] = get_profile().compact()
+        if not self.outbox:
+            result = self.delivery.send(reports, extra=extra)
+            if result.get('success'):
+                self.acknowledge(meta)
+            return result
         try:
-            response = requests.post(
-                self.url,
-                json={'api_key': self.api_key, 'reports': reports},
-                timeout=60
+            self.outbox.enqueue(reports, extra, meta)
+        except OutboxFull as e:
+            logger.error(
+                f"Отчёты не поставлены в очередь отправки и будут потеряны: {e}; "
+                f"записей в выгрузке {len(reports)}, отклонено выгрузок за запуск {self.outbox.refused}"
             )
-            return response.json()
-        except Exception as e:
-            return {'success': False, 'error': str(e)}
+            result = self.drain()
+            result.update({'success': False, 'error': 'outbox_full', 'queued': False})
+            return result
+        return dict(self.drain(), queued=True)
 
+    @profiled('drain_outbox')
+    def drain(self) -> dict:
+        """Досылает накопленные в очереди отправки (в том числе от прошлых запусков)."""
+        if not self.outbox:
+            return {'success': True, 'drained': 0, 'pending': 0}
+        return drain_outbox(
+            self.outbox, self.delivery, on_delivered=lambda entry: self.acknowledge(entry.get('meta'))
+        )
 
-def main():
-    logger.info("Агент CISLink v1.6 (fix upload_status для дистрибьюторов без остатков)")
-    if not all([CONFIG['cislink_login'], CONFIG['cislink_password'], CONFIG['api_url'], CONFIG['api_key']]):
-        logger.error("Не заданы переменные окружения!")
-        exit(1)
-    scraper = CISLinkScraper()
+    def close(self):
+        if self.outbox:
+            self.outbox.close()
+            self.outbox = None
+        if self.snapshot:
+            self.snapshot.close()
+            self.state.close()
+            self.snapshot = None
+
+
+@profiled('probe_upload_history')
+def probe_upload_history(scraper: BaseCISLinkScraper, api: APIClient) -> Optional[Dict[str, Any]]:
+    """
+    Сравнивает отпечаток UploadHistory с сохранённым после прошлого запуска.
+    Возвращает отпечаток с признаком unchanged или None, если проверка отключена или не удалась.
+    Пропуск не делается при FORCE_FULL_SCRAPE/--force-full и когда пора делать полную выгрузку.
+    """
+    if not CONFIG['change_probe']:
+        return None
+    try:
+        fingerprint = scraper.probe_fingerprint()
+        if not fingerprint:
+            return None
+        state = StateValues(CONFIG['state_dir'])
+        try:
+            previous = state.get('upload_history_fingerprint')
+        finally:
+            state.close()
+    except Exception as e:
+        logger.warning(f"Проверка изменений не удалась: {e}")
+        return None
+    unchanged = previous == fingerprint
+    if unchanged and CONFIG['force_full_scrape']:
+        logger.info("UploadHistory не изменилась, но включён принудительный полный сбор")
+        unchanged = False
+    elif unchanged and api.full_sync_due():
+        logger.info("UploadHistory не изменилась, но пора делать полную выгрузку")
+        unchanged = False
+    elif unchanged:
+        logger.info(f"UploadHistory не изменилась с прошлого запуска ({fingerprint['rows']} строк) - сбор пропущен")
+    return dict(fingerprint, unchanged=unchanged)
+
+
+def remember_fingerprint(fingerprint: Dict[str, Any]):
+    try:
+        state = StateValues(CONFIG['state_dir'])
+        try:
+            state.set('upload_history_fingerprint', {k: v for k, v in fingerprint.items() if k != 'unchanged'})
+        finally:
+            state.close()
+    except Exception as e:
+        logger.warning(f"Не удалось сохранить отпечаток UploadHistory: {e}")
+
+
+def build_report_filter(api: APIClient) -> ReportFilter:
+    """Ограничения сбора из CONFIG; при полной выгрузке и FORCE_FULL_SCRAPE таблица читается целиком."""
+    report_filter = ReportFilter(
+        include=parse_id_list(CONFIG['distr_include']),
+        exclude=parse_id_list(CONFIG['distr_exclude']),
+        max_rows=CONFIG['max_report_rows']
+    )
+    if CONFIG['scrape_since']:
+        last_run = None
+        if CONFIG['scrape_since'].lower() == 'last_run':
+            try:
+                state = StateValues(CONFIG['state_dir'])
+                try:
+                    last_run = state.get('last_scrape_started_at')
+                finally:
+                    state.close()
+            except Exception as e:
+                logger.warning(f"Не удалось прочитать время прошлого сбора: {e}")
+        report_filter.since = parse_since(CONFIG['scrape_since'], last_run)
+        if CONFIG['scrape_since'].lower() == 'last_run' and not last_run:
+            logger.info("Успешных сборов ещё не было - UploadHistory читается без ограничения по дате")
+    if report_filter.active and CONFIG['force_full_scrape']:
+        logger.info("Принудительный полный сбор - ограничения сбора не действуют")
+        return ReportFilter()
+    if report_filter.active and api.full_sync_due():
+        logger.info("Пора делать полную выгрузку - ограничения сбора не действуют")
+        return ReportFilter()
+    return report_filter
+
+
+def remember_scrape_start(started_at: datetime):
+    try:
+        state = StateValues(CONFIG['state_dir'])
+        try:
+            state.set('last_scrape_started_at', started_at.isoformat(sep=' ', timespec='seconds'))
+        finally:
+            state.close()
+    except Exception as e:
+        logger.warning(f"Не удалось сохранить время сбора: {e}")
+
+
+def run_sync(scraper: BaseCISLinkScraper, api: APIClient) -> bool:
+    """
+    Сбор UploadHistory и отправка в API на уже авторизованном скрапере.
+    Возвращает False, если навигация или доставка не удалась.
+    """
+    if not scraper.navigate_to_reports():
+        logger.error("Навигация не удалась")
+        return False
+    fingerprint = probe_upload_history(scraper, api)
+    if fingerprint and fingerprint.get('unchanged'):
+        return bool(api.drain().get('success'))
+    scraper.report_filter = build_report_filter(api)
+    scrape_started_at = datetime.now()
+    reports = scraper.scrape_reports()
+    if scraper.pacer.observations:
+        logger.info(f"Темп запросов: {scraper.pacer.summary()}")
+    if not reports:
+        logger.warning("Нет данных для отправки")
+        result = api.drain()
+        if result.get('drained'):
+            logger.info(f"Досланы отчёты из очереди: {result}")
+        return True
+    with_errors = sum(1 for r in reports if r.get('errors'))
+    logger.info(f"Отчётов с детальными ошибками: {with_errors}")
+    result = api.send_reports(reports, partial=scraper.report_filter.partial)
+    logger.info(f"Результат отправки: {result}")
+    # Отпечаток и время сбора сохраняются, только если выгрузка доставлена или лежит в очереди:
+    # иначе следующий запуск пропустил бы сбор (или окно SCRAPE_SINCE ушло бы дальше потерянных отчётов)
+    if result.get('success') or result.get('queued'):
+        if fingerprint:
+            remember_fingerprint(fingerprint)
+        remember_scrape_start(scrape_started_at)
+    return bool(result.get('success'))
+
+
+def sync_account(profile_name: str = 'cislink_agent') -> bool:
+    """Один запуск с текущим CONFIG: браузер, вход, сбор и отправка. False - если что-то не удалось."""
+    scraper = create_scraper()
+    api = APIClient()
+    session_store = open_session_store()
+    get_profile().start(profile_name)
     try:
         scraper.init_browser()
-        if not scraper.login():
+        if not restore_session(session_store, scraper) and not scraper.login():
             logger.error("Авторизация не удалась")
-            exit(1)
-        if not scraper.navigate_to_reports():
-            logger.error("Навигация не удалась")
-            exit(1)
-        reports = scraper.scrape_reports()
-        if reports:
-            with_errors = sum(1 for r in reports if r.get('errors'))
-            logger.info(f"Отчётов с детальными ошибками: {with_errors}")
-            result = APIClient().send_reports(reports)
-            logger.info(f"Результат отправки: {result}")
-            if not result.get('success'):
-                exit(1)
-        else:
-            logger.warning("Нет данных для отправки")
+            return False
+        ok = run_sync(scraper, api)
+        save_session(session_store, scraper)
+        return ok
     finally:
         scraper.close()
+        api.close()
+        if session_store:
+            session_store.close()
+        get_profile().report()
+
+
+def main():
+    logger.info("Агент CISLink v1.6 (fix upload_status для дистрибьюторов без остатков)")
+    if CONFIG['accounts']:
+        from cislink_accounts import run_accounts
+        if not run_accounts(CONFIG['accounts']):
+            exit(1)
+        return
+    if not all([CONFIG['cislink_login'], CONFIG['cislink_password'], CONFIG['api_url'], CONFIG['api_key']]):
+        logger.error("Не заданы переменные окружения!")
+        exit(1)
+    if not sync_account():
+        exit(1)
 
 
 if __name__ == '__main__':
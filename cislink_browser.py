@@ -0,0 +1,239 @@
+"""
+Общий запуск Chrome для агентов CISLink.
+
+- chromedriver ищется один раз: CHROMEDRIVER_PATH, путь из состояния прошлого запуска,
+  chromedriver в PATH и только потом webdriver-manager (сетевой запрос и загрузка).
+  Найденный путь запоминается, поэтому при локальном драйвере запуск работает без сети.
+- pageLoadStrategy=eager: driver.get возвращается после разбора DOM, не дожидаясь картинок;
+  готовность страниц проверяют ожидания cislink_waits.
+- Через CDP Network.setBlockedURLs не загружаются картинки, шрифты и счётчики аналитики.
+  CSS блокируется только по явному BLOCK_RESOURCES=...,css: проверки видимости
+  (lblTextCodeError, попап ошибок) опираются на стили страницы.
+"""
+
+import os
+import time
+import shutil
+import signal
+import logging
+import threading
+from typing import Optional, List
+
+from selenium import webdriver
+from selenium.common.exceptions import SessionNotCreatedException, WebDriverException
+from selenium.webdriver.chrome.options import Options
+from selenium.webdriver.chrome.service import Service
+
+from cislink_metrics import instrument_driver, profiled
+from cislink_state import StateValues
+
+logger = logging.getLogger(__name__)
+
+PAGE_LOAD_STRATEGY = os.getenv('PAGE_LOAD_STRATEGY', 'eager')
+BLOCK_RESOURCES = [
+    name.strip() for name in os.getenv('BLOCK_RESOURCES', 'images,fonts,analytics').lower().split(',')
+    if name.strip() and name.strip() != 'none'
+]
+
+BLOCKED_URL_PATTERNS = {
+    'images': ['*.png', '*.jpg', '*.jpeg', '*.gif', '*.bmp', '*.svg', '*.ico', '*.webp'],
+    'fonts': ['*.woff', '*.woff2', '*.ttf', '*.otf', '*.eot'],
+    'analytics': [
+        '*google-analytics.com*', '*googletagmanager.com*', '*doubleclick.net*',
+        '*mc.yandex.ru*', '*top-fwz1.mail.ru*',
+    ],
+    'css': ['*.css'],
+}
+
+DRIVER_PATH_KEY = 'chromedriver_path'
+
+_driver_path: Optional[str] = None
+_driver_path_lock = threading.Lock()
+
+
+def _load_cached_path(state_dir: Optional[str]) -> Optional[str]:
+    if not state_dir:
+        return None
+    try:
+        state = StateValues(state_dir)
+        try:
+            return state.get(DRIVER_PATH_KEY)
+        finally:
+            state.close()
+    except Exception as e:
+        logger.debug(f"Путь chromedriver из состояния не прочитан: {e}")
+        return None
+
+
+def _store_cached_path(state_dir: Optional[str], path: Optional[str]):
+    if not state_dir:
+        return
+    try:
+        state = StateValues(state_dir)
+        try:
+            state.set(DRIVER_PATH_KEY, path)
+        finally:
+            state.close()
+    except Exception as e:
+        logger.debug(f"Путь chromedriver не сохранён: {e}")
+
+
+def resolve_driver_path(state_dir: Optional[str] = None, refresh: bool = False) -> str:
+    """
+    Путь к chromedriver. refresh=True пропускает запомненный путь (например, если
+    драйвер не подошёл к обновившемуся Chrome) и обращается к webdriver-manager.
+    """
+    global _driver_path
+    with _driver_path_lock:
+        if not refresh:
+            candidates = [
+                ('CHROMEDRIVER_PATH', os.getenv('CHROMEDRIVER_PATH')),
+                ('процесс', _driver_path),
+                ('состояние', _load_cached_path(state_dir)),
+                ('PATH', shutil.which('chromedriver')),
+            ]
+            for source, path in candidates:
+                if path and os.path.isfile(path) and os.access(path, os.X_OK):
+                    if path != _driver_path:
+                        logger.info(f"chromedriver: {path} (источник: {source})")
+                    if source in ('CHROMEDRIVER_PATH', 'PATH'):
+                        _store_cached_path(state_dir, path)
+                    _driver_path = path
+                    return path
+        from webdriver_manager.chrome import ChromeDriverManager
+        path = ChromeDriverManager().install()
+        logger.info(f"chromedriver: {path} (источник: webdriver-manager)")
+        _driver_path = path
+        _store_cached_path(state_dir, path)
+        return path
+
+
+def build_options(headless: bool = True, debugging_port: Optional[int] = None,
+                  profile_dir: str = '') -> Options:
+    options = Options()
+    if headless:
+        options.add_argument('--headless=new')
+    options.add_argument('--no-sandbox')
+    options.add_argument('--disable-dev-shm-usage')
+    options.add_argument('--disable-gpu')
+    options.add_argument('--window-size=1920,1080')
+    options.add_argument('--disable-blink-features=AutomationControlled')
+    options.add_experimental_option('excludeSwitches', ['enable-automation'])
+    options.add_experimental_option('useAutomationExtension', False)
+    options.add_argument('--lang=ru-RU')
+    options.add_argument('--disable-extensions')
+    options.add_argument('--disable-infobars')
+    if debugging_port:
+        options.add_argument(f'--remote-debugging-port={debugging_port}')
+    if profile_dir:
+        options.add_argument(f'--user-data-dir={os.path.abspath(profile_dir)}')
+    options.page_load_strategy = PAGE_LOAD_STRATEGY
+    return options
+
+
+def blocked_url_patterns(categories: Optional[List[str]] = None) -> List[str]:
+    patterns = []
+    for name in (BLOCK_RESOURCES if categories is None else categories):
+        patterns.extend(BLOCKED_URL_PATTERNS.get(name, []))
+    return patterns
+
+
+def block_resources(driver, categories: Optional[List[str]] = None):
+    patterns = blocked_url_patterns(categories)
+    if not patterns:
+        return
+    try:
+        driver.execute_cdp_cmd('Network.enable', {})
+        driver.execute_cdp_cmd('Network.setBlockedURLs', {'urls': patterns})
+    except Exception as e:
+        logger.warning(f"Блокировка ресурсов через CDP недоступна: {e}")
+
+
+@profiled('start_browser')
+def create_driver(headless: bool = True, debugging_port: Optional[int] = None, profile_dir: str = '',
+                  state_dir: Optional[str] = None) -> webdriver.Chrome:
+    """Запускает Chrome с настройками агентов и пишет в лог время старта."""
+    started = time.monotonic()
+    options = build_options(headless, debugging_port, profile_dir)
+    path = resolve_driver_path(state_dir)
+    try:
+        driver = webdriver.Chrome(service=Service(path), options=options)
+    except (SessionNotCreatedException, WebDriverException) as e:
+        if os.getenv('CHROMEDRIVER_PATH'):
+            raise
+        # Запомненный драйвер мог устареть после обновления Chrome
+        logger.warning(f"chromedriver {path} не запустился ({(str(e).splitlines() or [''])[0]}) - получаем заново")
+        path = resolve_driver_path(state_dir, refresh=True)
+        driver = webdriver.Chrome(service=Service(path), options=options)
+    instrument_driver(driver)
+    driver.execute_script("Object.defineProperty(navigator, 'webdriver', {get: () => undefined})")
+    block_resources(driver)
+    logger.info(
+        f"Chrome запущен за {time.monotonic() - started:.1f} с "
+        f"(загрузка страниц: {PAGE_LOAD_STRATEGY}, блокируется: {', '.join(BLOCK_RESOURCES) or 'ничего'})"
+    )
+    return driver
+
+
+def _process_rss(pid: int, page_size: int) -> int:
+    try:
+        with open(f'/proc/{pid}/statm') as f:
+            return int(f.read().split()[1]) * page_size
+    except (OSError, ValueError, IndexError):
+        return 0
+
+
+def process_tree_pids(root_pid: int) -> Optional[List[int]]:
+    """pid процесса и всех его потомков (по /proc; None вне Linux)."""
+    if not os.path.isdir('/proc'):
+        return None
+    children: dict = {}
+    for entry in os.listdir('/proc'):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f'/proc/{entry}/stat') as f:
+                ppid = int(f.read().rsplit(')', 1)[1].split()[1])
+        except (OSError, ValueError, IndexError):
+            continue
+        children.setdefault(ppid, []).append(int(entry))
+    pids, stack = [], [root_pid]
+    while stack:
+        pid = stack.pop()
+        pids.append(pid)
+        stack.extend(children.get(pid, []))
+    return pids
+
+
+def process_tree_rss(root_pid: int) -> Optional[int]:
+    """Суммарный RSS процесса и всех его потомков в байтах (None вне Linux)."""
+    pids = process_tree_pids(root_pid)
+    if pids is None:
+        return None
+    page_size = os.sysconf('SC_PAGE_SIZE')
+    return sum(_process_rss(pid, page_size) for pid in pids)
+
+
+def browser_rss(driver) -> Optional[int]:
+    """RSS chromedriver вместе с запущенным им Chrome (все процессы-рендереры)."""
+    try:
+        return process_tree_rss(driver.service.process.pid)
+    except Exception:
+        return None
+
+
+def terminate_driver(driver):
+    """
+    Жёстко завершает chromedriver и все процессы Chrome. Для зависшего браузера,
+    когда quit() сам может не вернуться; зависшая команда WebDriver при этом
+    получает ошибку соединения.
+    """
+    try:
+        root_pid = driver.service.process.pid
+    except Exception:
+        return
+    for pid in reversed(process_tree_pids(root_pid) or [root_pid]):
+        try:
+            os.kill(pid, signal.SIGKILL)
+        except OSError:
+            pass
@@ -0,0 +1,348 @@
+"""
+Режим демона для собственного сервера: тёплый браузер и встроенный планировщик.
+
+Браузер запускается и авторизуется один раз, задачи cislink_runner (sync, link)
+выполняются по расписанию в формате cron (время сервера) на этой же сессии.
+Между запусками сессия CISLink поддерживается лёгкой проверкой, браузер
+перезапускается, если его память (RSS chromedriver + Chrome) превысила порог
+или он перестал отвечать. Локальный HTTP-эндпоинт отдаёт /health (JSON)
+и /metrics (формат Prometheus).
+
+    DAEMON_SCHEDULE="sync=*/30 7-20 * * *;link=0 7 * * *" python cislink_daemon.py
+"""
+
+import os
+import json
+import time
+import signal
+import logging
+import threading
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Optional, List, Dict, Any, Set
+
+import link_products_agent
+from cislink_browser import browser_rss
+from cislink_metrics import get_profile
+from cislink_runner import TASKS, Pipeline
+
+logger = logging.getLogger(__name__)
+
+CONFIG = {
+    # Задачи и расписания через ';' в виде задача=cron (минута час день месяц день_недели)
+    'schedule': os.getenv('DAEMON_SCHEDULE', 'sync=0 8,10,13,15,18 * * *;link=0 7 * * *'),
+    'http_host': os.getenv('DAEMON_HTTP_HOST', '127.0.0.1'),
+    'http_port': int(os.getenv('DAEMON_HTTP_PORT', '8088')),
+    # Перезапуск браузера, когда chromedriver + Chrome занимают больше указанного
+    'max_browser_rss_mb': float(os.getenv('DAEMON_MAX_BROWSER_RSS_MB', '1500')),
+    # Проверка сессии CISLink между запусками, чтобы она не истекала
+    'keepalive_minutes': float(os.getenv('DAEMON_KEEPALIVE_MINUTES', '10')),
+    'run_on_start': os.getenv('DAEMON_RUN_ON_START', 'False').lower() == 'true',
+}
+
+MAX_SLEEP_SECONDS = 30
+
+
+class CronSchedule:
+    """Пять полей cron: *, списки, диапазоны и шаги (*/15, 8-18/2). Воскресенье - 0 или 7."""
+
+    FIELDS = ((0, 59), (0, 23), (1, 31), (1, 12), (0, 7))
+
+    def __init__(self, expression: str):
+        parts = expression.split()
+        if len(parts) != 5:
+            raise ValueError(f"ожидается 5 полей cron: '{expression}'")
+        self.expression = expression
+        self.minutes, self.hours, self.days, self.months, weekdays = [
+            self._parse_field(part, low, high) for part, (low, high) in zip(parts, self.FIELDS)
+        ]
+        self.weekdays = {0 if day == 7 else day for day in weekdays}
+        self.any_day = parts[2] == '*'
+        self.any_weekday = parts[4] == '*'
+
+    @staticmethod
+    def _parse_field(field: str, low: int, high: int) -> Set[int]:
+        values: Set[int] = set()
+        for item in field.split(','):
+            step = 1
+            if '/' in item:
+                item, step_text = item.split('/', 1)
+                step = int(step_text)
+            if item == '*':
+                start, end = low, high
+            elif '-' in item:
+                start, end = (int(v) for v in item.split('-', 1))
+            else:
+                start = int(item)
+                end = high if step > 1 else start
+            if start < low or end > high or start > end or step < 1:
+                raise ValueError(f"значение вне диапазона {low}-{high}: '{field}'")
+            values.update(range(start, end + 1, step))
+        return values
+
+    def _day_matches(self, moment: datetime) -> bool:
+        day_ok = moment.day in self.days
+        weekday_ok = (moment.isoweekday() % 7) in self.weekdays
+        if self.any_day or self.any_weekday:
+            return day_ok and weekday_ok
+        return day_ok or weekday_ok
+
+    def next_after(self, moment: datetime) -> datetime:
+        candidate = moment.replace(second=0, microsecond=0) + timedelta(minutes=1)
+        limit = candidate + timedelta(days=366 * 5)
+        while candidate < limit:
+            if candidate.month not in self.months or not self._day_matches(candidate):
+                candidate = candidate.replace(hour=0, minute=0) + timedelta(days=1)
+            elif candidate.hour not in self.hours:
+                candidate = candidate.replace(minute=0) + timedelta(hours=1)
+            elif candidate.minute not in self.minutes:
+                candidate += timedelta(minutes=1)
+            else:
+                return candidate
+        raise ValueError(f"расписание '{self.expression}' не срабатывает в ближайшие 5 лет")
+
+
+class Job:
+    def __init__(self, task: str, schedule: CronSchedule):
+        self.task = task
+        self.schedule = schedule
+        self.next_run = schedule.next_after(datetime.now())
+
+
+def parse_schedule(text: str) -> List[Job]:
+    jobs = []
+    for entry in text.split(';'):
+        if not entry.strip():
+            continue
+        task, _, expression = entry.partition('=')
+        task = task.strip()
+        if task not in TASKS:
+            raise ValueError(f"неизвестная задача '{task}' (доступны: {', '.join(TASKS)})")
+        jobs.append(Job(task, CronSchedule(expression.strip())))
+    if not jobs:
+        raise ValueError("расписание пусто")
+    return jobs
+
+
+class DaemonMetrics:
+    """Счётчики для /health и /metrics; обновляются циклом демона, читаются HTTP-потоком."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.started_at = time.time()
+        self.runs: Dict[str, Dict[str, Any]] = {}
+        self.browser_rss = 0
+        self.browser_starts = 0
+        self.browser_recycles = 0
+        self.authorized = False
+        self.next_runs: Dict[str, str] = {}
+
+    def record_run(self, task: str, ok: bool, seconds: float):
+        with self._lock:
+            run = self.runs.setdefault(task, {'success': 0, 'failure': 0})
+            run['success' if ok else 'failure'] += 1
+            run['last_ok'] = ok
+            run['last_duration'] = seconds
+            run['last_finished_at'] = time.time()
+            if ok:
+                run['last_success_at'] = run['last_finished_at']
+
+    def update(self, **values):
+        with self._lock:
+            for key, value in values.items():
+                setattr(self, key, value)
+
+    def health(self) -> Dict[str, Any]:
+        with self._lock:
+            failing = [task for task, run in self.runs.items() if not run.get('last_ok', True)]
+            return {
+                'status': 'degraded' if failing or not self.authorized else 'ok',
+                'uptime_sec': round(time.time() - self.started_at),
+                'authorized': self.authorized,
+                'failing_tasks': failing,
+                'browser_rss_mb': round(self.browser_rss / 1024 / 1024, 1),
+                'browser_recycles': self.browser_recycles,
+                'next_runs': dict(self.next_runs),
+                'runs': json.loads(json.dumps(self.runs)),
+            }
+
+    def prometheus(self) -> str:
+        with self._lock:
+            lines = [
+                '# TYPE cislink_daemon_uptime_seconds gauge',
+                f'cislink_daemon_uptime_seconds {time.time() - self.started_at:.0f}',
+                '# TYPE cislink_daemon_browser_rss_bytes gauge',
+                f'cislink_daemon_browser_rss_bytes {self.browser_rss}',
+                '# TYPE cislink_daemon_browser_starts_total counter',
+                f'cislink_daemon_browser_starts_total {self.browser_starts}',
+                '# TYPE cislink_daemon_browser_recycles_total counter',
+                f'cislink_daemon_browser_recycles_total {self.browser_recycles}',
+                '# TYPE cislink_daemon_authorized gauge',
+                f'cislink_daemon_authorized {int(self.authorized)}',
+                '# TYPE cislink_daemon_task_runs_total counter',
+            ]
+            for task, run in self.runs.items():
+                for status in ('success', 'failure'):
+                    lines.append(f'cislink_daemon_task_runs_total{{task="{task}",status="{status}"}} {run[status]}')
+            lines.append('# TYPE cislink_daemon_task_last_duration_seconds gauge')
+            for task, run in self.runs.items():
+                lines.append(f'cislink_daemon_task_last_duration_seconds{{task="{task}"}} {run["last_duration"]:.3f}')
+            lines.append('# TYPE cislink_daemon_task_last_success_timestamp_seconds gauge')
+            for task, run in self.runs.items():
+                if run.get('last_success_at'):
+                    lines.append(
+                        f'cislink_daemon_task_last_success_timestamp_seconds{{task="{task}"}} '
+                        f'{run["last_success_at"]:.0f}'
+                    )
+            return '\n'.join(lines) + '\n'
+
+
+def start_http_server(metrics: DaemonMetrics) -> Optional[ThreadingHTTPServer]:
+    if not CONFIG['http_port']:
+        return None
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.startswith('/health'):
+                health = metrics.health()
+                body = json.dumps(health, ensure_ascii=False).encode('utf-8')
+                self._send(200 if health['status'] == 'ok' else 503, body, 'application/json; charset=utf-8')
+            elif self.path.startswith('/metrics'):
+                self._send(200, metrics.prometheus().encode('utf-8'), 'text/plain; version=0.0.4')
+            else:
+                self._send(404, b'not found', 'text/plain')
+
+        def _send(self, code: int, body: bytes, content_type: str):
+            self.send_response(code)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            logger.debug(f"HTTP {self.address_string()} {format % args}")
+
+    server = ThreadingHTTPServer((CONFIG['http_host'], CONFIG['http_port']), Handler)
+    threading.Thread(target=server.serve_forever, name='daemon-http', daemon=True).start()
+    logger.info(f"Health/metrics: http://{CONFIG['http_host']}:{CONFIG['http_port']}/health, /metrics")
+    return server
+
+
+class Daemon:
+    def __init__(self, jobs: List[Job]):
+        self.jobs = jobs
+        self.pipeline = Pipeline([job.task for job in jobs])
+        self.metrics = DaemonMetrics()
+        self.stopping = threading.Event()
+        self.last_activity = time.monotonic()
+
+    def stop(self, *_):
+        logger.info("Получен сигнал остановки - завершаем после текущей задачи")
+        self.stopping.set()
+
+    def ensure_browser(self) -> bool:
+        """Тёплый браузер с действующей сессией; при неудаче браузер закрывается до следующей попытки."""
+        try:
+            if not self.pipeline.driver:
+                seconds = self.pipeline.start_browser()
+                self.metrics.update(browser_starts=self.metrics.browser_starts + 1)
+                logger.info(f"Браузер демона запущен за {seconds:.1f} с")
+            authorized = self.pipeline.authorize()
+        except Exception as e:
+            logger.error(f"Браузер недоступен: {e}")
+            authorized = False
+        self.metrics.update(authorized=authorized)
+        if not authorized:
+            self.pipeline.stop_browser()
+        self.last_activity = time.monotonic()
+        return authorized
+
+    def browser_alive(self) -> bool:
+        try:
+            _ = self.pipeline.driver.current_url
+            return True
+        except Exception:
+            return False
+
+    def check_memory(self):
+        if not self.pipeline.driver:
+            return
+        rss = browser_rss(self.pipeline.driver) or 0
+        self.metrics.update(browser_rss=rss)
+        limit = CONFIG['max_browser_rss_mb'] * 1024 * 1024
+        if limit and rss > limit:
+            logger.info(
+                f"Браузер занимает {rss / 1024 / 1024:.0f} МБ (порог {CONFIG['max_browser_rss_mb']:.0f} МБ) - перезапуск"
+            )
+            self.pipeline.stop_browser()
+            self.metrics.update(browser_recycles=self.metrics.browser_recycles + 1, browser_rss=0)
+            self.ensure_browser()
+
+    def run_job(self, job: Job):
+        if not self.ensure_browser():
+            logger.error(f"Задача {job.task} пропущена: нет авторизованной сессии")
+            self.metrics.record_run(job.task, False, 0.0)
+            return
+        get_profile().start(job.task)
+        ok, seconds = self.pipeline.run_task(job.task)
+        get_profile().report()
+        self.metrics.record_run(job.task, ok, seconds)
+        logger.info(f"Задача {job.task}: {'ok' if ok else 'ошибка'} за {seconds:.1f} с")
+        if not ok and not self.browser_alive():
+            logger.warning("Браузер перестал отвечать - будет перезапущен")
+            self.pipeline.stop_browser()
+        self.last_activity = time.monotonic()
+
+    def publish_schedule(self):
+        self.metrics.update(next_runs={
+            job.task: job.next_run.strftime('%Y-%m-%d %H:%M') for job in self.jobs
+        })
+
+    def run(self):
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+        server = start_http_server(self.metrics)
+        try:
+            self.ensure_browser()
+            if CONFIG['run_on_start']:
+                for job in self.jobs:
+                    job.next_run = datetime.now()
+            self.publish_schedule()
+            for job in self.jobs:
+                logger.info(f"Задача {job.task}: '{job.schedule.expression}', ближайший запуск {job.next_run:%Y-%m-%d %H:%M}")
+            while not self.stopping.is_set():
+                now = datetime.now()
+                for job in self.jobs:
+                    if job.next_run <= now and not self.stopping.is_set():
+                        self.run_job(job)
+                        job.next_run = job.schedule.next_after(datetime.now())
+                        self.publish_schedule()
+                self.check_memory()
+                idle = time.monotonic() - self.last_activity
+                if self.pipeline.driver and idle > CONFIG['keepalive_minutes'] * 60:
+                    self.ensure_browser()
+                wait = (min(job.next_run for job in self.jobs) - datetime.now()).total_seconds()
+                self.stopping.wait(max(0.0, min(wait, MAX_SLEEP_SECONDS)))
+        finally:
+            if server:
+                server.shutdown()
+            self.pipeline.close()
+            logger.info("Демон остановлен")
+
+
+def main():
+    logger.info("Демон CISLink")
+    config = link_products_agent.CONFIG
+    if not all([config['cislink_login'], config['cislink_password']]):
+        logger.error("Не заданы CISLINK_LOGIN / CISLINK_PASSWORD")
+        exit(1)
+    try:
+        jobs = parse_schedule(CONFIG['schedule'])
+    except ValueError as e:
+        logger.error(f"Некорректное расписание DAEMON_SCHEDULE: {e}")
+        exit(1)
+    Daemon(jobs).run()
+
+
+if __name__ == '__main__':
+    main()
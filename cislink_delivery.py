@@ -0,0 +1,192 @@
+"""
+Доставка данных агентов CISLink в API ЛК PROTECO.
+
+Один пул соединений (requests.Session), gzip-сжатие тела (только по явному use_gzip:
+не каждый сервер разжимает тело запроса), разбиение больших
+списков на пакеты ограниченного размера с ключами идемпотентности и повторы
+с экспоненциальной задержкой и джиттером. Результаты пакетов сводятся в один ответ.
+"""
+
+import gzip
+import json
+import random
+import hashlib
+import logging
+from typing import Optional, List, Dict, Any
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from cislink_metrics import sleep
+
+logger = logging.getLogger(__name__)
+
+RETRY_STATUS_CODES = (429, 500, 502, 503, 504)
+
+# Диагностические поля запроса: не влияют на ключ идемпотентности
+DIAGNOSTIC_FIELDS = ('run_profile',)
+
+
+def create_session(pool_size: int = 4) -> requests.Session:
+    """HTTP-сессия с пулом keep-alive соединений."""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+
+def split_batches(items: List[Dict[str, Any]], max_batch_bytes: int) -> List[List[Dict[str, Any]]]:
+    """Делит список на пакеты, чей JSON не превышает max_batch_bytes (один элемент - всегда пакет)."""
+    batches: List[List[Dict[str, Any]]] = []
+    current: List[Dict[str, Any]] = []
+    current_size = 0
+    for item in items:
+        size = len(json.dumps(item, ensure_ascii=False, default=str).encode('utf-8')) + 1
+        if current and current_size + size > max_batch_bytes:
+            batches.append(current)
+            current, current_size = [], 0
+        current.append(item)
+        current_size += size
+    if current:
+        batches.append(current)
+    return batches
+
+
+def idempotency_key(source: str, items: List[Dict[str, Any]], extra: Optional[Dict[str, Any]] = None) -> str:
+    """
+    Ключ зависит только от содержимого пакета и полей запроса: повторная отправка
+    того же пакета (в том числе из очереди в следующем запуске) даёт тот же ключ.
+    """
+    fields = {k: v for k, v in (extra or {}).items() if k not in DIAGNOSTIC_FIELDS}
+    body = json.dumps([items, fields], ensure_ascii=False, sort_keys=True, default=str)
+    return hashlib.sha256(f'{source}:{body}'.encode('utf-8')).hexdigest()[:32]
+
+
+class DeliveryClient:
+    def __init__(self, url: str, api_key: str, source: str, session: Optional[requests.Session] = None,
+                 max_batch_bytes: int = 1_000_000, max_attempts: int = 5, backoff_base: float = 1.0,
+                 backoff_max: float = 30.0, timeout: float = 60, use_gzip: bool = False):
+        self.url = url
+        self.api_key = api_key
+        self.source = source
+        self.session = session or create_session()
+        self.max_batch_bytes = max_batch_bytes
+        self.max_attempts = max_attempts
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.timeout = timeout
+        self.use_gzip = use_gzip
+
+    def _backoff(self, attempt: int, retry_after: Optional[str] = None) -> float:
+        if retry_after and retry_after.isdigit():
+            return min(float(retry_after), self.backoff_max)
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+
+    def _post(self, payload: Dict[str, Any], key: str) -> requests.Response:
+        body = json.dumps(payload, ensure_ascii=False, default=str).encode('utf-8')
+        headers = {'Content-Type': 'application/json; charset=utf-8', 'Idempotency-Key': key}
+        if self.use_gzip:
+            body = gzip.compress(body)
+            headers['Content-Encoding'] = 'gzip'
+        response = self.session.post(self.url, data=body, headers=headers, timeout=self.timeout)
+        if response.status_code == 415 and self.use_gzip:
+            logger.warning("API не принимает gzip - отправляем без сжатия")
+            self.use_gzip = False
+            return self._post(payload, key)
+        return response
+
+    def send_batch(self, payload: Dict[str, Any], key: str) -> Dict[str, Any]:
+        """Отправляет один пакет с повторами. Возвращает ответ API или {'success': False, 'error': ...}."""
+        last_error = ''
+        for attempt in range(self.max_attempts):
+            retry_after = None
+            try:
+                response = self._post(payload, key)
+                try:
+                    result = response.json()
+                except ValueError:
+                    result = {'success': response.ok, 'status_code': response.status_code}
+                if not isinstance(result, dict):
+                    result = {'success': response.ok, 'response': result}
+                if response.ok:
+                    return result
+                last_error = f'HTTP {response.status_code}'
+                if response.status_code not in RETRY_STATUS_CODES:
+                    result.setdefault('success', False)
+                    result.setdefault('error', last_error)
+                    return result
+                retry_after = response.headers.get('Retry-After')
+            except (requests.ConnectionError, requests.Timeout) as e:
+                last_error = str(e)
+            except Exception as e:
+                return {'success': False, 'error': str(e)}
+            if attempt + 1 < self.max_attempts:
+                delay = self._backoff(attempt, retry_after)
+                logger.warning(
+                    f"Отправка пакета не удалась ({last_error}), попытка {attempt + 1}/{self.max_attempts}, "
+                    f"повтор через {delay:.1f} с"
+                )
+                sleep(delay)
+        return {'success': False, 'error': last_error}
+
+    def send(self, items: List[Dict[str, Any]], extra: Optional[Dict[str, Any]] = None,
+             items_key: str = 'reports') -> Dict[str, Any]:
+        """
+        Отправляет список пакетами. Каждый пакет - самостоятельный запрос с полями extra,
+        api_key, списком items_key и сведениями о пакете. Возвращает сводный результат:
+        success = все пакеты доставлены.
+        """
+        # Пустой список - всё равно один запрос: в extra могут быть данные (например, удалённые записи)
+        batches = split_batches(items, self.max_batch_bytes) or [[]]
+        merged: Dict[str, Any] = {'success': True, 'batches': len(batches), 'delivered': 0, 'responses': []}
+        for index, batch in enumerate(batches):
+            key = idempotency_key(self.source, batch, extra)
+            payload = dict(extra or {})
+            payload['api_key'] = self.api_key
+            payload[items_key] = batch
+            payload['batch'] = {'index': index, 'total': len(batches), 'idempotency_key': key}
+            result = self.send_batch(payload, key)
+            merged['responses'].append(result)
+            if result.get('success', True) is False:
+                merged['success'] = False
+                merged.setdefault('error', result.get('error', 'batch_failed'))
+                merged.setdefault('failed_batches', []).append(index)
+            else:
+                merged['delivered'] += len(batch)
+        if len(batches) > 1:
+            logger.info(f"Отправлено пакетов: {len(batches)}, доставлено записей: {merged['delivered']}/{len(items)}")
+        return merged
+
+
+def drain_outbox(outbox, delivery: DeliveryClient, items_key: str = 'reports',
+                 on_delivered=None) -> Dict[str, Any]:
+    """
+    Отправляет записи очереди по порядку. На первой неудаче останавливается, чтобы
+    не нарушать порядок; запись остаётся в очереди, пакеты с уже принятыми ключами
+    идемпотентности сервер при повторе отбросит. on_delivered(entry) вызывается
+    после успешной доставки каждой записи.
+    """
+    entries = outbox.pending()
+    summary: Dict[str, Any] = {'success': True, 'drained': 0, 'delivered': 0, 'pending': len(entries)}
+    for entry in entries:
+        result = delivery.send(entry['items'], extra=entry['extra'], items_key=items_key)
+        summary['last_result'] = result
+        if not result.get('success'):
+            outbox.mark_failed(entry['id'], result.get('error', ''))
+            summary['success'] = False
+            summary['error'] = result.get('error', 'delivery_failed')
+            logger.warning(
+                f"Запись очереди {entry['id']} не доставлена ({summary['error']}), "
+                f"в очереди осталось {summary['pending']}"
+            )
+            break
+        outbox.mark_delivered(entry['id'])
+        if on_delivered:
+            on_delivered(entry)
+        summary['drained'] += 1
+        summary['delivered'] += result.get('delivered', 0)
+        summary['pending'] -= 1
+    if len(entries) > 1 or summary['pending']:
+        logger.info(f"Очередь отправки: доставлено записей {summary['drained']}, осталось {summary['pending']}")
+    return summary
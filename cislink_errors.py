@@ -0,0 +1,176 @@
+"""
+Разбор текста ошибки из popup-а UploadHistory (lblDetails) в структуру для API.
+
+Popup содержит один или несколько разделов "Шаг N: сообщение (pdФайл.txt)", за каждым
+может идти таблица с примерами строк. parse_error_details проходит HTML один раз по
+индексам (str.find и заранее скомпилированные шаблоны с pos/endpos, без копий фрагментов):
+таблица относится к разделу, чей заголовок встретился перед ней; из таблицы разбираются
+заголовок и первые max_examples строк, остальные строки только подсчитываются.
+Разметка - как её отдают браузер (innerHTML) и ElementHTMLParser: теги в нижнем регистре.
+parse_error_details_legacy - прежний разбор (только первый шаг), ERROR_PARSER=legacy.
+"""
+
+import re
+import html
+import logging
+from typing import Optional, Dict, List, Any, Tuple
+
+logger = logging.getLogger(__name__)
+
+STEP_RE = re.compile(r'Шаг\s+(\d+):[ \t]*')
+FILE_RE = re.compile(r'\((pd\w+)(?:\.txt|\.dbf)?\)')
+CELL_RE = re.compile(r'<t[dh]\b[^>]*>(.*?)</t[dh]>', re.S)
+TAG_RE = re.compile(r'<[^>]+>')
+
+TRUNCATION_MARKERS = ('(список неполный)', '...')
+
+
+def cell_text(cell_html: str) -> str:
+    """Текст ячейки: без вложенной разметки (<b>, <span>), с раскрытыми сущностями."""
+    if '<' in cell_html:
+        cell_html = TAG_RE.sub('', cell_html)
+    if '&' in cell_html:
+        cell_html = html.unescape(cell_html)
+    return ' '.join(cell_html.split())
+
+
+def row_cells(raw_html: str, start: int, end: int) -> List[str]:
+    return [cell_text(match.group(1)) for match in CELL_RE.finditer(raw_html, start, end)]
+
+
+def split_sections(raw_text: str) -> List[Tuple[Optional[str], int, int]]:
+    """Разделы "Шаг N: ..." текста popup-а: (шаг, начало, конец). Без шагов - весь текст."""
+    matches = list(STEP_RE.finditer(raw_text))
+    if not matches:
+        return [(None, 0, len(raw_text))]
+    ends = [match.start() for match in matches[1:]] + [len(raw_text)]
+    return [(f"Шаг {match.group(1)}", match.end(), end) for match, end in zip(matches, ends)]
+
+
+def new_error(raw_text: str, step: Optional[str], start: int, end: int) -> Dict[str, Any]:
+    """Описание шага по его разделу raw_text[start:end] (раздел не копируется)."""
+    file_match = FILE_RE.search(raw_text, start, end)
+    if step is not None:
+        line_end = raw_text.find('\n', start, end)
+        message = raw_text[start:end if line_end == -1 else line_end].split('(pd', 1)[0].strip()
+    else:
+        message = raw_text[:200]
+    return {
+        'step': step,
+        'file': file_match.group(1) if file_match else None,
+        'message': message,
+        'fields': [],
+        'count': 0,
+        'is_truncated': any(raw_text.find(marker, start, end) != -1 for marker in TRUNCATION_MARKERS),
+        'examples': []
+    }
+
+
+def read_table(raw_html: str, start: int, end: int, error_info: Dict[str, Any], max_examples: int):
+    """
+    Таблица raw_html[start:end]: заголовок и первые max_examples строк с данными - в error_info,
+    остальные строки только считаются. Если у шага уже есть таблица, её строки добавляются к count.
+    """
+    row = raw_html.find('<tr', start, end)
+    if row == -1:
+        return
+    next_row = raw_html.find('<tr', row + 3, end)
+    if not error_info['fields']:
+        error_info['fields'] = [
+            text for text in row_cells(raw_html, row, end if next_row == -1 else next_row) if text
+        ]
+    fields = error_info['fields']
+    examples = error_info['examples']
+    row = next_row
+    while row != -1 and len(examples) < max_examples:
+        next_row = raw_html.find('<tr', row + 3, end)
+        cells = row_cells(raw_html, row, end if next_row == -1 else next_row)
+        if fields and len(cells) == len(fields) and any(cells):
+            examples.append(dict(zip(fields, cells)))
+        error_info['count'] += 1
+        row = next_row
+    if row != -1:
+        error_info['count'] += raw_html.count('<tr', row, end)
+
+
+def parse_error_details(raw_text: str, raw_html: str, max_examples: int = 5,
+                        max_text_length: int = 2000) -> Dict[str, Any]:
+    result = {
+        'raw_text': raw_text[:max_text_length] if raw_text else '',
+        'errors': []
+    }
+    if not raw_text:
+        return result
+    errors = [new_error(raw_text, step, start, end) for step, start, end in split_sections(raw_text)]
+    result['errors'] = errors
+    if not raw_html:
+        return result
+    try:
+        # Таблица относится к последнему заголовку "Шаг N", встреченному перед ней в HTML
+        section = -1
+        position = 0
+        while True:
+            table_start = raw_html.find('<table', position)
+            if table_start == -1:
+                break
+            section += len(STEP_RE.findall(raw_html, position, table_start))
+            table_end = raw_html.find('</table', table_start)
+            if table_end == -1:
+                table_end = len(raw_html)
+            read_table(raw_html, table_start, table_end, errors[min(max(section, 0), len(errors) - 1)], max_examples)
+            position = table_end
+    except Exception as e:
+        logger.debug(f"Ошибка парсинга таблицы: {e}")
+    return result
+
+
+def parse_error_details_legacy(raw_text: str, raw_html: str, max_examples: int = 5,
+                               max_text_length: int = 2000) -> Dict[str, Any]:
+    result = {
+        'raw_text': raw_text[:max_text_length] if raw_text else '',
+        'errors': []
+    }
+    if not raw_text:
+        return result
+    step_pattern = r'Шаг\s+(\d+):\s*(.+?)(?=\(pd|$)'
+    file_pattern = r'\((pd\w+)(?:\.txt|\.dbf)?\)'
+    step_match = re.search(step_pattern, raw_text)
+    file_matches = re.findall(file_pattern, raw_text)
+    error_info = {
+        'step': f"Шаг {step_match.group(1)}" if step_match else None,
+        'file': file_matches[0] if file_matches else None,
+        'message': step_match.group(2).strip() if step_match else raw_text[:200],
+        'fields': [],
+        'count': 0,
+        'is_truncated': '(список неполный)' in raw_text or '...' in raw_text,
+        'examples': []
+    }
+    if raw_html and '<table' in raw_html:
+        try:
+            headers = re.findall(r'<td[^>]*>([^<]+)</td>', raw_html.split('</tr>')[0] if '</tr>' in raw_html else '')
+            if headers:
+                error_info['fields'] = [h.strip() for h in headers if h.strip()]
+            rows = raw_html.split('</tr>')[1:]
+            example_count = 0
+            for row in rows:
+                if example_count >= max_examples:
+                    break
+                cells = re.findall(r'<td[^>]*>([^<]*)</td>', row)
+                if cells and len(cells) == len(error_info['fields']):
+                    example = {}
+                    for i, field in enumerate(error_info['fields']):
+                        example[field] = cells[i].strip()
+                    if any(example.values()):
+                        error_info['examples'].append(example)
+                        example_count += 1
+            error_info['count'] = len(rows) - 1
+        except Exception as e:
+            logger.debug(f"Ошибка парсинга таблицы: {e}")
+    result['errors'].append(error_info)
+    return result
+
+
+PARSERS = {
+    'fast': parse_error_details,
+    'legacy': parse_error_details_legacy,
+}
@@ -0,0 +1,377 @@
+"""
+Профиль запуска агентов CISLink: время по фазам, команды WebDriver, паузы и ожидания.
+
+Фазы (login, navigate_to_reports, scrape_reports.pass1/pass2, process_item.load/validate/save,
+send_reports, ...) размечаются в коде агентов через phase()/profiled(). Команды драйвера
+считаются и замеряются обёрткой driver.execute (instrument_driver в create_driver) - через
+неё идут и команды элементов. Паузы (sleep) и ожидания PageWaiter отмечаются в cislink_waits,
+cislink_pacing и cislink_delivery. Всё относится к самой вложенной активной фазе потока
+(у воркеров линкера свои стеки фаз); время фазы - полное, команды и паузы - только свои.
+
+По итогам запуска (report()):
+- сводка по фазам в лог;
+- PROFILE_JSON=path - полный профиль в JSON ({agent} в пути заменяется именем агента/задачи);
+- PROFILE_PROM=path - textfile для node_exporter (формат Prometheus);
+- краткая сводка compact() уходит в API вместе с выгрузкой (поле run_profile, PROFILE_PAYLOAD).
+PROFILE_PYTHON=cprofile (только основной поток) или sample (все потоки, выборка стеков
+раз в PROFILE_SAMPLE_INTERVAL) включает профилирование Python-кода; результат пишется
+в PROFILE_PYTHON_OUT (pstats или свёрнутые стеки для flamegraph), топ функций - в лог.
+"""
+
+import io
+import os
+import sys
+import json
+import time
+import pstats
+import logging
+import cProfile
+import functools
+import threading
+from collections import Counter
+from contextlib import contextmanager
+from typing import Callable, Optional, List, Dict, Any
+
+logger = logging.getLogger(__name__)
+
+PROFILE_ENABLED = os.getenv('PROFILE', 'True').lower() == 'true'
+PROFILE_JSON = os.getenv('PROFILE_JSON', '')
+PROFILE_PROM = os.getenv('PROFILE_PROM', '')
+PROFILE_PAYLOAD = os.getenv('PROFILE_PAYLOAD', 'True').lower() == 'true'
+PROFILE_PYTHON = os.getenv('PROFILE_PYTHON', '').lower()
+PROFILE_PYTHON_OUT = os.getenv('PROFILE_PYTHON_OUT', '')
+SAMPLE_INTERVAL = float(os.getenv('PROFILE_SAMPLE_INTERVAL', '0.005'))
+
+TOP_FUNCTIONS = 20
+OTHER_PHASE = 'other'
+
+PHASE_FIELDS = ('calls', 'seconds', 'commands', 'command_seconds', 'sleeps', 'sleep_seconds', 'wait_seconds')
+
+
+class StackSampler:
+    """Выборочный профилировщик: раз в interval снимает стеки всех потоков (sys._current_frames)."""
+
+    def __init__(self, interval: float = SAMPLE_INTERVAL):
+        self.interval = interval
+        self.stacks: Counter = Counter()
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='profile-sampler', daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        own = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own:
+                    continue
+                names = []
+                while frame is not None:
+                    code = frame.f_code
+                    names.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+                    frame = frame.f_back
+                self.stacks[';'.join(reversed(names))] += 1
+            self.samples += 1
+
+    def leaf_counts(self) -> Counter:
+        leaves: Counter = Counter()
+        for stack, count in self.stacks.items():
+            leaves[stack.rsplit(';', 1)[-1]] += count
+        return leaves
+
+    def write_collapsed(self, path: str):
+        """Свёрнутые стеки (stack count) - вход для flamegraph.pl и speedscope."""
+        with open(path, 'w', encoding='utf-8') as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f"{stack} {count}\n")
+
+
+class RunProfile:
+    """Счётчики одного запуска агента. Потокобезопасен; стек фаз - свой у каждого потока."""
+
+    def __init__(self, name: str = 'cislink', enabled: bool = PROFILE_ENABLED):
+        self.name = name
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._python_profiler = None
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.started_at = time.time()
+            self._started = time.monotonic()
+            self.phases: Dict[str, Dict[str, float]] = {}
+            self.commands: Dict[str, List[float]] = {}
+
+    def _stack(self) -> list:
+        stack = getattr(self._local, 'stack', None)
+        if stack is None:
+            stack = self._local.stack = []
+        return stack
+
+    def current_phase(self) -> str:
+        stack = self._stack()
+        return stack[-1][0] if stack else OTHER_PHASE
+
+    def _add(self, phase: str, **values):
+        with self._lock:
+            stats = self.phases.get(phase)
+            if stats is None:
+                stats = self.phases[phase] = dict.fromkeys(PHASE_FIELDS, 0)
+            for key, value in values.items():
+                stats[key] += value
+
+    @contextmanager
+    def phase(self, name: str):
+        if not self.enabled:
+            yield
+            return
+        stack = self._stack()
+        stack.append([name, time.monotonic()])
+        depth = len(stack)
+        try:
+            yield
+        finally:
+            current, started = stack[depth - 1]
+            del stack[depth - 1:]
+            self._add(current, calls=1, seconds=time.monotonic() - started)
+
+    def switch(self, name: str):
+        """Закрывает текущую фазу и открывает следующую на том же уровне (шаги одной операции)."""
+        stack = self._stack()
+        if not self.enabled or not stack:
+            return
+        now = time.monotonic()
+        current, started = stack[-1]
+        self._add(current, calls=1, seconds=now - started)
+        stack[-1] = [name, now]
+
+    def record_command(self, command: str, seconds: float):
+        self._add(self.current_phase(), commands=1, command_seconds=seconds)
+        with self._lock:
+            entry = self.commands.setdefault(command, [0, 0.0])
+            entry[0] += 1
+            entry[1] += seconds
+
+    def record_sleep(self, seconds: float):
+        if self.enabled:
+            self._add(self.current_phase(), sleeps=1, sleep_seconds=seconds)
+
+    def record_wait(self, seconds: float):
+        if self.enabled:
+            self._add(self.current_phase(), wait_seconds=seconds)
+
+    # Итоги
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            phases = {name: dict(stats) for name, stats in self.phases.items()}
+            commands = {name: {'count': c, 'seconds': round(s, 3)} for name, (c, s) in self.commands.items()}
+        for stats in phases.values():
+            for key in ('seconds', 'command_seconds', 'sleep_seconds', 'wait_seconds'):
+                stats[key] = round(stats[key], 3)
+        return {
+            'agent': self.name,
+            'started_at': time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(self.started_at)),
+            'duration_seconds': round(time.monotonic() - self._started, 3),
+            'webdriver_commands': sum(c['count'] for c in commands.values()),
+            'webdriver_seconds': round(sum(c['seconds'] for c in commands.values()), 3),
+            'sleep_seconds': round(sum(p['sleep_seconds'] for p in phases.values()), 3),
+            'phases': phases,
+            'commands': dict(sorted(commands.items(), key=lambda item: -item[1]['count'])),
+        }
+
+    def compact(self) -> Dict[str, Any]:
+        """Краткая сводка для API: по фазе - секунды, вызовы и команды WebDriver."""
+        data = self.snapshot()
+        return {
+            'agent': data['agent'],
+            'duration_sec': round(data['duration_seconds'], 1),
+            'webdriver_commands': data['webdriver_commands'],
+            'sleep_sec': round(data['sleep_seconds'], 1),
+            'phases': {
+                name: {'sec': round(stats['seconds'], 2), 'n': stats['calls'], 'cmd': stats['commands']}
+                for name, stats in data['phases'].items()
+            },
+        }
+
+    def prometheus(self) -> str:
+        data = self.snapshot()
+        agent = data['agent']
+        lines = [
+            '# HELP cislink_run_duration_seconds Длительность последнего запуска агента',
+            '# TYPE cislink_run_duration_seconds gauge',
+            f'cislink_run_duration_seconds{{agent="{agent}"}} {data["duration_seconds"]}',
+            '# HELP cislink_run_timestamp_seconds Время начала последнего запуска',
+            '# TYPE cislink_run_timestamp_seconds gauge',
+            f'cislink_run_timestamp_seconds{{agent="{agent}"}} {self.started_at:.0f}',
+        ]
+        series = (
+            ('phase_seconds', 'seconds', 'Время фазы'),
+            ('phase_calls', 'calls', 'Число входов в фазу'),
+            ('phase_webdriver_commands', 'commands', 'Команды WebDriver в фазе'),
+            ('phase_webdriver_seconds', 'command_seconds', 'Время команд WebDriver в фазе'),
+            ('phase_sleep_seconds', 'sleep_seconds', 'Паузы в фазе'),
+            ('phase_wait_seconds', 'wait_seconds', 'Ожидания PageWaiter в фазе'),
+        )
+        for metric, key, help_text in series:
+            lines.append(f'# HELP cislink_run_{metric} {help_text}')
+            lines.append(f'# TYPE cislink_run_{metric} gauge')
+            for name, stats in sorted(data['phases'].items()):
+                lines.append(f'cislink_run_{metric}{{agent="{agent}",phase="{name}"}} {stats[key]}')
+        lines.append('# HELP cislink_run_webdriver_command_total Команды WebDriver по типу')
+        lines.append('# TYPE cislink_run_webdriver_command_total gauge')
+        for command, stats in data['commands'].items():
+            lines.append(f'cislink_run_webdriver_command_total{{agent="{agent}",command="{command}"}} {stats["count"]}')
+        return '\n'.join(lines) + '\n'
+
+    def log_summary(self):
+        data = self.snapshot()
+        logger.info(
+            f"Профиль {data['agent']}: {data['duration_seconds']:.1f} с, команд WebDriver {data['webdriver_commands']} "
+            f"({data['webdriver_seconds']:.1f} с), паузы {data['sleep_seconds']:.1f} с"
+        )
+        logger.info(f"  {'фаза':<28} {'вызовов':>7} {'время, с':>9} {'команд':>7} {'WD, с':>7} {'паузы, с':>9}")
+        for name, stats in sorted(data['phases'].items(), key=lambda item: -item[1]['seconds']):
+            logger.info(
+                f"  {name:<28} {stats['calls']:>7} {stats['seconds']:>9.1f} {stats['commands']:>7} "
+                f"{stats['command_seconds']:>7.1f} {stats['sleep_seconds']:>9.1f}"
+            )
+
+    # Профилирование Python-кода
+
+    def start(self, name: Optional[str] = None):
+        """Начало запуска агента: имя профиля и, если включено, профилировщик Python."""
+        if name:
+            self.name = name
+        self.reset()
+        if PROFILE_PYTHON == 'cprofile':
+            self._python_profiler = cProfile.Profile()
+            self._python_profiler.enable()
+        elif PROFILE_PYTHON == 'sample':
+            self._python_profiler = StackSampler()
+            self._python_profiler.start()
+        elif PROFILE_PYTHON:
+            logger.warning(f"Неизвестный PROFILE_PYTHON={PROFILE_PYTHON} (cprofile или sample)")
+
+    def _stop_python_profiler(self):
+        profiler, self._python_profiler = self._python_profiler, None
+        if profiler is None:
+            return
+        if isinstance(profiler, StackSampler):
+            profiler.stop()
+            path = PROFILE_PYTHON_OUT or f'{self.name}.collapsed'
+            profiler.write_collapsed(path)
+            total = profiler.samples or 1
+            logger.info(f"Выборочный профиль: {profiler.samples} выборок, стеки в {path}")
+            for function, count in profiler.leaf_counts().most_common(TOP_FUNCTIONS):
+                logger.info(f"  {count / total * 100:5.1f}%  {function}")
+            return
+        profiler.disable()
+        path = PROFILE_PYTHON_OUT or f'{self.name}.pstats'
+        profiler.dump_stats(path)
+        out = io.StringIO()
+        pstats.Stats(profiler, stream=out).sort_stats('cumulative').print_stats(TOP_FUNCTIONS)
+        logger.info(f"cProfile сохранён в {path}:\n{out.getvalue()}")
+
+    def report(self):
+        """Конец запуска: профилировщик Python, сводка в лог, JSON и textfile Prometheus."""
+        if not self.enabled:
+            return
+        try:
+            self._stop_python_profiler()
+        except Exception as e:
+            logger.warning(f"Не удалось сохранить профиль Python: {e}")
+        self.log_summary()
+        for path, render in ((PROFILE_JSON, self._json), (PROFILE_PROM, self.prometheus)):
+            if not path:
+                continue
+            # {agent} в пути разводит профили задач демона по разным файлам
+            path = path.replace('{agent}', self.name)
+            try:
+                write_atomic(path, render())
+                logger.info(f"Профиль запуска записан: {path}")
+            except Exception as e:
+                logger.warning(f"Не удалось записать профиль {path}: {e}")
+
+    def _json(self) -> str:
+        return json.dumps(self.snapshot(), ensure_ascii=False, indent=2)
+
+
+def write_atomic(path: str, text: str):
+    """Запись через временный файл: node_exporter не должен увидеть файл наполовину."""
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        f.write(text)
+    os.replace(tmp_path, path)
+
+
+_profile: Optional[RunProfile] = None
+_profile_lock = threading.Lock()
+
+
+def get_profile() -> RunProfile:
+    """Общий на процесс профиль запуска."""
+    global _profile
+    with _profile_lock:
+        if _profile is None:
+            _profile = RunProfile()
+        return _profile
+
+
+def phase(name: str):
+    return get_profile().phase(name)
+
+
+def profiled(name: str) -> Callable:
+    """Декоратор: весь вызов функции - фаза name."""
+    def decorator(func: Callable) -> Callable:
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            profile = get_profile()
+            if profile.current_phase() == name:
+                # Вложенный вызов той же фазы (например, разбор страницы внутри смены размера)
+                return func(*args, **kwargs)
+            with profile.phase(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def sleep(seconds: float):
+    """time.sleep с учётом паузы в профиле текущей фазы."""
+    if seconds <= 0:
+        return
+    time.sleep(seconds)
+    get_profile().record_sleep(seconds)
+
+
+def instrument_driver(driver):
+    """
+    Считает и замеряет каждую команду драйвера. WebElement отправляет команды через
+    parent.execute, поэтому обёртки driver.execute достаточно и для элементов.
+    """
+    profile = get_profile()
+    if not profile.enabled or getattr(driver, '_cislink_profiled', False):
+        return driver
+    execute = driver.execute
+
+    def timed_execute(driver_command, params=None):
+        started = time.monotonic()
+        try:
+            return execute(driver_command, params)
+        finally:
+            profile.record_command(driver_command, time.monotonic() - started)
+
+    driver.execute = timed_execute
+    driver._cislink_profiled = True
+    return driver
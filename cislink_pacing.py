@@ -0,0 +1,160 @@
+"""
+Адаптивный темп запросов к CISLink (AIMD).
+
+Агенты сообщают задержку загрузки страниц и postback-ов и их успех. Каждые
+PACING_WINDOW наблюдений контроллер решает:
+- ошибок больше PACING_MAX_ERROR_RATE или медианная задержка выше
+  PACING_TARGET_LATENCY * 1.5 - число одновременных запросов делится пополам,
+  пауза между запросами удваивается (мультипликативное снижение);
+- задержка ниже цели и ошибок нет - параллельность растёт на 1, пауза
+  уменьшается на шаг (аддитивный рост).
+Старт - с настроенной параллельности (configure, для линкера - число запущенных
+воркеров LINK_CONCURRENCY): перегрузку снимает первое же снижение вдвое, а не
+медленный рост с 1.
+Контроллер общий на процесс (get_pacer): при запуске нескольких задач
+(cislink_runner) линкер и скрапер делят один темп на один сервер.
+Решения пишутся в лог.
+"""
+
+import os
+import logging
+import threading
+from contextlib import contextmanager
+from typing import Optional, List, Dict, Any
+
+from cislink_metrics import sleep
+
+logger = logging.getLogger(__name__)
+
+PACING_ENABLED = os.getenv('PACING', 'True').lower() == 'true'
+TARGET_LATENCY = float(os.getenv('PACING_TARGET_LATENCY', '3.0'))
+MAX_ERROR_RATE = float(os.getenv('PACING_MAX_ERROR_RATE', '0.1'))
+WINDOW = int(os.getenv('PACING_WINDOW', '10'))
+MAX_DELAY = float(os.getenv('PACING_MAX_DELAY', '5.0'))
+DELAY_STEP = 0.25
+
+
+class AdaptivePacer:
+    """
+    Ограничивает число одновременных запросов (slot) и паузу перед запросом (pause).
+    observe(latency, ok) вызывается после каждого измеренного запроса.
+    """
+
+    def __init__(self, name: str = 'cislink', max_concurrency: int = 1, target_latency: float = TARGET_LATENCY,
+                 max_error_rate: float = MAX_ERROR_RATE, window: int = WINDOW, max_delay: float = MAX_DELAY,
+                 enabled: bool = PACING_ENABLED):
+        self.name = name
+        self.enabled = enabled
+        self.target_latency = target_latency
+        self.max_error_rate = max_error_rate
+        self.window = max(1, window)
+        self.max_delay = max_delay
+        self.max_concurrency = max(1, max_concurrency)
+        self.concurrency = 1
+        self.delay = 0.0
+        self._cond = threading.Condition()
+        self._active = 0
+        self._latencies: List[float] = []
+        self._errors = 0
+        self.observations = 0
+        self.total_errors = 0
+        self.decreases = 0
+        self.increases = 0
+
+    def configure(self, max_concurrency: int):
+        """
+        Верхняя граница параллельности (сколько воркеров реально запущено); с неё же
+        начинается работа. Если общий контроллер уже снижал темп, текущая
+        параллельность сохраняется (не выше новой границы).
+        """
+        with self._cond:
+            self.max_concurrency = max(1, max_concurrency)
+            if self.decreases:
+                self.concurrency = min(self.concurrency, self.max_concurrency)
+            else:
+                self.concurrency = self.max_concurrency
+            self._cond.notify_all()
+
+    @contextmanager
+    def slot(self):
+        """Ждёт, пока число активных запросов меньше текущей параллельности."""
+        if not self.enabled:
+            yield
+            return
+        with self._cond:
+            while self._active >= self.concurrency:
+                self._cond.wait()
+            self._active += 1
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._active -= 1
+                self._cond.notify_all()
+
+    def pause(self):
+        if self.enabled and self.delay > 0:
+            sleep(self.delay)
+
+    def observe(self, latency: float, ok: bool = True):
+        if not self.enabled:
+            return
+        with self._cond:
+            self.observations += 1
+            self._latencies.append(latency)
+            if not ok:
+                self._errors += 1
+                self.total_errors += 1
+            if len(self._latencies) >= self.window:
+                self._decide()
+
+    def _decide(self):
+        latencies = sorted(self._latencies)
+        median = latencies[len(latencies) // 2]
+        error_rate = self._errors / len(latencies)
+        old_concurrency, old_delay = self.concurrency, self.delay
+        if error_rate > self.max_error_rate or median > self.target_latency * 1.5:
+            self.concurrency = max(1, self.concurrency // 2)
+            self.delay = min(self.max_delay, max(self.delay * 2, DELAY_STEP))
+            reason = 'ошибки сервера' if error_rate > self.max_error_rate else 'рост задержки'
+            self.decreases += 1
+        elif median < self.target_latency and not self._errors:
+            self.concurrency = min(self.max_concurrency, self.concurrency + 1)
+            self.delay = max(0.0, self.delay - DELAY_STEP)
+            reason = 'запас по задержке'
+            self.increases += 1
+        else:
+            reason = ''
+        if (self.concurrency, self.delay) != (old_concurrency, old_delay):
+            logger.info(
+                f"Темп [{self.name}]: медиана {median:.2f} с, ошибок {self._errors}/{len(latencies)} ({reason}) -> "
+                f"параллельность {old_concurrency}->{self.concurrency}, пауза {old_delay:.2f}->{self.delay:.2f} с"
+            )
+            self._cond.notify_all()
+        self._latencies = []
+        self._errors = 0
+
+    def summary(self) -> Dict[str, Any]:
+        with self._cond:
+            return {
+                'concurrency': self.concurrency,
+                'max_concurrency': self.max_concurrency,
+                'delay': round(self.delay, 2),
+                'observations': self.observations,
+                'errors': self.total_errors,
+                'increases': self.increases,
+                'decreases': self.decreases,
+            }
+
+
+_pacer: Optional[AdaptivePacer] = None
+_pacer_lock = threading.Lock()
+
+
+def get_pacer() -> AdaptivePacer:
+    """Общий на процесс контроллер темпа запросов к CISLink."""
+    global _pacer
+    with _pacer_lock:
+        if _pacer is None:
+            _pacer = AdaptivePacer()
+        return _pacer
@@ -0,0 +1,241 @@
+"""
+Единая точка запуска агентов CISLink: несколько задач в одной авторизованной сессии.
+
+Браузер запускается один раз, вход (или восстановление сохранённой сессии) и выбор
+всех дистрибьюторов выполняются один раз, затем задачи конвейера по очереди работают
+на этом же драйвере и общей HTTP-сессии API. Время запуска, входа и каждой задачи
+выводится в конце.
+
+    RUNNER_TASKS=sync,link python cislink_runner.py
+    python cislink_runner.py link
+
+Задачи:
+    sync - сбор UploadHistory (cislink_agent); при SCRAPER_BACKEND=http куки браузера
+           переносятся в requests.Session, и сбор идёт без браузера
+    link - привязка непривязанных товаров (link_products_agent)
+"""
+
+import os
+import sys
+import time
+import logging
+from typing import Callable, Optional, List, Dict, Tuple
+
+import cislink_agent
+import link_products_agent
+from cislink_browser import create_driver, terminate_driver
+from cislink_delivery import create_session
+from cislink_metrics import get_profile, phase
+from cislink_session import restore_session, save_session
+
+logger = logging.getLogger(__name__)
+
+CONFIG = {
+    'tasks': [t.strip() for t in os.getenv('RUNNER_TASKS', 'sync,link').split(',') if t.strip()],
+    # Продолжать конвейер после неудачной задачи
+    'continue_on_failure': os.getenv('RUNNER_CONTINUE_ON_FAILURE', 'True').lower() == 'true',
+}
+
+
+class RunContext:
+    """Общее для задач: авторизованный линкер (владелец сессии CISLink и драйвера) и HTTP-сессия API."""
+
+    def __init__(self, linker: link_products_agent.CISLinkLinker, api_session):
+        self.linker = linker
+        self.api_session = api_session
+
+    @property
+    def driver(self):
+        """Текущий драйвер линкера (после перезапуска браузера - уже новый)."""
+        return self.linker.driver
+
+
+def task_sync(context: RunContext) -> bool:
+    if not cislink_agent.CONFIG['api_url'] or not cislink_agent.CONFIG['api_key']:
+        logger.error("Не заданы API_URL / API_KEY - задача sync пропущена")
+        return False
+    if cislink_agent.CONFIG['scraper_backend'] == 'http':
+        scraper = cislink_agent.CISLinkHTTPScraper()
+        scraper.init_browser()
+        scraper.apply_cookies(context.driver.get_cookies())
+    else:
+        scraper = cislink_agent.CISLinkScraper()
+        scraper.use_driver(context.driver, owned=False)
+    scraper.distributors_selected = context.linker.distributors_selected
+    api = cislink_agent.APIClient(session=context.api_session)
+    try:
+        return cislink_agent.run_sync(scraper, api)
+    finally:
+        scraper.close()
+        api.close()
+
+
+def task_link(context: RunContext) -> bool:
+    context.linker.results = []
+    api = link_products_agent.APIClient(session=context.api_session)
+    try:
+        return link_products_agent.run_link(context.linker, api)
+    finally:
+        api.close()
+
+
+TASKS: Dict[str, Callable[[RunContext], bool]] = {
+    'sync': task_sync,
+    'link': task_link,
+}
+
+
+def log_timings(timings: List[tuple]):
+    logger.info("=" * 60)
+    logger.info("Время выполнения:")
+    for name, seconds, status in timings:
+        logger.info(f"  {name:<10} {seconds:>8.1f} с  {status}")
+    logger.info(f"  {'всего':<10} {sum(t[1] for t in timings):>8.1f} с")
+    logger.info("=" * 60)
+
+
+class Pipeline:
+    """
+    Браузер, авторизованная сессия CISLink и HTTP-сессия API, на которых выполняются задачи.
+    Переживает несколько запусков задач (режим демона): перед каждым запуском authorize()
+    одним запросом проверяет, что сессия ещё действует.
+    """
+
+    def __init__(self, task_names: List[str]):
+        self.linker = link_products_agent.CISLinkLinker(
+            resolution_cache=link_products_agent.open_resolution_cache() if 'link' in task_names else None
+        )
+        self.session_store = link_products_agent.open_session_store('cislink_runner')
+        self.api_session = create_session()
+        self.authorized = False
+
+    @property
+    def driver(self):
+        """Драйвер сессии; линкер может заменить его при перезапуске браузера."""
+        return self.linker.driver
+
+    @staticmethod
+    def new_driver():
+        return create_driver(
+            headless=not link_products_agent.CONFIG['debug_mode'],
+            debugging_port=link_products_agent.CONFIG['debugging_port'],
+            profile_dir=link_products_agent.CONFIG['chrome_profile_dir'],
+            state_dir=link_products_agent.CONFIG['state_dir']
+        )
+
+    def start_browser(self) -> float:
+        started = time.monotonic()
+        self.linker.use_driver(self.new_driver(), owned=False, restart=self.restart_browser)
+        self.authorized = False
+        return time.monotonic() - started
+
+    def restart_browser(self):
+        """
+        restart для линкера (плановый перезапуск браузера в recycle_driver): закрывает текущий
+        браузер и возвращает новый драйвер. Куки сессии переносит линкер, авторизация сохраняется.
+        """
+        driver = self.driver
+        try:
+            driver.quit()
+        except Exception:
+            terminate_driver(driver)
+        return self.new_driver()
+
+    def stop_browser(self):
+        if self.driver:
+            save_session(self.session_store, self.linker)
+            try:
+                self.driver.quit()
+            except Exception:
+                pass
+        self.linker.driver = None
+        self.authorized = False
+
+    def authorize(self) -> bool:
+        """Вход (или восстановление сохранённой сессии) и выбор всех дистрибьюторов."""
+        if self.authorized:
+            try:
+                selected = self.linker.check_session()
+            except Exception as e:
+                logger.warning(f"Проверка сессии не удалась: {e}")
+                selected = None
+            if selected is not None:
+                self.linker.distributors_selected = selected
+                return selected or self.linker.select_all_distributors()
+            logger.info("Сессия CISLink истекла - повторный вход")
+            self.authorized = False
+        self.linker.distributors_selected = False
+        self.authorized = bool(
+            (restore_session(self.session_store, self.linker) or self.linker.login()) and
+            self.linker.select_all_distributors()
+        )
+        if self.authorized:
+            save_session(self.session_store, self.linker)
+        return self.authorized
+
+    def run_task(self, name: str) -> Tuple[bool, float]:
+        logger.info(f"=== Задача {name} ===")
+        started = time.monotonic()
+        try:
+            with phase(f'task_{name}'):
+                ok = TASKS[name](RunContext(self.linker, self.api_session))
+        except Exception as e:
+            logger.error(f"Задача {name} завершилась с ошибкой: {e}")
+            ok = False
+        return ok, time.monotonic() - started
+
+    def close(self):
+        self.stop_browser()
+        self.api_session.close()
+        if self.linker.resolution_cache:
+            self.linker.resolution_cache.close()
+        if self.session_store:
+            self.session_store.close()
+
+
+def run_pipeline(task_names: List[str]) -> bool:
+    unknown = [name for name in task_names if name not in TASKS]
+    if unknown:
+        logger.error(f"Неизвестные задачи: {', '.join(unknown)} (доступны: {', '.join(TASKS)})")
+        return False
+    logger.info(f"Конвейер задач: {', '.join(task_names)}")
+    timings: List[tuple] = []
+    success = True
+    pipeline = Pipeline(task_names)
+    get_profile().start('cislink_runner')
+    try:
+        timings.append(('browser', pipeline.start_browser(), 'ok'))
+        started = time.monotonic()
+        authorized = pipeline.authorize()
+        timings.append(('login', time.monotonic() - started, 'ok' if authorized else 'ошибка'))
+        if not authorized:
+            logger.error("Авторизация не удалась")
+            return False
+        for name in task_names:
+            ok, seconds = pipeline.run_task(name)
+            timings.append((name, seconds, 'ok' if ok else 'ошибка'))
+            if not ok:
+                success = False
+                if not CONFIG['continue_on_failure']:
+                    break
+        return success
+    finally:
+        log_timings(timings)
+        pipeline.close()
+        get_profile().report()
+
+
+def main(argv: Optional[List[str]] = None):
+    logger.info("Запуск агентов CISLink в общей сессии")
+    config = link_products_agent.CONFIG
+    if not all([config['cislink_login'], config['cislink_password']]):
+        logger.error("Не заданы CISLINK_LOGIN / CISLINK_PASSWORD")
+        exit(1)
+    args = [a for a in (sys.argv[1:] if argv is None else argv) if not a.startswith('--')]
+    task_names = args or CONFIG['tasks']
+    if not run_pipeline(task_names):
+        exit(1)
+
+
+if __name__ == '__main__':
+    main()
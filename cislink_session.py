@@ -0,0 +1,186 @@
+"""
+Повторное использование авторизованной сессии CISLink между запусками агентов.
+
+Куки сессии и признак выбранных дистрибьюторов хранятся в базе состояния (STATE_DIR)
+в зашифрованном виде (Fernet из пакета cryptography). Ключ выводится из SESSION_KEY,
+а если он не задан - из пароля CISLink. Без cryptography сессия не сохраняется,
+и агенты логинятся при каждом запуске, как раньше.
+"""
+
+import json
+import time
+import base64
+import hashlib
+import logging
+from typing import Optional, List, Dict, Any
+
+from selenium.webdriver.common.by import By
+
+from cislink_metrics import profiled
+from cislink_state import StateValues
+
+try:
+    from cryptography.fernet import Fernet, InvalidToken
+except ImportError:
+    Fernet = None
+    InvalidToken = ValueError
+
+logger = logging.getLogger(__name__)
+
+ENCRYPTION_AVAILABLE = Fernet is not None
+
+KEY_ITERATIONS = 200_000
+
+# Поля куки, которые понимает Network.setCookie (имена совпадают с driver.get_cookies)
+CDP_COOKIE_FIELDS = ('name', 'value', 'domain', 'path', 'secure', 'httpOnly', 'sameSite')
+
+
+def derive_key(secret: str, salt: str) -> bytes:
+    raw = hashlib.pbkdf2_hmac('sha256', secret.encode('utf-8'), salt.encode('utf-8'), KEY_ITERATIONS)
+    return base64.urlsafe_b64encode(raw)
+
+
+class SessionStore:
+    """
+    Зашифрованная запись {cookies, distributors_selected, login, saved_at} по имени агента.
+    Запись другого логина или старше max_age_seconds считается отсутствующей.
+    """
+
+    def __init__(self, state_dir: str, name: str, login: str, secret: str, max_age_seconds: float):
+        if not ENCRYPTION_AVAILABLE:
+            raise RuntimeError("пакет cryptography не установлен")
+        self.key = f'session:{name}'
+        self.login = login
+        self.max_age_seconds = max_age_seconds
+        self.fernet = Fernet(derive_key(secret, f'cislink-session:{login}'))
+        self.state = StateValues(state_dir)
+
+    def load(self) -> Optional[Dict[str, Any]]:
+        token = self.state.get(self.key)
+        if not token:
+            return None
+        try:
+            saved = json.loads(self.fernet.decrypt(token.encode('ascii')))
+        except (InvalidToken, ValueError):
+            logger.warning("Сохранённую сессию не удалось расшифровать - будет выполнен вход")
+            self.clear()
+            return None
+        if saved.get('login') != self.login or time.time() - saved.get('saved_at', 0) > self.max_age_seconds:
+            self.clear()
+            return None
+        return saved
+
+    def save(self, cookies: List[Dict[str, Any]], distributors_selected: bool):
+        payload = json.dumps({
+            'login': self.login,
+            'saved_at': time.time(),
+            'cookies': cookies,
+            'distributors_selected': distributors_selected,
+        }, ensure_ascii=False)
+        self.state.set(self.key, self.fernet.encrypt(payload.encode('utf-8')).decode('ascii'))
+
+    def clear(self):
+        self.state.set(self.key, None)
+
+    def close(self):
+        self.state.close()
+
+
+def live_cookies(cookies: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    now = time.time()
+    return [c for c in cookies if not c.get('expiry') or c['expiry'] > now]
+
+
+def apply_browser_cookies(driver, cookies: List[Dict[str, Any]], base_url: str):
+    """
+    Подставляет куки в браузер. Через CDP это делается без загрузки страницы;
+    если CDP недоступен - открываем сайт и добавляем куки через WebDriver.
+    """
+    cookies = live_cookies(cookies)
+    try:
+        for cookie in cookies:
+            params = {field: cookie[field] for field in CDP_COOKIE_FIELDS if field in cookie}
+            if cookie.get('expiry'):
+                params['expires'] = cookie['expiry']
+            if 'domain' not in params:
+                params['url'] = base_url
+            driver.execute_cdp_cmd('Network.setCookie', params)
+    except Exception as e:
+        logger.debug(f"CDP недоступен для установки кук ({e}) - добавляем через WebDriver")
+        driver.get(base_url)
+        for cookie in cookies:
+            driver.add_cookie(cookie)
+
+
+def check_browser_session(driver, waiter, url: str, checkbox_id: str) -> Optional[bool]:
+    """
+    Открывает страницу выбора дистрибьюторов. None - сессия недействительна
+    (сервер вернул форму входа), иначе - отмечен ли чекбокс 'Выбрать все'.
+    """
+    driver.get(url)
+    waiter.page_ready(legacy=3)
+    if driver.find_elements(By.ID, 'txtLogin') or 'Dictionary' not in driver.current_url:
+        return None
+    checkbox = driver.find_elements(By.ID, checkbox_id)
+    return bool(checkbox) and checkbox[0].is_selected()
+
+
+def session_cookies(session) -> List[Dict[str, Any]]:
+    """Куки requests.Session в формате driver.get_cookies()."""
+    return [
+        {
+            'name': c.name, 'value': c.value, 'domain': c.domain, 'path': c.path,
+            'secure': bool(c.secure), 'httpOnly': c.has_nonstandard_attr('HttpOnly'),
+            **({'expiry': c.expires} if c.expires else {}),
+        }
+        for c in session.cookies
+    ]
+
+
+def apply_session_cookies(session, cookies: List[Dict[str, Any]]):
+    for cookie in live_cookies(cookies):
+        session.cookies.set(
+            cookie['name'], cookie['value'], domain=cookie.get('domain', ''),
+            path=cookie.get('path', '/'), secure=cookie.get('secure', False),
+            expires=cookie.get('expiry'),
+            rest={'HttpOnly': None} if cookie.get('httpOnly') else {}
+        )
+
+
+@profiled('restore_session')
+def restore_session(store: Optional[SessionStore], agent) -> bool:
+    """
+    Восстанавливает сессию агента вместо входа. agent предоставляет apply_cookies(cookies)
+    и check_session() -> Optional[bool] (None - сессия недействительна, иначе выбраны ли
+    дистрибьюторы) и атрибут distributors_selected.
+    """
+    saved = store.load() if store else None
+    if not saved:
+        return False
+    try:
+        agent.apply_cookies(saved['cookies'])
+        selected = agent.check_session()
+    except Exception as e:
+        logger.warning(f"Проверка сохранённой сессии не удалась: {e}")
+        selected = None
+    if selected is None:
+        logger.info("Сохранённая сессия недействительна - выполняем вход")
+        store.clear()
+        return False
+    agent.distributors_selected = selected
+    age_min = (time.time() - saved['saved_at']) / 60
+    logger.info(
+        f"Сессия восстановлена без входа (сохранена {age_min:.0f} мин назад, "
+        f"дистрибьюторы {'выбраны' if selected else 'не выбраны'})"
+    )
+    return True
+
+
+@profiled('save_session')
+def save_session(store: Optional[SessionStore], agent):
+    if not store:
+        return
+    try:
+        store.save(agent.export_cookies(), agent.distributors_selected)
+    except Exception as e:
+        logger.warning(f"Не удалось сохранить сессию: {e}")
@@ -0,0 +1,429 @@
+"""
+Локальное состояние агентов CISLink между запусками.
+
+Всё хранится в SQLite-файле в каталоге STATE_DIR. В GitHub Actions каталог
+переносится между запусками через actions/cache (см. .github/workflows).
+"""
+
+import os
+import json
+import time
+import sqlite3
+import logging
+import threading
+from typing import Optional, List, Dict, Any
+
+logger = logging.getLogger(__name__)
+
+STATE_DB_NAME = 'state.db'
+
+
+def open_state_db(state_dir: str) -> sqlite3.Connection:
+    """Открывает (и при необходимости создаёт) базу состояния в state_dir."""
+    os.makedirs(state_dir, exist_ok=True)
+    conn = sqlite3.connect(os.path.join(state_dir, STATE_DB_NAME), timeout=30, check_same_thread=False)
+    conn.execute('PRAGMA journal_mode=WAL')
+    return conn
+
+
+class ErrorDetailsCache:
+    """
+    Кэш разобранных popup-ов ошибок UploadHistory.
+    Ключ - (distr_id, upload_datetime, error_file_type): пока строка в таблице та же,
+    текст ошибки не меняется и popup можно не открывать.
+    """
+
+    def __init__(self, state_dir: str, ttl_seconds: float, max_entries: int):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self.conn = open_state_db(state_dir)
+        self.conn.execute(
+            'CREATE TABLE IF NOT EXISTS error_details ('
+            ' distr_id INTEGER NOT NULL,'
+            ' upload_datetime TEXT NOT NULL,'
+            ' error_file_type TEXT NOT NULL,'
+            ' details TEXT NOT NULL,'
+            ' created_at REAL NOT NULL,'
+            ' accessed_at REAL NOT NULL,'
+            ' PRIMARY KEY (distr_id, upload_datetime, error_file_type))'
+        )
+        self.conn.commit()
+
+    @staticmethod
+    def _key(report: Dict[str, Any]) -> tuple:
+        return (
+            report['distr_id'],
+            report.get('upload_datetime') or '',
+            report.get('error_file_type') or '',
+        )
+
+    def get(self, report: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """Возвращает закэшированные детали ошибки для отчёта или None."""
+        now = time.time()
+        with self._lock:
+            row = self.conn.execute(
+                'SELECT details, created_at FROM error_details '
+                'WHERE distr_id = ? AND upload_datetime = ? AND error_file_type = ?',
+                self._key(report)
+            ).fetchone()
+            if not row or now - row[1] > self.ttl_seconds:
+                self.misses += 1
+                return None
+            self.conn.execute(
+                'UPDATE error_details SET accessed_at = ? '
+                'WHERE distr_id = ? AND upload_datetime = ? AND error_file_type = ?',
+                (now,) + self._key(report)
+            )
+            self.conn.commit()
+            self.hits += 1
+        return json.loads(row[0])
+
+    def put(self, report: Dict[str, Any], details: Dict[str, Any]):
+        now = time.time()
+        with self._lock:
+            self.conn.execute(
+                'INSERT OR REPLACE INTO error_details VALUES (?, ?, ?, ?, ?, ?)',
+                self._key(report) + (json.dumps(details, ensure_ascii=False), now, now)
+            )
+            self.conn.commit()
+
+    def evict(self) -> int:
+        """Удаляет просроченные записи и самые давно использованные сверх max_entries."""
+        with self._lock:
+            cursor = self.conn.execute(
+                'DELETE FROM error_details WHERE created_at < ?', (time.time() - self.ttl_seconds,)
+            )
+            removed = cursor.rowcount
+            cursor = self.conn.execute(
+                'DELETE FROM error_details WHERE rowid IN ('
+                ' SELECT rowid FROM error_details ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)',
+                (self.max_entries,)
+            )
+            removed += cursor.rowcount
+            self.conn.commit()
+        return removed
+
+    def close(self):
+        self.conn.close()
+
+
+class ArticleResolutionCache:
+    """
+    Кэш результатов проверки артикулов по (distr_code, article).
+    Отрицательные исходы (артикул не распознан) и положительные (найден ID номенклатуры)
+    живут разное время: справочник производителя пополняется, и отрицательный
+    результат стоит перепроверять чаще.
+    """
+
+    NEGATIVE_STATUSES = ('skipped_invalid_article', 'skipped_no_match')
+    POSITIVE_STATUS = 'linked'
+
+    def __init__(self, state_dir: str, positive_ttl_seconds: float, negative_ttl_seconds: float):
+        self.positive_ttl_seconds = positive_ttl_seconds
+        self.negative_ttl_seconds = negative_ttl_seconds
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self.conn = open_state_db(state_dir)
+        self.conn.execute(
+            'CREATE TABLE IF NOT EXISTS article_resolution ('
+            ' distr_code TEXT NOT NULL,'
+            ' article TEXT NOT NULL,'
+            ' status TEXT NOT NULL,'
+            ' nomenclature_id TEXT NOT NULL,'
+            ' message TEXT NOT NULL,'
+            ' checked_at REAL NOT NULL,'
+            ' PRIMARY KEY (distr_code, article))'
+        )
+        self._purge()
+
+    def _ttl(self, status: str) -> float:
+        return self.positive_ttl_seconds if status == self.POSITIVE_STATUS else self.negative_ttl_seconds
+
+    def _purge(self):
+        now = time.time()
+        with self._lock:
+            self.conn.execute(
+                'DELETE FROM article_resolution WHERE (status = ? AND checked_at < ?) OR (status != ? AND checked_at < ?)',
+                (self.POSITIVE_STATUS, now - self.positive_ttl_seconds,
+                 self.POSITIVE_STATUS, now - self.negative_ttl_seconds)
+            )
+            self.conn.commit()
+
+    def _lookup(self, distr_code: str, article: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            row = self.conn.execute(
+                'SELECT status, nomenclature_id, message, checked_at FROM article_resolution '
+                'WHERE distr_code = ? AND article = ?',
+                (distr_code or '', article)
+            ).fetchone()
+        if not row or time.time() - row[3] > self._ttl(row[0]):
+            return None
+        return {'status': row[0], 'nomenclature_id': row[1], 'message': row[2], 'checked_at': row[3]}
+
+    def get(self, distr_code: str, article: str) -> Optional[Dict[str, Any]]:
+        """Свежая запись {status, nomenclature_id, message, checked_at} или None."""
+        entry = self._lookup(distr_code, article)
+        with self._lock:
+            if entry:
+                self.hits += 1
+            else:
+                self.misses += 1
+        return entry
+
+    def put(self, distr_code: str, article: str, status: str, nomenclature_id: str = '', message: str = ''):
+        """Запоминает итог обработки; статусы кроме linked/skipped_* (ошибки) не кэшируются."""
+        if status != self.POSITIVE_STATUS and status not in self.NEGATIVE_STATUSES:
+            return
+        with self._lock:
+            self.conn.execute(
+                'INSERT OR REPLACE INTO article_resolution VALUES (?, ?, ?, ?, ?, ?)',
+                (distr_code or '', article, status, nomenclature_id or '', message or '', time.time())
+            )
+            self.conn.commit()
+
+    def close(self):
+        self.conn.close()
+
+
+class OutboxFull(Exception):
+    """В очереди отправки уже max_entries неотправленных записей; новая запись не сохранена."""
+
+
+class Outbox:
+    """
+    Очередь исходящих отправок в API. Данные сначала фиксируются локально, затем
+    отправляются по порядку; неотправленное остаётся в очереди до следующего запуска.
+    api_key в очереди не хранится - его добавляет клиент доставки.
+    max_entries (0 - без ограничения) - предел неотправленных записей: сверх него
+    enqueue отказывает (OutboxFull), накопленные записи не удаляются; refused - число
+    отклонённых так отправок за время жизни объекта.
+    """
+
+    def __init__(self, state_dir: str, source: str, max_entries: int = 0):
+        self.source = source
+        self.max_entries = max_entries
+        self.refused = 0
+        self._lock = threading.Lock()
+        self.conn = open_state_db(state_dir)
+        self.conn.execute(
+            'CREATE TABLE IF NOT EXISTS outbox ('
+            ' id INTEGER PRIMARY KEY AUTOINCREMENT,'
+            ' source TEXT NOT NULL,'
+            ' payload TEXT NOT NULL,'
+            ' created_at REAL NOT NULL,'
+            ' attempts INTEGER NOT NULL DEFAULT 0,'
+            ' last_error TEXT NOT NULL DEFAULT \'\')'
+        )
+        self.conn.commit()
+
+    def enqueue(self, items: List[Dict[str, Any]], extra: Optional[Dict[str, Any]] = None,
+                meta: Optional[Dict[str, Any]] = None) -> int:
+        """Сохраняет отправку (items + поля запроса extra + служебные meta). Возвращает id записи."""
+        payload = json.dumps({'items': items, 'extra': extra or {}, 'meta': meta or {}}, ensure_ascii=False, default=str)
+        with self._lock:
+            if self.max_entries:
+                queued = self.conn.execute('SELECT COUNT(*) FROM outbox WHERE source = ?', (self.source,)).fetchone()[0]
+                if queued >= self.max_entries:
+                    self.refused += 1
+                    raise OutboxFull(
+                        f"в очереди отправки {queued} неотправленных записей (OUTBOX_MAX_ENTRIES={self.max_entries})"
+                    )
+            cursor = self.conn.execute(
+                'INSERT INTO outbox (source, payload, created_at) VALUES (?, ?, ?)',
+                (self.source, payload, time.time())
+            )
+            entry_id = cursor.lastrowid
+            self.conn.commit()
+        return entry_id
+
+    def pending(self) -> List[Dict[str, Any]]:
+        """Неотправленные записи в порядке постановки."""
+        with self._lock:
+            rows = self.conn.execute(
+                'SELECT id, payload, created_at, attempts FROM outbox WHERE source = ? ORDER BY id',
+                (self.source,)
+            ).fetchall()
+        entries = []
+        for entry_id, payload, created_at, attempts in rows:
+            data = json.loads(payload)
+            data.update({'id': entry_id, 'created_at': created_at, 'attempts': attempts})
+            entries.append(data)
+        return entries
+
+    def mark_delivered(self, entry_id: int):
+        with self._lock:
+            self.conn.execute('DELETE FROM outbox WHERE id = ?', (entry_id,))
+            self.conn.commit()
+
+    def mark_failed(self, entry_id: int, error: str):
+        with self._lock:
+            self.conn.execute(
+                'UPDATE outbox SET attempts = attempts + 1, last_error = ? WHERE id = ?',
+                (error or '', entry_id)
+            )
+            self.conn.commit()
+
+    def close(self):
+        self.conn.close()
+
+
+class StateValues:
+    """Отдельные значения состояния (метки времени, отпечатки и т.п.) в виде JSON по ключу."""
+
+    def __init__(self, state_dir: str):
+        self._lock = threading.Lock()
+        self.conn = open_state_db(state_dir)
+        self.conn.execute(
+            'CREATE TABLE IF NOT EXISTS state_values ('
+            ' key TEXT PRIMARY KEY,'
+            ' value TEXT NOT NULL,'
+            ' updated_at REAL NOT NULL)'
+        )
+        self.conn.commit()
+
+    def get(self, key: str, default: Any = None) -> Any:
+        with self._lock:
+            row = self.conn.execute('SELECT value FROM state_values WHERE key = ?', (key,)).fetchone()
+        return json.loads(row[0]) if row else default
+
+    def set(self, key: str, value: Any):
+        with self._lock:
+            self.conn.execute(
+                'INSERT OR REPLACE INTO state_values VALUES (?, ?, ?)',
+                (key, json.dumps(value, ensure_ascii=False, default=str), time.time())
+            )
+            self.conn.commit()
+
+    def close(self):
+        self.conn.close()
+
+
+class ReportSnapshot:
+    """
+    Последний подтверждённый API снимок отчётов: хэш содержимого по distr_id.
+    Обновляется только после успешной доставки, поэтому дельта всегда считается
+    относительно того, что сервер действительно получил.
+    """
+
+    def __init__(self, state_dir: str):
+        self._lock = threading.Lock()
+        self.conn = open_state_db(state_dir)
+        self.conn.execute(
+            'CREATE TABLE IF NOT EXISTS report_snapshot ('
+            ' distr_id INTEGER PRIMARY KEY,'
+            ' hash TEXT NOT NULL,'
+            ' acked_at REAL NOT NULL)'
+        )
+        self.conn.commit()
+
+    def hashes(self) -> Dict[int, str]:
+        with self._lock:
+            rows = self.conn.execute('SELECT distr_id, hash FROM report_snapshot').fetchall()
+        return {distr_id: value for distr_id, value in rows}
+
+    def apply(self, hashes: Dict[Any, str], removed: List[int], full: bool = False):
+        """Фиксирует доставленное: full заменяет весь снимок, иначе - точечное обновление."""
+        now = time.time()
+        with self._lock:
+            if full:
+                self.conn.execute('DELETE FROM report_snapshot')
+            self.conn.executemany(
+                'INSERT OR REPLACE INTO report_snapshot VALUES (?, ?, ?)',
+                [(int(distr_id), value, now) for distr_id, value in hashes.items()]
+            )
+            self.conn.executemany(
+                'DELETE FROM report_snapshot WHERE distr_id = ?', [(int(distr_id),) for distr_id in removed]
+            )
+            self.conn.commit()
+
+    def close(self):
+        self.conn.close()
+
+
+class LinkJournal:
+    """
+    Журнал хода привязки товаров: каждый результат записывается сразу после обработки.
+    Если запуск прервался (падение Chrome, таймаут задания), следующий запуск пропускает
+    товары, уже дошедшие до конечного статуса, и досылает накопленные результаты.
+    Запуск считается завершённым после finish_run.
+    """
+
+    TERMINAL_STATUSES = ('linked', 'skipped_invalid_article', 'skipped_no_match')
+
+    def __init__(self, state_dir: str):
+        self._lock = threading.Lock()
+        self.conn = open_state_db(state_dir)
+        self.conn.execute(
+            'CREATE TABLE IF NOT EXISTS link_runs ('
+            ' run_id TEXT PRIMARY KEY,'
+            ' started_at REAL NOT NULL,'
+            ' finished_at REAL)'
+        )
+        self.conn.execute(
+            'CREATE TABLE IF NOT EXISTS link_journal ('
+            ' id INTEGER PRIMARY KEY AUTOINCREMENT,'
+            ' run_id TEXT NOT NULL,'
+            ' item_key TEXT NOT NULL,'
+            ' status TEXT NOT NULL,'
+            ' result TEXT NOT NULL,'
+            ' created_at REAL NOT NULL,'
+            ' delivered INTEGER NOT NULL DEFAULT 0)'
+        )
+        self.conn.commit()
+
+    def start_run(self, run_id: str):
+        with self._lock:
+            self.conn.execute('INSERT OR IGNORE INTO link_runs VALUES (?, ?, NULL)', (run_id, time.time()))
+            self.conn.commit()
+
+    def resume_keys(self, max_age_seconds: float) -> set:
+        """Товары в конечном статусе из незавершённых запусков не старше max_age_seconds."""
+        with self._lock:
+            rows = self.conn.execute(
+                'SELECT j.item_key FROM link_journal j JOIN link_runs r ON r.run_id = j.run_id'
+                ' WHERE r.finished_at IS NULL AND r.started_at >= ? AND j.status IN (?, ?, ?)',
+                (time.time() - max_age_seconds, *self.TERMINAL_STATUSES)
+            ).fetchall()
+        return {row[0] for row in rows}
+
+    def append(self, run_id: str, item_key: str, result: Dict[str, Any]):
+        with self._lock:
+            self.conn.execute(
+                'INSERT INTO link_journal (run_id, item_key, status, result, created_at) VALUES (?, ?, ?, ?, ?)',
+                (run_id, item_key, result['status'], json.dumps(result, ensure_ascii=False, default=str), time.time())
+            )
+            self.conn.commit()
+
+    def undelivered(self) -> List[Dict[str, Any]]:
+        """Ещё не переданные в API результаты в порядке записи: [{'id', 'result'}]."""
+        with self._lock:
+            rows = self.conn.execute(
+                'SELECT id, result FROM link_journal WHERE delivered = 0 ORDER BY id'
+            ).fetchall()
+        return [{'id': entry_id, 'result': json.loads(result)} for entry_id, result in rows]
+
+    def mark_delivered(self, entry_ids: List[int]):
+        with self._lock:
+            self.conn.executemany('UPDATE link_journal SET delivered = 1 WHERE id = ?', [(i,) for i in entry_ids])
+            self.conn.commit()
+
+    def finish_run(self, keep_seconds: float = 7 * 24 * 3600):
+        """Закрывает все незавершённые запуски (текущий и те, что он продолжил) и чистит старое."""
+        with self._lock:
+            now = time.time()
+            self.conn.execute('UPDATE link_runs SET finished_at = ? WHERE finished_at IS NULL', (now,))
+            self.conn.execute(
+                'DELETE FROM link_journal WHERE delivered = 1 AND created_at < ?', (now - keep_seconds,)
+            )
+            self.conn.execute(
+                'DELETE FROM link_runs WHERE finished_at < ? AND run_id NOT IN (SELECT run_id FROM link_journal)',
+                (now - keep_seconds,)
+            )
+            self.conn.commit()
+
+    def close(self):
+        self.conn.close()
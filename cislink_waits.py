@@ -0,0 +1,176 @@
+"""
+Ожидания готовности страниц CISLink для Selenium-агентов.
+
+Профиль fast (по умолчанию) ждёт реальные сигналы готовности: document.readyState,
+завершение ASP.NET/jQuery-запросов, смену видимости элементов, замену устаревших
+элементов после postback-а. Каждое ожидание ограничено сверху (WAIT_<ИМЯ>_TIMEOUT).
+Профиль conservative (WAIT_PROFILE=conservative) повторяет прежние фиксированные паузы.
+"""
+
+import os
+import time
+import logging
+from typing import Callable, Optional, Dict, Any
+
+from selenium.common.exceptions import TimeoutException, StaleElementReferenceException
+from selenium.webdriver.support.ui import WebDriverWait
+
+from cislink_metrics import get_profile, sleep
+
+logger = logging.getLogger(__name__)
+
+WAIT_PROFILE = os.getenv('WAIT_PROFILE', 'fast').lower()
+
+# Верхние границы ожиданий в секундах, переопределяются через WAIT_<ИМЯ>_TIMEOUT
+DEFAULT_BOUNDS = {
+    'page': 15,
+    'postback': 15,
+    'popup': 10,
+    'validation': 10,
+    'element': 5,
+}
+
+POLL_INTERVAL = 0.1
+
+# Страница разобрана и нет незавершённых UpdatePanel/jQuery-запросов
+PAGE_IDLE_SCRIPT = """
+    if (document.readyState === 'loading') return false;
+    var prm = window.Sys && Sys.WebForms && Sys.WebForms.PageRequestManager;
+    if (prm && prm.getInstance().get_isInAsyncPostBack()) return false;
+    if (window.jQuery && jQuery.active > 0) return false;
+    return true;
+"""
+
+ELEMENT_SHOWN_SCRIPT = """
+    var el = document.getElementById(arguments[0]);
+    if (!el) return false;
+    var style = window.getComputedStyle(el);
+    return style.display !== 'none' && style.visibility !== 'hidden' && el.getClientRects().length > 0;
+"""
+
+# Начало ухода со страницы (отправка формы postback-а): до ответа сервера старый DOM ещё жив
+WATCH_NAVIGATION_SCRIPT = """
+    window.__cislinkLeaving = false;
+    window.addEventListener('beforeunload', function() { window.__cislinkLeaving = true; });
+"""
+
+CHECKBOX_STATE_SCRIPT = """
+    if (window.__cislinkLeaving) return false;
+    var el = document.getElementById(arguments[0]);
+    return !!el && el.checked === arguments[1];
+"""
+
+# Сколько ждать начала postback-а после клика, если элемент так и не устарел
+POSTBACK_START_GRACE = 0.3
+
+INPUT_VALUE_SCRIPT = """
+    var el = document.getElementById(arguments[0]);
+    return !!el && (el.value || '').trim().length > 0;
+"""
+
+
+def load_bounds() -> Dict[str, float]:
+    return {
+        name: float(os.getenv(f'WAIT_{name.upper()}_TIMEOUT', default))
+        for name, default in DEFAULT_BOUNDS.items()
+    }
+
+
+class PageWaiter:
+    """
+    Набор ожиданий поверх одного драйвера. Каждый метод принимает legacy - прежнюю
+    фиксированную паузу, которая используется только в профиле conservative.
+    Методы возвращают True, если условие выполнилось, и False по таймауту
+    (по таймауту работа продолжается так же, как после старой паузы).
+    """
+
+    def __init__(self, driver, profile: Optional[str] = None, bounds: Optional[Dict[str, float]] = None):
+        self.driver = driver
+        self.profile = (profile or WAIT_PROFILE).lower()
+        self.bounds = bounds or load_bounds()
+
+    @property
+    def conservative(self) -> bool:
+        return self.profile == 'conservative'
+
+    def pause(self, seconds: float):
+        """Пауза, нужная только старому профилю (например, между вводом в поля)."""
+        if self.conservative:
+            sleep(seconds)
+
+    def until(self, condition: Callable[[Any], Any], bound: str, legacy: float) -> bool:
+        if self.conservative:
+            sleep(legacy)
+            return True
+        started = time.monotonic()
+        try:
+            WebDriverWait(
+                self.driver, self.bounds[bound], poll_frequency=POLL_INTERVAL,
+                ignored_exceptions=(StaleElementReferenceException,)
+            ).until(condition)
+            return True
+        except TimeoutException:
+            logger.debug(f"Ожидание '{bound}' не дождалось условия за {self.bounds[bound]} с")
+            return False
+        finally:
+            get_profile().record_wait(time.monotonic() - started)
+
+    def _page_idle(self, driver) -> bool:
+        return bool(driver.execute_script(PAGE_IDLE_SCRIPT))
+
+    @staticmethod
+    def _is_stale(element) -> bool:
+        try:
+            element.is_enabled()
+            return False
+        except StaleElementReferenceException:
+            return True
+
+    def page_ready(self, legacy: float) -> bool:
+        """После driver.get: DOM разобран, асинхронных запросов нет."""
+        return self.until(self._page_idle, 'page', legacy)
+
+    def postback_complete(self, reference, legacy: float) -> bool:
+        """
+        После клика, вызывающего postback: reference (элемент до клика) устарел -
+        страница или UpdatePanel перерисованы - и новая страница простаивает.
+        """
+        return self.until(
+            lambda d: self._is_stale(reference) and self._page_idle(d), 'postback', legacy
+        )
+
+    def watch_navigation(self):
+        """Вызывается перед кликом, после которого ждут checkbox_applied."""
+        if not self.conservative:
+            self.driver.execute_script(WATCH_NAVIGATION_SCRIPT)
+
+    def checkbox_applied(self, reference, element_id: str, checked: bool, legacy: float) -> bool:
+        """
+        После клика по чекбоксу с AutoPostBack: чекбокс (найденный заново по id) в состоянии
+        checked и страница простаивает. Не требует, чтобы reference устарел: если клик
+        не вызвал postback, ожидание заканчивается через POSTBACK_START_GRACE, а не по таймауту.
+        Пока уходит запрос postback-а (beforeunload, см. watch_navigation), состояние не засчитывается.
+        """
+        started = time.monotonic()
+
+        def applied(driver) -> bool:
+            if not self._is_stale(reference) and time.monotonic() - started < POSTBACK_START_GRACE:
+                return False
+            return self._page_idle(driver) and driver.execute_script(CHECKBOX_STATE_SCRIPT, element_id, checked)
+
+        return self.until(applied, 'postback', legacy)
+
+    def element_visible(self, element_id: str, legacy: float, bound: str = 'popup') -> bool:
+        return self.until(
+            lambda d: d.execute_script(ELEMENT_SHOWN_SCRIPT, element_id), bound, legacy
+        )
+
+    def element_hidden(self, element_id: str, legacy: float, bound: str = 'element') -> bool:
+        return self.until(
+            lambda d: not d.execute_script(ELEMENT_SHOWN_SCRIPT, element_id), bound, legacy
+        )
+
+    def input_has_value(self, element_id: str, legacy: float, bound: str = 'validation') -> bool:
+        return self.until(
+            lambda d: d.execute_script(INPUT_VALUE_SCRIPT, element_id), bound, legacy
+        )
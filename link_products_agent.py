@@ -7,28 +7,31 @@
 2. Заходит на страницу выбора дистрибьюторов (Dictionary/Default.aspx)
    и нажимает "Выбрать все" (чекбокс cbDistrs)
 3. Открывает страницу непривязанных товаров (reportId=13, contentId=3)
-4. Собирает список товаров (до MAX_ITEMS_PER_RUN) с ссылками на карточки и артикулами
+4. Собирает список товаров (до MAX_ITEMS_PER_RUN) со всех страниц списка,
+   предварительно выставив максимальный размер страницы
 5. Для каждого товара:
    - Открывает карточку
    - Вбивает артикул дистрибьютора в поле #inpTextCode ("Номенклатура Артикул")
    - Триггерит blur - система запускает валидацию (функция enter_code)
    - Если #lblTextCodeError стал видим - артикул не распознан, пропуск
    - Если #btnSave стал видим и #inpManfCode заполнен - жмем Сохранить
+   Перед этим артикулы пачки проверяются через enter_code на одной карточке,
+   и карточки с нераспознанными артикулами не открываются вовсе
 6. Отправляет итоговый отчет в API
 """
 
 import os
+import re
 import time
+import queue
 import logging
+import threading
 from datetime import datetime
-from typing import Optional, List, Dict, Any
+from typing import Callable, Optional, List, Dict, Any, Iterable, Iterator, Tuple
 
 import requests
-from selenium import webdriver
 from selenium.webdriver.common.by import By
-from selenium.webdriver.chrome.service import Service
-from selenium.webdriver.chrome.options import Options
-from selenium.webdriver.support.ui import WebDriverWait
+from selenium.webdriver.support.ui import WebDriverWait, Select
 from selenium.webdriver.support import expected_conditions as EC
 from selenium.webdriver.common.keys import Keys
 from selenium.common.exceptions import (
@@ -37,7 +40,17 @@ from selenium.common.exceptions import (
     ElementClickInterceptedException,
     StaleElementReferenceException
 )
-from webdriver_manager.chrome import ChromeDriverManager
+
+from cislink_browser import browser_rss, create_driver, terminate_driver
+from cislink_delivery import DeliveryClient, drain_outbox
+from cislink_metrics import PROFILE_PAYLOAD, get_profile, profiled
+from cislink_pacing import get_pacer
+from cislink_session import (
+    ENCRYPTION_AVAILABLE, SessionStore, apply_browser_cookies, check_browser_session,
+    restore_session, save_session
+)
+from cislink_state import ArticleResolutionCache, LinkJournal, Outbox, OutboxFull
+from cislink_waits import PageWaiter
 
 logging.basicConfig(
     level=logging.INFO,
@@ -46,10 +59,13 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# Другой адрес портала, например локальный макет bench/mock_cislink.py
+CISLINK_URL = os.getenv('CISLINK_URL', 'https://b2b.cislinkdts.com').rstrip('/')
+
 CONFIG = {
-    'cislink_url': 'https://b2b.cislinkdts.com',
-    'distributors_page_url': 'https://b2b.cislinkdts.com/Dictionary/Default.aspx',
-    'unlinked_page_url': 'https://b2b.cislinkdts.com/Dictionary/DGrid.aspx?reportId=13&contentId=3',
+    'cislink_url': CISLINK_URL,
+    'distributors_page_url': f'{CISLINK_URL}/Dictionary/Default.aspx',
+    'unlinked_page_url': f'{CISLINK_URL}/Dictionary/DGrid.aspx?reportId=13&contentId=3',
     'cislink_login': os.getenv('CISLINK_LOGIN'),
     'cislink_password': os.getenv('CISLINK_PASSWORD'),
     'api_url': os.getenv('API_URL'),
@@ -59,6 +75,46 @@ CONFIG = {
     'max_items_per_run': int(os.getenv('MAX_ITEMS_PER_RUN', '50')),
     'validation_wait_seconds': 3,
     'save_wait_seconds': 3,
+    # Число параллельных браузеров для обработки карточек (1 - последовательно)
+    'link_concurrency': max(1, int(os.getenv('LINK_CONCURRENCY', '1'))),
+    # Пакетная проверка артикулов на одной загруженной карточке до открытия остальных
+    'batch_validation': os.getenv('BATCH_VALIDATION', 'True').lower() == 'true',
+    'batch_validation_size': int(os.getenv('BATCH_VALIDATION_SIZE', '100')),
+    'batch_article_timeout': 10,
+    # Доставка в API: размер пакета, сжатие, число попыток
+    'api_batch_bytes': int(os.getenv('API_BATCH_BYTES', '1000000')),
+    # gzip тела запроса - только если API его разжимает (иначе сервер ответит 400/422 или success: false)
+    'api_gzip': os.getenv('API_GZIP', 'False').lower() == 'true',
+    'api_max_attempts': int(os.getenv('API_MAX_ATTEMPTS', '5')),
+    # Локальная очередь отправок: результаты не теряются при недоступности API
+    'outbox_enabled': os.getenv('OUTBOX', 'True').lower() == 'true',
+    # Предел неотправленных записей в очереди (0 - без ограничения); при переполнении
+    # новая отправка не ставится в очередь и запуск завершается ошибкой
+    'outbox_max_entries': int(os.getenv('OUTBOX_MAX_ENTRIES', '0')),
+    # Кэш результатов проверки артикулов между запусками
+    'state_dir': os.getenv('STATE_DIR', '.cislink_state'),
+    'resolution_cache': os.getenv('RESOLUTION_CACHE', 'True').lower() == 'true',
+    'resolution_positive_ttl_hours': float(os.getenv('RESOLUTION_POSITIVE_TTL_HOURS', '720')),
+    'resolution_negative_ttl_hours': float(os.getenv('RESOLUTION_NEGATIVE_TTL_HOURS', '72')),
+    # Оценка времени на карточку, если в запуске не было ни одной открытой карточки
+    'estimated_card_seconds': 8,
+    'debugging_port': 9222,
+    # Повторное использование сессии CISLink (куки + выбор дистрибьюторов) между запусками
+    'session_reuse': os.getenv('SESSION_REUSE', 'True').lower() == 'true',
+    'session_max_age_hours': float(os.getenv('SESSION_MAX_AGE_HOURS', '12')),
+    'session_key': os.getenv('SESSION_KEY'),
+    # Постоянный профиль Chrome (--user-data-dir) для основного браузера
+    'chrome_profile_dir': os.getenv('CHROME_PROFILE_DIR', ''),
+    # Журнал хода привязки: продолжение прерванного запуска и отправка результатов частями
+    'journal_enabled': os.getenv('LINK_JOURNAL', 'True').lower() == 'true',
+    'journal_flush_items': int(os.getenv('LINK_JOURNAL_FLUSH_ITEMS', '20')),
+    'journal_resume_hours': float(os.getenv('LINK_JOURNAL_RESUME_HOURS', '48')),
+    # Сторож: жёсткий лимит времени на товар (браузер убивается и перезапускается),
+    # плановый перезапуск браузера после N карточек или при превышении памяти
+    'item_deadline_seconds': float(os.getenv('ITEM_DEADLINE_SECONDS', '120')),
+    'page_load_timeout': float(os.getenv('PAGE_LOAD_TIMEOUT', '60')),
+    'recycle_after_items': int(os.getenv('DRIVER_RECYCLE_ITEMS', '200')),
+    'recycle_max_rss_mb': float(os.getenv('DRIVER_MAX_RSS_MB', '1200')),
 }
 
 # Точные id элементов, полученные по результатам разведки HTML-разметки
@@ -83,54 +139,336 @@ SELECTORS = {
     'card_form': 'aspnetForm',
 }
 
+# Счётчик XHR/fetch страницы (window.__cislinkPending): count - незавершённые, seen - все запущенные.
+# Ставится один раз на документ; по нему видно, что запросы enter_code закончились.
+PENDING_REQUESTS_SCRIPT = """
+    if (!window.__cislinkPending) {
+        var state = window.__cislinkPending = {count: 0, seen: 0, mark: 0, markedAt: 0};
+        var send = XMLHttpRequest.prototype.send;
+        XMLHttpRequest.prototype.send = function() {
+            state.count++; state.seen++;
+            this.addEventListener('loadend', function() { setTimeout(function() { state.count--; }, 0); });
+            return send.apply(this, arguments);
+        };
+        if (window.fetch) {
+            var origFetch = window.fetch;
+            window.fetch = function() {
+                state.count++; state.seen++;
+                return origFetch.apply(this, arguments).finally(function() {
+                    setTimeout(function() { state.count--; }, 0);
+                });
+            };
+        }
+    }
+"""
+
+# Ввод артикула в карточку: значение в inpTextCode и события input/change/blur -> enter_code.
+# Перед вводом запоминается счётчик запросов (mark), чтобы VALIDATION_SETTLED_SCRIPT
+# видел только запросы этого ввода.
+SET_ARTICLE_SCRIPT = PENDING_REQUESTS_SCRIPT + """
+    var el = document.getElementById(arguments[0]);
+    if (!el) return false;
+    var pending = window.__cislinkPending;
+    pending.mark = pending.seen;
+    pending.markedAt = Date.now();
+    el.focus();
+    el.value = arguments[1];
+    el.dispatchEvent(new Event('input', { bubbles: true }));
+    el.dispatchEvent(new Event('change', { bubbles: true }));
+    el.blur();
+    return true;
+"""
+
+# Валидация enter_code завершилась: показана ошибка артикула,
+# либо подтянулся ID номенклатуры и появилась кнопка Сохранить,
+# либо запросы enter_code закончились (артикул без совпадения ничего не показывает).
+# Если enter_code запросов не делал, ждём VALIDATION_QUIET_MS после ввода;
+# если вместо XHR был полный postback, счётчика на новой странице нет - ждём её загрузки.
+VALIDATION_QUIET_MS = 300
+VALIDATION_SETTLED_SCRIPT = """
+    function shown(el) {
+        return !!el && window.getComputedStyle(el).display !== 'none' && el.getClientRects().length > 0;
+    }
+    var error = document.getElementById(arguments[0]);
+    if (shown(error) && (error.innerText || '').trim()) return true;
+    var manf = document.getElementById(arguments[2]);
+    if (shown(document.getElementById(arguments[1])) && !!manf && (manf.value || '').trim().length > 0) return true;
+    var pending = window.__cislinkPending;
+    if (!pending) return document.readyState === 'complete';
+    return pending.count === 0 && (pending.seen > pending.mark || Date.now() - pending.markedAt > arguments[3]);
+"""
+
+# Строки текущей страницы gvList за один round trip (те же колонки, что и при поэлементном обходе)
+EXTRACT_ITEMS_SCRIPT = """
+    var table = document.getElementById(arguments[0]);
+    if (!table) return null;
+    var links = table.querySelectorAll("a[id^='" + arguments[0] + "_ctl'][id$='" + arguments[1] + "']");
+    var items = [];
+    for (var i = 0; i < links.length; i++) {
+        var row = links[i].closest('tr');
+        if (!row || row.cells.length < 7) continue;
+        items.push({
+            product_name: (links[i].innerText || '').trim(),
+            detail_url: links[i].href || '',
+            article: (row.cells[4].innerText || '').trim(),
+            distr_code: (row.cells[6].innerText || '').trim()
+        });
+    }
+    return items;
+"""
+
+# Ссылки пейджера GridView: __doPostBack('<UniqueID gvList>','Page$N')
+PAGER_LINKS_SCRIPT = """
+    var table = document.getElementById(arguments[0]);
+    if (!table) return [];
+    var links = table.querySelectorAll("a[href*='Page$']");
+    var hrefs = [];
+    for (var i = 0; i < links.length; i++) hrefs.push(links[i].getAttribute('href'));
+    return hrefs;
+"""
+# Пакетная проверка артикулов (execute_async_script) на уже открытой карточке.
+# Для каждого артикула повторяет то же, что process_item: значение в inpTextCode,
+# события input/change/blur -> enter_code. Конец проверки определяется по завершению
+# XHR/fetch, которые запустил enter_code (счётчик ставится на XMLHttpRequest/fetch),
+# после чего читается то же состояние, что и в process_item.
+# Перед каждым артикулом сбрасывается ID номенклатуры и запоминается состояние, которое
+# оставил предыдущий: видимость #btnSave (save_before) и видимая ошибка #lblTextCodeError.
+# Ошибка определяется по видимости метки (текст может быть статичным); если после ввода
+# видна та же ошибка, что и до него, она могла остаться от предыдущего артикула -
+# такой артикул не считается проверенным (settled = false) и проверяется на своей карточке.
+BATCH_VALIDATE_SCRIPT = PENDING_REQUESTS_SCRIPT + """
+    var done = arguments[arguments.length - 1];
+    var ids = arguments[0], articles = arguments[1], timeoutMs = arguments[2], quietMs = arguments[3];
+    var input = document.getElementById(ids.article);
+    if (!input) { done(null); return; }
+    var error = document.getElementById(ids.error);
+    var save = document.getElementById(ids.save);
+    var manf = document.getElementById(ids.manf);
+    var pending = window.__cislinkPending;
+    function shown(el) {
+        return !!el && window.getComputedStyle(el).display !== 'none' && el.getClientRects().length > 0;
+    }
+    var results = {};
+    var i = 0;
+    function next() {
+        if (i >= articles.length) { done(results); return; }
+        var article = articles[i++];
+        if (manf) manf.value = '';
+        var errorBefore = shown(error) ? (error.innerText || '').trim() : '';
+        var saveBefore = shown(save);
+        var seenBefore = pending.seen;
+        var started = Date.now();
+        input.focus();
+        input.value = article;
+        input.dispatchEvent(new Event('input', { bubbles: true }));
+        input.dispatchEvent(new Event('change', { bubbles: true }));
+        input.blur();
+        (function poll() {
+            var elapsed = Date.now() - started;
+            var requested = pending.seen > seenBefore;
+            var settled = pending.count === 0 && (requested || elapsed > quietMs);
+            if (!settled && elapsed < timeoutMs) { setTimeout(poll, 50); return; }
+            var errorText = shown(error) ? (error.innerText || '').trim() : '';
+            var carried = errorText !== '' && errorText === errorBefore;
+            var id = manf ? (manf.value || '').trim() : '';
+            results[article] = {
+                settled: settled && !carried,
+                error: errorText,
+                nomenclature_id: id,
+                save_visible: shown(save),
+                save_before: saveBefore
+            };
+            next();
+        })();
+    }
+    next();
+"""
+
+PAGER_PATTERN = re.compile(r"__doPostBack\('([^']+)','Page\$(\w+)'\)")
+
+
+def open_resolution_cache() -> Optional[ArticleResolutionCache]:
+    if not CONFIG['resolution_cache']:
+        return None
+    try:
+        return ArticleResolutionCache(
+            CONFIG['state_dir'],
+            positive_ttl_seconds=CONFIG['resolution_positive_ttl_hours'] * 3600,
+            negative_ttl_seconds=CONFIG['resolution_negative_ttl_hours'] * 3600
+        )
+    except Exception as e:
+        logger.warning(f"Кэш артикулов недоступен: {e}")
+        return None
+
 
 class CISLinkLinker:
-    def __init__(self):
+    def __init__(self, resolution_cache: Optional[ArticleResolutionCache] = None):
         self.driver = None
         self.wait = None
+        self.waiter = None
+        self.resolution_cache = resolution_cache
         self.results: List[Dict[str, Any]] = []
+        self.distributors_selected = False
+        self.owns_driver = True
+        self.restart_driver: Optional[Callable[[], Any]] = None
+        self.journal: Optional[LinkJournal] = None
+        self.run_id = ''
+        self.resume_skip: set = set()
+        self.on_progress: Optional[Callable[[], None]] = None
+        self._progress_lock = threading.Lock()
+        self.debugging_port: Optional[int] = None
+        self.session_cookies: List[Dict[str, Any]] = []
+        self.items_since_start = 0
+        self.recycles = 0
+        self.peak_rss = 0
+        self.pacer = get_pacer()
+        self.profile = get_profile()
 
-    def init_browser(self):
+    def init_browser(self, debugging_port: Optional[int] = None):
         logger.info("Инициализация браузера...")
-        options = Options()
-        if not CONFIG['debug_mode']:
-            options.add_argument('--headless=new')
-        options.add_argument('--no-sandbox')
-        options.add_argument('--disable-dev-shm-usage')
-        options.add_argument('--disable-gpu')
-        options.add_argument('--window-size=1920,1080')
-        options.add_argument('--disable-blink-features=AutomationControlled')
-        options.add_experimental_option('excludeSwitches', ['enable-automation'])
-        options.add_experimental_option('useAutomationExtension', False)
-        options.add_argument('--lang=ru-RU')
-        options.add_argument('--disable-extensions')
-        options.add_argument('--disable-infobars')
-        options.add_argument('--remote-debugging-port=9222')
-
-        service = Service(ChromeDriverManager().install())
-        self.driver = webdriver.Chrome(service=service, options=options)
-        self.driver.execute_script(
-            "Object.defineProperty(navigator, 'webdriver', {get: () => undefined})"
-        )
+        self.debugging_port = debugging_port
+        self.use_driver(create_driver(
+            headless=not CONFIG['debug_mode'],
+            debugging_port=debugging_port or CONFIG['debugging_port'],
+            # Профиль может быть открыт только одним Chrome - воркеры получают куки копированием
+            profile_dir='' if debugging_port else CONFIG['chrome_profile_dir'],
+            state_dir=CONFIG['state_dir']
+        ))
+        logger.info(f"Браузер запущен (профиль ожиданий: {self.waiter.profile})")
+
+    def use_driver(self, driver, owned: bool = True, restart: Optional[Callable[[], Any]] = None):
+        """
+        Работа на готовом драйвере; owned=False - драйвер общий и close() его не закрывает.
+        Общий драйвер перезапускает его владелец: restart() закрывает старый браузер и
+        возвращает новый драйвер (без restart перезапуск общего драйвера не выполняется).
+        """
+        self.driver = driver
+        self.owns_driver = owned
+        self.restart_driver = None if owned else restart
+        self.items_since_start = 0
         self.wait = WebDriverWait(self.driver, CONFIG['timeout'])
-        logger.info("Браузер запущен")
+        self.waiter = PageWaiter(self.driver)
+        if CONFIG['page_load_timeout']:
+            self.driver.set_page_load_timeout(CONFIG['page_load_timeout'])
+
+    def run_with_deadline(self, seconds: float, label: str, func: Callable, *args) -> Tuple[Any, bool]:
+        """
+        Выполняет func(*args) с жёстким лимитом времени. Если лимит истёк, сторож убивает
+        браузер - зависшая команда WebDriver тут же завершается ошибкой, - и браузер
+        перезапускается с той же сессией. Возвращает (результат func, истёк ли лимит).
+        Общий драйвер без restart (см. use_driver) перезапустить нельзя: превышение
+        только записывается в лог, func дорабатывает сама.
+        """
+        if not seconds:
+            return func(*args), False
+        state = {'finished': False, 'expired': False}
+        lock = threading.Lock()
 
+        def expire():
+            if not self.can_recycle:
+                logger.warning(f"{label}: превышен лимит {seconds:.0f} с, браузер общий и не перезапускается")
+                return
+            with lock:
+                if state['finished']:
+                    return
+                state['expired'] = True
+            logger.warning(f"{label}: превышен лимит {seconds:.0f} с - браузер будет перезапущен")
+            terminate_driver(self.driver)
+
+        timer = threading.Timer(seconds, expire)
+        timer.daemon = True
+        timer.start()
+        try:
+            value = func(*args)
+        finally:
+            with lock:
+                state['finished'] = True
+            timer.cancel()
+        if state['expired']:
+            self.recycle_driver('превышен лимит времени')
+        return value, state['expired']
+
+    def process_item_guarded(self, item: Dict[str, str]) -> Dict[str, Any]:
+        """process_item с лимитом времени и плановым перезапуском браузера."""
+        if not self.session_cookies:
+            try:
+                self.session_cookies = self.export_cookies()
+            except Exception:
+                pass
+        with self.pacer.slot():
+            result, expired = self.run_with_deadline(
+                CONFIG['item_deadline_seconds'], f"Товар {item['product_name']}", self.process_item, item
+            )
+        if expired:
+            result['status'] = 'error'
+            result['message'] = f"Превышен лимит времени на товар ({CONFIG['item_deadline_seconds']:.0f} с)"
+        else:
+            self.items_since_start += 1
+            self.maybe_recycle()
+        return result
+
+    def maybe_recycle(self):
+        """Перезапуск браузера после DRIVER_RECYCLE_ITEMS карточек или выше DRIVER_MAX_RSS_MB."""
+        rss = browser_rss(self.driver) or 0
+        self.peak_rss = max(self.peak_rss, rss)
+        if CONFIG['recycle_after_items'] and self.items_since_start >= CONFIG['recycle_after_items']:
+            self.recycle_driver(f"обработано карточек: {self.items_since_start}")
+        elif CONFIG['recycle_max_rss_mb'] and rss > CONFIG['recycle_max_rss_mb'] * 1024 * 1024:
+            self.recycle_driver(f"память браузера {rss / 1024 / 1024:.0f} МБ")
+        elif not self.session_cookies or self.items_since_start % 10 == 0:
+            try:
+                self.session_cookies = self.export_cookies()
+            except Exception:
+                pass
+
+    @property
+    def can_recycle(self) -> bool:
+        """Браузер можно закрыть и запустить заново: он свой или владелец передал restart."""
+        return self.owns_driver or self.restart_driver is not None
+
+    @profiled('recycle_driver')
+    def recycle_driver(self, reason: str):
+        """
+        Закрывает браузер и запускает новый с куками текущей сессии (без повторного входа).
+        Общий драйвер (owned=False) перезапускает владелец через restart из use_driver.
+        """
+        if not self.can_recycle:
+            logger.debug(f"Перезапуск браузера пропущен ({reason}): драйвер общий, владелец не передал restart")
+            return
+        logger.info(f"Перезапуск браузера: {reason}")
+        try:
+            self.session_cookies = self.export_cookies()
+        except Exception:
+            pass
+        if self.owns_driver:
+            try:
+                self.driver.quit()
+            except Exception:
+                terminate_driver(self.driver)
+            self.init_browser(debugging_port=self.debugging_port)
+        else:
+            restart = self.restart_driver
+            self.use_driver(restart(), owned=False, restart=restart)
+        self.apply_cookies(self.session_cookies)
+        self.recycles += 1
+
+    @profiled('login')
     def login(self) -> bool:
         logger.info("Авторизация в CISLink...")
         try:
             self.driver.get(CONFIG['cislink_url'])
-            time.sleep(3)
+            self.waiter.page_ready(legacy=3)
             login_field = self.wait.until(EC.presence_of_element_located((By.ID, "txtLogin")))
             password_field = self.driver.find_element(By.ID, "txtPassword")
             login_field.clear()
-            time.sleep(0.5)
+            self.waiter.pause(0.5)
             login_field.send_keys(CONFIG['cislink_login'])
             password_field.clear()
-            time.sleep(0.5)
+            self.waiter.pause(0.5)
             password_field.send_keys(CONFIG['cislink_password'])
             login_button = self.driver.find_element(By.ID, "btnEnter")
             login_button.click()
-            time.sleep(5)
+            self.waiter.postback_complete(login_button, legacy=5)
             current_url = self.driver.current_url
             logger.info(f"URL после входа: {current_url}")
             if "Default.aspx" in current_url or "Dictionary" in current_url:
@@ -142,15 +480,37 @@ class CISLinkLinker:
             logger.error(f"Ошибка авторизации: {e}")
             return False
 
+    def apply_cookies(self, cookies: List[Dict[str, Any]]):
+        apply_browser_cookies(self.driver, cookies, CONFIG['cislink_url'])
+
+    def export_cookies(self) -> List[Dict[str, Any]]:
+        return self.driver.get_cookies()
+
+    def check_session(self) -> Optional[bool]:
+        return check_browser_session(
+            self.driver, self.waiter, CONFIG['distributors_page_url'], SELECTORS['select_all_distrs_checkbox']
+        )
+
+    @profiled('select_all_distributors')
     def select_all_distributors(self) -> bool:
         """
         Переходит на страницу Dictionary/Default.aspx и отмечает чекбокс 'Выбрать все'.
         Это обязательный шаг - без выбранных дистрибьюторов справочник товаров пуст.
+        В восстановленной сессии, где чекбокс уже отмечен, шаг пропускается.
         """
+        if self.distributors_selected:
+            logger.info("Дистрибьюторы уже выбраны в восстановленной сессии")
+            return True
+        self.distributors_selected = self._select_all_distributors()
+        return self.distributors_selected
+
+    def _select_all_distributors(self) -> bool:
         logger.info("Переход на страницу дистрибьюторов и выбор всех...")
         try:
-            self.driver.get(CONFIG['distributors_page_url'])
-            time.sleep(3)
+            # После входа или проверки сессии страница дистрибьюторов уже открыта
+            if '/Dictionary/Default.aspx' not in self.driver.current_url:
+                self.driver.get(CONFIG['distributors_page_url'])
+                self.waiter.page_ready(legacy=3)
             try:
                 checkbox = self.wait.until(
                     EC.presence_of_element_located((By.ID, SELECTORS['select_all_distrs_checkbox']))
@@ -163,30 +523,33 @@ class CISLinkLinker:
                 logger.info("Чекбокс 'Выбрать все' уже активен - ничего не делаем")
                 return True
 
+            self.waiter.watch_navigation()
             try:
                 checkbox.click()
             except ElementClickInterceptedException:
                 self.driver.execute_script("arguments[0].click();", checkbox)
-            time.sleep(2)
+            self.waiter.checkbox_applied(checkbox, SELECTORS['select_all_distrs_checkbox'], True, legacy=2)
 
             checkbox = self.driver.find_element(By.ID, SELECTORS['select_all_distrs_checkbox'])
             if checkbox.is_selected():
                 logger.info("Все дистрибьюторы выбраны")
                 return True
             logger.warning("После клика чекбокс не активен - пробуем еще раз через JS")
+            self.waiter.watch_navigation()
             self.driver.execute_script("arguments[0].click();", checkbox)
-            time.sleep(2)
+            self.waiter.checkbox_applied(checkbox, SELECTORS['select_all_distrs_checkbox'], True, legacy=2)
             checkbox = self.driver.find_element(By.ID, SELECTORS['select_all_distrs_checkbox'])
             return checkbox.is_selected()
         except Exception as e:
             logger.error(f"Ошибка выбора всех дистрибьюторов: {e}")
             return False
 
+    @profiled('open_unlinked_page')
     def open_unlinked_page(self) -> bool:
         logger.info("Открываем страницу непривязанных товаров...")
         try:
             self.driver.get(CONFIG['unlinked_page_url'])
-            time.sleep(3)
+            self.waiter.page_ready(legacy=3)
             self.wait.until(EC.presence_of_element_located((By.ID, SELECTORS['list_table'])))
             return True
         except TimeoutException:
@@ -196,10 +559,36 @@ class CISLinkLinker:
             logger.error(f"Ошибка открытия страницы непривязанных товаров: {e}")
             return False
 
-    def collect_unlinked_items(self) -> List[Dict[str, str]]:
+    @profiled('unlinked_list')
+    def set_max_page_size(self) -> bool:
+        """Выбирает в ddlPageSize наибольший размер страницы (AutoPostBack перерисовывает таблицу)."""
+        try:
+            dropdown = Select(self.driver.find_element(By.ID, SELECTORS['page_size_dropdown']))
+        except NoSuchElementException:
+            logger.debug("Выбор размера страницы не найден")
+            return False
+        sizes = {}
+        for option in dropdown.options:
+            value = option.get_attribute('value') or option.text
+            if value.strip().isdigit():
+                sizes[int(value.strip())] = value
+        if not sizes:
+            return False
+        largest = max(sizes)
+        if dropdown.first_selected_option.get_attribute('value') == sizes[largest]:
+            logger.info(f"Размер страницы уже максимальный: {largest}")
+            return True
+        table = self.driver.find_element(By.ID, SELECTORS['list_table'])
+        dropdown.select_by_value(sizes[largest])
+        self.waiter.postback_complete(table, legacy=3)
+        self.wait.until(EC.presence_of_element_located((By.ID, SELECTORS['list_table'])))
+        logger.info(f"Установлен размер страницы: {largest}")
+        return True
+
+    @profiled('unlinked_list')
+    def _parse_page_items(self) -> List[Dict[str, str]]:
         """
-        Собирает список непривязанных товаров со страницы.
-        Использует селектор ссылок вида a[id$='_hlLabel1'] внутри таблицы gvList.
+        Товары текущей страницы gvList.
         Структура колонок (по отчету разведки):
             td[0] - № строки
             td[1] - Название товара дистрибьютора (ссылка)
@@ -211,64 +600,152 @@ class CISLinkLinker:
             td[7] - кнопка-иконка Редактировать
             td[8] - кнопка-иконка Удалить
         """
-        logger.info("Собираем данные о непривязанных товарах...")
-        items: List[Dict[str, str]] = []
         try:
-            table = self.driver.find_element(By.ID, SELECTORS['list_table'])
-            link_elements = table.find_elements(
-                By.CSS_SELECTOR,
-                f"a[id^='{SELECTORS['list_table']}_ctl'][id$='{SELECTORS['row_link_suffix']}']"
+            rows = self.driver.execute_script(
+                EXTRACT_ITEMS_SCRIPT, SELECTORS['list_table'], SELECTORS['row_link_suffix']
             )
-            logger.info(f"Найдено ссылок на карточки: {len(link_elements)}")
+        except Exception as e:
+            logger.debug(f"Ошибка чтения страницы через JS: {e}, переходим к поэлементному обходу")
+            rows = None
+        if rows is None:
+            rows = self._parse_page_items_elements()
+        items = []
+        for row in rows:
+            if not row['article'] or not row['detail_url']:
+                logger.debug(f"Пропуск строки без артикула/ссылки: {row['product_name']}")
+                continue
+            items.append({
+                'product_name': row['product_name'],
+                'article': row['article'],
+                'detail_url': row['detail_url'],
+                'distr_code': row['distr_code'],
+            })
+        return items
 
-            for link in link_elements:
-                try:
-                    row = link.find_element(By.XPATH, "./ancestor::tr[1]")
-                    cells = row.find_elements(By.TAG_NAME, "td")
-                    if len(cells) < 7:
-                        continue
-                    product_name = link.text.strip()
-                    detail_url = link.get_attribute("href") or ""
-                    article = cells[4].text.strip()
-                    distr_code = cells[6].text.strip()
-
-                    if not article or not detail_url:
-                        logger.debug(f"Пропуск строки без артикула/ссылки: {product_name}")
-                        continue
-
-                    items.append({
-                        'product_name': product_name,
-                        'article': article,
-                        'detail_url': detail_url,
-                        'distr_code': distr_code,
-                    })
-
-                    if len(items) >= CONFIG['max_items_per_run']:
-                        logger.info(
-                            f"Достигнут лимит {CONFIG['max_items_per_run']} товаров за запуск "
-                            f"(всего на странице {len(link_elements)})"
-                        )
-                        break
-                except Exception as e:
-                    logger.debug(f"Ошибка обработки строки: {e}")
+    def _parse_page_items_elements(self) -> List[Dict[str, str]]:
+        """Поэлементный обход ссылок a[id$='_hlLabel1'] (запасной вариант)."""
+        table = self.driver.find_element(By.ID, SELECTORS['list_table'])
+        link_elements = table.find_elements(
+            By.CSS_SELECTOR,
+            f"a[id^='{SELECTORS['list_table']}_ctl'][id$='{SELECTORS['row_link_suffix']}']"
+        )
+        rows = []
+        for link in link_elements:
+            try:
+                row = link.find_element(By.XPATH, "./ancestor::tr[1]")
+                cells = row.find_elements(By.TAG_NAME, "td")
+                if len(cells) < 7:
+                    continue
+                rows.append({
+                    'product_name': link.text.strip(),
+                    'detail_url': link.get_attribute("href") or "",
+                    'article': cells[4].text.strip(),
+                    'distr_code': cells[6].text.strip(),
+                })
+            except Exception as e:
+                logger.debug(f"Ошибка обработки строки: {e}")
+                continue
+        return rows
+
+    @profiled('unlinked_list')
+    def _goto_next_page(self, current_page: int) -> bool:
+        """Переходит на страницу current_page + 1 через postback пейджера. False - страниц больше нет."""
+        hrefs = self.driver.execute_script(PAGER_LINKS_SCRIPT, SELECTORS['list_table']) or []
+        event_target = None
+        has_next = False
+        for href in hrefs:
+            match = PAGER_PATTERN.search(href or '')
+            if not match:
+                continue
+            event_target = match.group(1)
+            argument = match.group(2)
+            if argument in ('Next', 'Last') or (argument.isdigit() and int(argument) > current_page):
+                has_next = True
+        if not has_next or not event_target:
+            return False
+        table = self.driver.find_element(By.ID, SELECTORS['list_table'])
+        self.driver.execute_script(
+            "__doPostBack(arguments[0], arguments[1]);", event_target, f'Page${current_page + 1}'
+        )
+        self.waiter.postback_complete(table, legacy=3)
+        self.wait.until(EC.presence_of_element_located((By.ID, SELECTORS['list_table'])))
+        return True
+
+    def iter_unlinked_items(self, limit: Optional[int] = None,
+                            skip: Optional[Callable[[Dict[str, str]], bool]] = None,
+                            rescan: bool = False) -> Iterator[Dict[str, str]]:
+        """
+        Обходит все страницы gvList (предварительно выставив максимальный размер страницы)
+        и отдаёт товары по мере разбора. Останавливается, когда отдано limit товаров
+        (по умолчанию MAX_ITEMS_PER_RUN). Товары, для которых skip(item) истинно,
+        не отдаются и в лимит не входят.
+        rescan - товары привязываются, пока идёт обход (run_parallel): привязанная строка
+        уходит из списка, следующие страницы сдвигаются, и часть строк не попадает ни на
+        одну страницу. Поэтому после последней страницы список открывается заново и
+        обходится с первой страницы, пока проход находит новые товары (уже виденные не
+        повторяются).
+        Пока генератор не исчерпан, драйвер должен оставаться на странице списка.
+        """
+        limit = limit or CONFIG['max_items_per_run']
+        seen: set = set()
+        yielded = 0
+        scan = 1
+        while True:
+            self.set_max_page_size()
+            found = 0
+            for item in self._iter_unlinked_pass(seen):
+                found += 1
+                if item['detail_url'] in self.resume_skip:
+                    logger.info(f"Пропуск {item['product_name']}: обработан в прерванном запуске")
+                    continue
+                if skip and skip(item):
                     continue
-            logger.info(f"Собрано {len(items)} непривязанных товаров для обработки")
-            return items
+                yield item
+                yielded += 1
+                if yielded >= limit:
+                    logger.info(f"Достигнут лимит {limit} товаров за запуск")
+                    return
+            if not rescan or not found or not self.open_unlinked_page():
+                return
+            scan += 1
+            logger.info(f"Повторный обход списка ({scan}): строки могли сдвинуться после привязки")
+
+    def _iter_unlinked_pass(self, seen: set) -> Iterator[Dict[str, str]]:
+        """Один проход по страницам gvList: товары, которых ещё нет в seen (seen пополняется)."""
+        page = 1
+        previous_first = None
+        while True:
+            page_items = self._parse_page_items()
+            logger.info(f"Страница {page}: товаров {len(page_items)}")
+            if not page_items or page_items[0]['detail_url'] == previous_first:
+                return
+            previous_first = page_items[0]['detail_url']
+            for item in page_items:
+                if item['detail_url'] in seen:
+                    continue
+                seen.add(item['detail_url'])
+                yield item
+            if not self._goto_next_page(page):
+                return
+            page += 1
+
+    def collect_unlinked_items(self) -> List[Dict[str, str]]:
+        """Собирает список непривязанных товаров со всех страниц (до MAX_ITEMS_PER_RUN)."""
+        logger.info("Собираем данные о непривязанных товарах...")
+        items: List[Dict[str, str]] = []
+        try:
+            for item in self.iter_unlinked_items(skip=self._skip_cached_negative):
+                items.append(item)
         except NoSuchElementException:
             logger.warning("Таблица gvList не найдена на странице")
-            return []
         except Exception as e:
             logger.error(f"Ошибка сбора непривязанных товаров: {e}")
-            return []
+        logger.info(f"Собрано {len(items)} непривязанных товаров для обработки")
+        return items
 
-    def process_item(self, item: Dict[str, str]) -> Dict[str, Any]:
-        """
-        Обрабатывает один товар: открывает карточку, вбивает артикул,
-        дергает blur (триггерит валидацию через enter_code),
-        проверяет результат по видимости #lblTextCodeError и #btnSave,
-        сохраняет или пропускает.
-        """
-        result = {
+    @staticmethod
+    def _new_result(item: Dict[str, str]) -> Dict[str, Any]:
+        return {
             'product_name': item['product_name'],
             'article': item['article'],
             'distr_code': item.get('distr_code', ''),
@@ -277,81 +754,247 @@ class CISLinkLinker:
             'message': '',
             'nomenclature_id': '',
             'processed_at': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+            # card - карточка открывалась, batch - пакетная проверка, cache - кэш артикулов
+            'resolved_by': 'card',
+            'duration_sec': 0.0,
         }
+
+    @profiled('validate_articles')
+    def validate_articles(self, articles: List[str], card_url: str) -> Optional[Dict[str, Dict[str, Any]]]:
+        """
+        Прогоняет список артикулов через enter_code на одной карточке (card_url), без сохранения.
+        Карточка должна быть того же дистрибьютора, что и товары с этими артикулами.
+        Возвращает словарь артикул -> {error, nomenclature_id, save_visible, save_before, settled}
+        или None, если проверить не удалось (тогда товары обрабатываются по одному).
+        """
+        unique = list(dict.fromkeys(articles))
         try:
-            logger.info(f"Обработка: {item['product_name']} (артикул {item['article']})")
-            self.driver.get(item['detail_url'])
-            time.sleep(2)
+            self.driver.get(card_url)
+            self.waiter.page_ready(legacy=2)
+            self.wait.until(EC.presence_of_element_located((By.ID, SELECTORS['card_article_input'])))
+            per_article = CONFIG['batch_article_timeout']
+            self.driver.set_script_timeout(per_article * len(unique) + 30)
+            results = self.driver.execute_async_script(
+                BATCH_VALIDATE_SCRIPT,
+                {
+                    'article': SELECTORS['card_article_input'],
+                    'error': SELECTORS['card_error_label'],
+                    'save': SELECTORS['card_save_button'],
+                    'manf': SELECTORS['card_manf_id_input'],
+                },
+                unique,
+                per_article * 1000,
+                VALIDATION_QUIET_MS
+            )
+        except Exception as e:
+            logger.warning(f"Пакетная проверка артикулов не удалась: {e}")
+            return None
+        if results is None:
+            logger.warning(f"Поле #{SELECTORS['card_article_input']} не найдено на карточке для пакетной проверки")
+            return None
+        resolved = sum(1 for r in results.values() if r['nomenclature_id'] and r['save_visible'] and not r['error'])
+        logger.info(f"Пакетная проверка: артикулов {len(unique)}, распознано {resolved}")
+        return results
 
-            try:
-                article_input = self.wait.until(
-                    EC.presence_of_element_located((By.ID, SELECTORS['card_article_input']))
+    def _cached_result(self, item: Dict[str, str], entry: Dict[str, Any]) -> Dict[str, Any]:
+        result = self._new_result(item)
+        result['status'] = entry['status']
+        result['message'] = f"Из кэша: {entry['message']}"
+        result['resolved_by'] = 'cache'
+        logger.info(f"Пропуск {item['product_name']} (артикул {item['article']}): результат из кэша")
+        return result
+
+    def _skip_cached_negative(self, item: Dict[str, str]) -> bool:
+        """
+        skip для iter_unlinked_items: товар со свежим отрицательным результатом в кэше артикулов
+        сразу получает результат из кэша и не занимает место в лимите запуска.
+        """
+        if not self.resolution_cache:
+            return False
+        entry = self.resolution_cache.get(item['distr_code'], item['article'])
+        if not entry or entry['status'] not in ArticleResolutionCache.NEGATIVE_STATUSES:
+            return False
+        result = self._cached_result(item, entry)
+        self._remember_result(result)
+        self.results.append(result)
+        return True
+
+    def process_batch(self, items: List[Dict[str, str]]) -> List[Dict[str, Any]]:
+        """
+        Обрабатывает пачку товаров:
+        1. Свежий отрицательный результат в кэше артикулов - пропуск без обращения к CISLink.
+        2. Остальные (кроме закэшированных положительных) - пакетная проверка артикулов
+           на карточке первого товара того же дистрибьютора; нераспознанные получают тот же
+           статус, что дал бы process_item, без загрузки своей карточки. Такой итог
+           получен на чужой карточке, поэтому в кэш артикулов не записывается.
+        3. Карточки с распознанным артикулом открываются и сохраняются.
+        """
+        results: List[Optional[Dict[str, Any]]] = [None] * len(items)
+        to_validate = []
+        for i, item in enumerate(items):
+            entry = self.resolution_cache.get(item['distr_code'], item['article']) if self.resolution_cache else None
+            if entry and entry['status'] in ArticleResolutionCache.NEGATIVE_STATUSES:
+                results[i] = self._cached_result(item, entry)
+            elif not entry:
+                to_validate.append(i)
+
+        by_distr: Dict[str, List[int]] = {}
+        for i in to_validate:
+            by_distr.setdefault(items[i]['distr_code'], []).append(i)
+        validation: Dict[str, Dict[str, Dict[str, Any]]] = {}
+        for distr_code, indexes in by_distr.items():
+            if not CONFIG['batch_validation'] or len(indexes) < 2:
+                continue
+            articles = [items[i]['article'] for i in indexes]
+            checks, _ = self.run_with_deadline(
+                CONFIG['item_deadline_seconds'] and
+                CONFIG['item_deadline_seconds'] + CONFIG['batch_article_timeout'] * len(articles),
+                "Пакетная проверка артикулов", self.validate_articles, articles, items[indexes[0]]['detail_url']
+            )
+            if checks:
+                validation[distr_code] = checks
+        for i in to_validate:
+            item = items[i]
+            check = validation.get(item['distr_code'], {}).get(item['article'])
+            if not check or not check['settled']:
+                continue
+            if check['error']:
+                result = self._new_result(item)
+                result['status'] = 'skipped_invalid_article'
+                result['message'] = f"Ошибка валидации: {check['error']}"
+            elif not check['nomenclature_id'] or not check['save_visible']:
+                result = self._new_result(item)
+                result['status'] = 'skipped_no_match'
+                result['message'] = (
+                    f"ID не подтянулся (nomenclature_id='{check['nomenclature_id']}', "
+                    f"save_button_visible={check['save_visible']}, до ввода {check['save_before']})"
                 )
-            except TimeoutException:
-                result['status'] = 'error'
-                result['message'] = f"Поле #{SELECTORS['card_article_input']} не найдено на карточке"
-                return result
+            else:
+                continue
+            result['resolved_by'] = 'batch'
+            logger.info(f"Пропуск {item['product_name']} (артикул {item['article']}): {result['message']}")
+            results[i] = result
+
+        for i, item in enumerate(items):
+            if results[i] is None:
+                results[i] = self.process_item_guarded(item)
+            self._remember_result(results[i])
+        return results
 
-            # Устанавливаем значение через JS (обходит проверку интерактивности Selenium)
-            # и явно триггерим события input/change/blur, чтобы сработал enter_code.
-            set_value_script = """
-                var el = document.getElementById(arguments[0]);
-                if (!el) return false;
-                el.focus();
-                el.value = arguments[1];
-                el.dispatchEvent(new Event('input', { bubbles: true }));
-                el.dispatchEvent(new Event('change', { bubbles: true }));
-                el.blur();
-                return true;
-            """
-            ok = self.driver.execute_script(
-                set_value_script,
-                SELECTORS['card_article_input'],
-                item['article']
+    def _remember_result(self, result: Dict[str, Any]):
+        if self.journal:
+            try:
+                self.journal.append(self.run_id, result['detail_url'], result)
+            except Exception as e:
+                logger.warning(f"Не удалось записать результат в журнал: {e}")
+        # batch - итог получен на карточке другого товара, кэшировать его как отрицательный нельзя
+        if not self.resolution_cache or result['resolved_by'] in ('cache', 'batch'):
+            return
+        try:
+            self.resolution_cache.put(
+                result['distr_code'], result['article'], result['status'],
+                result['nomenclature_id'], result['message']
             )
-            if not ok:
-                result['status'] = 'error'
-                result['message'] = f"Не удалось установить значение в #{SELECTORS['card_article_input']}"
-                return result
-            time.sleep(CONFIG['validation_wait_seconds'])
+        except Exception as e:
+            logger.debug(f"Не удалось обновить кэш артикулов: {e}")
 
-            # Проверка ошибки валидации
-            error_text = self._read_error_label()
-            if error_text:
-                result['status'] = 'skipped_invalid_article'
-                result['message'] = f"Ошибка валидации: {error_text}"
-                logger.info(f"  -> пропуск: {error_text}")
-                return result
+    @profiled('process_item')
+    def process_item(self, item: Dict[str, str]) -> Dict[str, Any]:
+        """
+        Обрабатывает один товар: открывает карточку, вбивает артикул,
+        дергает blur (триггерит валидацию через enter_code),
+        проверяет результат по видимости #lblTextCodeError и #btnSave,
+        сохраняет или пропускает.
+        """
+        result = self._new_result(item)
+        started = time.monotonic()
+        try:
+            with self.profile.phase('process_item.load'):
+                logger.info(f"Обработка: {item['product_name']} (артикул {item['article']})")
+                self.pacer.pause()
+                load_started = time.monotonic()
+                self.driver.get(item['detail_url'])
+                self.waiter.page_ready(legacy=2)
 
-            nomenclature_id = self._read_input_value(SELECTORS['card_manf_id_input'])
-            save_visible = self._is_element_visible(SELECTORS['card_save_button'])
+                try:
+                    article_input = self.wait.until(
+                        EC.presence_of_element_located((By.ID, SELECTORS['card_article_input']))
+                    )
+                except TimeoutException:
+                    self.pacer.observe(time.monotonic() - load_started, ok=False)
+                    result['status'] = 'error'
+                    result['message'] = f"Поле #{SELECTORS['card_article_input']} не найдено на карточке"
+                    return result
+                self.pacer.observe(time.monotonic() - load_started)
 
-            if not nomenclature_id or not save_visible:
-                result['status'] = 'skipped_no_match'
-                result['message'] = (
-                    f"ID не подтянулся (nomenclature_id='{nomenclature_id}', "
-                    f"save_button_visible={save_visible})"
+                self.profile.switch('process_item.validate')
+                # Устанавливаем значение через JS (обходит проверку интерактивности Selenium)
+                # и явно триггерим события input/change/blur, чтобы сработал enter_code.
+                ok = self.driver.execute_script(
+                    SET_ARTICLE_SCRIPT,
+                    SELECTORS['card_article_input'],
+                    item['article']
+                )
+                if not ok:
+                    result['status'] = 'error'
+                    result['message'] = f"Не удалось установить значение в #{SELECTORS['card_article_input']}"
+                    return result
+                self.waiter.until(
+                    lambda d: d.execute_script(
+                        VALIDATION_SETTLED_SCRIPT,
+                        SELECTORS['card_error_label'],
+                        SELECTORS['card_save_button'],
+                        SELECTORS['card_manf_id_input'],
+                        VALIDATION_QUIET_MS
+                    ),
+                    'validation',
+                    legacy=CONFIG['validation_wait_seconds']
                 )
-                logger.info(f"  -> пропуск: {result['message']}")
-                return result
 
-            result['nomenclature_id'] = nomenclature_id
-            logger.info(f"  -> ID найден: {nomenclature_id}, сохраняем")
+                # Проверка ошибки валидации
+                error_text = self._read_error_label()
+                if error_text:
+                    result['status'] = 'skipped_invalid_article'
+                    result['message'] = f"Ошибка валидации: {error_text}"
+                    logger.info(f"  -> пропуск: {error_text}")
+                    return result
 
-            if self._click_save_button():
-                time.sleep(CONFIG['save_wait_seconds'])
-                result['status'] = 'linked'
-                result['message'] = 'Товар успешно привязан'
-                logger.info(f"  -> сохранено")
-            else:
-                result['status'] = 'error'
-                result['message'] = 'Не удалось нажать кнопку Сохранить'
-            return result
+                nomenclature_id = self._read_input_value(SELECTORS['card_manf_id_input'])
+                save_visible = self._is_element_visible(SELECTORS['card_save_button'])
+
+                if not nomenclature_id or not save_visible:
+                    result['status'] = 'skipped_no_match'
+                    result['message'] = (
+                        f"ID не подтянулся (nomenclature_id='{nomenclature_id}', "
+                        f"save_button_visible={save_visible})"
+                    )
+                    logger.info(f"  -> пропуск: {result['message']}")
+                    return result
+
+                result['nomenclature_id'] = nomenclature_id
+                logger.info(f"  -> ID найден: {nomenclature_id}, сохраняем")
+
+                self.profile.switch('process_item.save')
+                save_btn = self._click_save_button()
+                if save_btn:
+                    postback_started = time.monotonic()
+                    completed = self.waiter.postback_complete(save_btn, legacy=CONFIG['save_wait_seconds'])
+                    self.pacer.observe(time.monotonic() - postback_started, ok=completed)
+                    result['status'] = 'linked'
+                    result['message'] = 'Товар успешно привязан'
+                    logger.info(f"  -> сохранено")
+                else:
+                    result['status'] = 'error'
+                    result['message'] = 'Не удалось нажать кнопку Сохранить'
+                return result
         except Exception as e:
             logger.error(f"Ошибка обработки товара {item.get('product_name')}: {e}")
+            self.pacer.observe(time.monotonic() - started, ok=False)
             result['status'] = 'error'
             result['message'] = f'Исключение: {e}'
             return result
+        finally:
+            result['duration_sec'] = round(time.monotonic() - started, 2)
 
     def _read_input_value(self, element_id: str) -> str:
         try:
@@ -396,39 +1039,181 @@ class CISLinkLinker:
             logger.debug(f"Ошибка чтения label ошибки: {e}")
             return ''
 
-    def _click_save_button(self) -> bool:
-        """Клик по #btnSave."""
+    def _click_save_button(self):
+        """Клик по #btnSave. Возвращает нажатый элемент (для ожидания postback-а) или None."""
         try:
             save_btn = self.driver.find_element(By.ID, SELECTORS['card_save_button'])
             if not self._is_element_visible(SELECTORS['card_save_button']):
                 logger.warning("Кнопка Сохранить не видима")
-                return False
+                return None
             try:
                 self.driver.execute_script("arguments[0].scrollIntoView(true);", save_btn)
-                time.sleep(0.3)
+                self.waiter.pause(0.3)
                 save_btn.click()
             except ElementClickInterceptedException:
                 self.driver.execute_script("arguments[0].click();", save_btn)
-            return True
+            return save_btn
         except NoSuchElementException:
             logger.error("Кнопка #btnSave не найдена в DOM")
-            return False
+            return None
         except Exception as e:
             logger.error(f"Ошибка клика Сохранить: {e}")
-            return False
+            return None
+
+    def spawn_worker(self, worker_index: int) -> 'CISLinkLinker':
+        """
+        Запускает дополнительный браузер и переносит в него куки текущей сессии:
+        авторизация и выбор дистрибьюторов хранятся на сервере, повторять их не нужно.
+        """
+        worker = CISLinkLinker(resolution_cache=self.resolution_cache)
+        worker.journal = self.journal
+        worker.run_id = self.run_id
+        worker.init_browser(debugging_port=CONFIG['debugging_port'] + worker_index)
+        try:
+            worker.apply_cookies(self.export_cookies())
+            worker.distributors_selected = self.distributors_selected
+        except Exception:
+            worker.close()
+            raise
+        return worker
+
+    def _process_batch_safely(self, worker: 'CISLinkLinker', items: List[Dict[str, str]]) -> List[Dict[str, Any]]:
+        """
+        process_batch воркера: при исключении товары пачки получают статус error,
+        браузер воркера перезапускается, и поток продолжает разбирать очередь.
+        """
+        try:
+            return worker.process_batch(items)
+        except Exception as e:
+            error = str(e)
+            logger.error(f"{threading.current_thread().name}: пачка из {len(items)} товаров не обработана: {error}")
+        results = []
+        for item in items:
+            result = self._new_result(item)
+            result['status'] = 'error'
+            result['message'] = f"Ошибка воркера: {error}"
+            results.append(result)
+        try:
+            worker.recycle_driver("ошибка при обработке пачки")
+        except Exception as recycle_error:
+            logger.warning(f"Не удалось перезапустить браузер воркера: {recycle_error}")
+        return results
+
+    def run_parallel(self, source: Iterable[Dict[str, str]]) -> List[Dict[str, Any]]:
+        """
+        Обрабатывает товары пулом из LINK_CONCURRENCY дополнительных браузеров с общей сессией.
+        Текущий драйвер остаётся на списке товаров и наполняет очередь по мере обхода
+        страниц (source - обычно iter_unlinked_items), воркеры начинают работу сразу.
+        Результаты возвращаются в исходном порядке товаров.
+        """
+        workers = []
+        for worker_index in range(1, CONFIG['link_concurrency'] + 1):
+            try:
+                workers.append(self.spawn_worker(worker_index))
+            except Exception as e:
+                logger.warning(f"Не удалось запустить воркер {worker_index}: {e}")
+                break
+        if not workers:
+            logger.warning("Воркеры не запущены - обрабатываем последовательно")
+            return self.process_batch(list(source))
+        self.pacer.configure(max_concurrency=len(workers))
+        logger.info(f"Параллельная обработка: воркеров {len(workers)}, параллельность {self.pacer.concurrency}")
+
+        tasks: queue.Queue = queue.Queue()
+        results: Dict[int, Dict[str, Any]] = {}
+        results_lock = threading.Lock()
+
+        def work(worker: 'CISLinkLinker'):
+            finished = False
+            while not finished:
+                task = tasks.get()
+                if task is None:
+                    return
+                batch = [task]
+                # Забираем из очереди то, что уже накопилось, для пакетной проверки артикулов
+                while len(batch) < CONFIG['batch_validation_size']:
+                    try:
+                        task = tasks.get_nowait()
+                    except queue.Empty:
+                        break
+                    if task is None:
+                        finished = True
+                        break
+                    batch.append(task)
+                logger.info(
+                    f"--- [{batch[0][0] + 1}..{batch[-1][0] + 1}] {threading.current_thread().name} ---"
+                )
+                batch_results = self._process_batch_safely(worker, [item for _, item in batch])
+                with results_lock:
+                    for (idx, _), res in zip(batch, batch_results):
+                        results[idx] = res
+                self.report_progress()
+
+        threads = [
+            threading.Thread(target=work, args=(worker,), name=f'worker-{n}')
+            for n, worker in enumerate(workers, start=1)
+        ]
+        try:
+            for thread in threads:
+                thread.start()
+            try:
+                for idx, item in enumerate(source):
+                    tasks.put((idx, item))
+            except Exception as e:
+                logger.error(f"Ошибка сбора непривязанных товаров: {e}")
+            finally:
+                for _ in threads:
+                    tasks.put(None)
+            for thread in threads:
+                thread.join()
+        finally:
+            for worker in workers:
+                self.recycles += worker.recycles
+                self.peak_rss = max(self.peak_rss, worker.peak_rss)
+                worker.close()
+        return [results[idx] for idx in sorted(results)]
 
     def run_linking(self):
+        if CONFIG['link_concurrency'] > 1:
+            logger.info("Собираем и обрабатываем непривязанные товары параллельно...")
+            self.results.extend(
+                self.run_parallel(self.iter_unlinked_items(skip=self._skip_cached_negative, rescan=True))
+            )
+            if not self.results:
+                logger.info("Непривязанных товаров не найдено")
+            return
         items = self.collect_unlinked_items()
         if not items:
             logger.info("Непривязанных товаров не найдено")
             return
-        for idx, item in enumerate(items, start=1):
-            logger.info(f"--- [{idx}/{len(items)}] ---")
-            res = self.process_item(item)
-            self.results.append(res)
+        size = CONFIG['batch_validation_size']
+        for start in range(0, len(items), size):
+            batch = items[start:start + size]
+            logger.info(f"--- [{start + 1}..{start + len(batch)}/{len(items)}] ---")
+            self.results.extend(self.process_batch(batch))
+            self.report_progress()
+
+    def report_progress(self):
+        """Вызывает on_progress после очередной пачки (из воркеров - по одному за раз)."""
+        if not self.on_progress:
+            return
+        with self._progress_lock:
+            try:
+                self.on_progress()
+            except Exception as e:
+                logger.warning(f"Промежуточная отправка не удалась: {e}")
+
+    def attach_journal(self, journal: LinkJournal):
+        """Начинает запуск в журнале и загружает товары, завершённые прерванными запусками."""
+        self.journal = journal
+        self.run_id = datetime.now().strftime('%Y%m%d-%H%M%S')
+        self.resume_skip = journal.resume_keys(CONFIG['journal_resume_hours'] * 3600)
+        journal.start_run(self.run_id)
+        if self.resume_skip:
+            logger.info(f"Продолжение прерванного запуска: уже обработано товаров {len(self.resume_skip)}")
 
     def close(self):
-        if self.driver:
+        if self.driver and self.owns_driver:
             try:
                 self.driver.quit()
             except Exception:
@@ -436,28 +1221,79 @@ class CISLinkLinker:
 
 
 class APIClient:
-    def __init__(self):
+    def __init__(self, session: Optional[requests.Session] = None):
         self.url = CONFIG['api_url']
         self.api_key = CONFIG['api_key']
+        self.delivery = DeliveryClient(
+            self.url, self.api_key, source='link_products_agent', session=session,
+            max_batch_bytes=CONFIG['api_batch_bytes'],
+            max_attempts=CONFIG['api_max_attempts'],
+            use_gzip=CONFIG['api_gzip']
+        )
+        self.outbox = None
+        if CONFIG['outbox_enabled']:
+            try:
+                self.outbox = Outbox(CONFIG['state_dir'], 'link_products_agent', CONFIG['outbox_max_entries'])
+            except Exception as e:
+                logger.warning(f"Очередь отправки недоступна, отправляем напрямую: {e}")
 
+    @profiled('send_results')
     def send_results(self, results: List[Dict[str, Any]]) -> dict:
+        """
+        Фиксирует результаты в очереди и отправляет всю очередь по порядку.
+        queued в результате - результаты сохранены в очереди и будут досланы, даже если доставка не удалась.
+        """
         if not self.url or not self.api_key:
             logger.warning("API_URL или API_KEY не заданы - пропуск отправки")
             return {'success': False, 'error': 'api_not_configured'}
+        extra = {
+            'source': 'link_products_agent',
+            'run_datetime': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+        }
+        if PROFILE_PAYLOAD:
+            extra['run_profile'] = get_profile().compact()
+        if not self.outbox:
+            return self.delivery.send(results, extra=extra)
         try:
-            payload = {
-                'api_key': self.api_key,
-                'source': 'link_products_agent',
-                'run_datetime': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
-                'reports': results,
-            }
-            response = requests.post(self.url, json=payload, timeout=60)
-            try:
-                return response.json()
-            except Exception:
-                return {'success': response.ok, 'status_code': response.status_code}
-        except Exception as e:
-            return {'success': False, 'error': str(e)}
+            self.outbox.enqueue(results, extra)
+        except OutboxFull as e:
+            logger.error(
+                f"Результаты не поставлены в очередь отправки: {e}; "
+                f"результатов {len(results)}, отклонено отправок за запуск {self.outbox.refused}"
+            )
+            result = self.drain()
+            result.update({'success': False, 'error': 'outbox_full', 'queued': False})
+            return result
+        return dict(self.drain(), queued=True)
+
+    @profiled('drain_outbox')
+    def drain(self) -> dict:
+        """Досылает накопленные в очереди отправки (в том числе от прошлых запусков)."""
+        if not self.outbox or not self.url or not self.api_key:
+            return {'success': True, 'drained': 0, 'pending': 0}
+        return drain_outbox(self.outbox, self.delivery)
+
+    def close(self):
+        if self.outbox:
+            self.outbox.close()
+            self.outbox = None
+
+
+def open_session_store(name: str = 'link_products_agent') -> Optional[SessionStore]:
+    if not CONFIG['session_reuse']:
+        return None
+    if not ENCRYPTION_AVAILABLE:
+        logger.info("Пакет cryptography не установлен - сессия между запусками не сохраняется")
+        return None
+    try:
+        return SessionStore(
+            CONFIG['state_dir'], name, CONFIG['cislink_login'],
+            CONFIG['session_key'] or CONFIG['cislink_password'],
+            max_age_seconds=CONFIG['session_max_age_hours'] * 3600
+        )
+    except Exception as e:
+        logger.warning(f"Хранилище сессии недоступно: {e}")
+        return None
 
 
 def summarize(results: List[Dict[str, Any]]):
@@ -466,37 +1302,129 @@ def summarize(results: List[Dict[str, Any]]):
     skipped_invalid = sum(1 for r in results if r['status'] == 'skipped_invalid_article')
     skipped_no_match = sum(1 for r in results if r['status'] == 'skipped_no_match')
     errors = sum(1 for r in results if r['status'] == 'error')
+    from_cache = sum(1 for r in results if r.get('resolved_by') == 'cache')
+    from_batch = sum(1 for r in results if r.get('resolved_by') == 'batch')
+    card_times = [r['duration_sec'] for r in results if r.get('resolved_by') == 'card' and r.get('duration_sec')]
+    card_seconds = sum(card_times) / len(card_times) if card_times else CONFIG['estimated_card_seconds']
     logger.info("=" * 60)
     logger.info(f"Итого обработано: {total}")
     logger.info(f"  Привязано: {linked}")
     logger.info(f"  Пропущено (некорректный артикул): {skipped_invalid}")
     logger.info(f"  Пропущено (ID не подтянулся): {skipped_no_match}")
     logger.info(f"  Ошибки: {errors}")
+    logger.info(f"Без открытия карточки: по кэшу артикулов {from_cache}, по пакетной проверке {from_batch}")
+    logger.info(
+        f"  Среднее время карточки {card_seconds:.1f} с, сэкономлено ~{(from_cache + from_batch) * card_seconds:.0f} с"
+    )
+    if card_times:
+        ordered = sorted(card_times)
+        p50 = ordered[len(ordered) // 2]
+        p99 = ordered[min(len(ordered) - 1, int(len(ordered) * 0.99))]
+        logger.info(f"  Время карточки: p50 {p50:.1f} с, p99 {p99:.1f} с, максимум {ordered[-1]:.1f} с")
     logger.info("=" * 60)
 
 
+def open_link_journal() -> Optional[LinkJournal]:
+    if not CONFIG['journal_enabled']:
+        return None
+    try:
+        return LinkJournal(CONFIG['state_dir'])
+    except Exception as e:
+        logger.warning(f"Журнал привязки недоступен: {e}")
+        return None
+
+
+def flush_journal(journal: LinkJournal, api: APIClient, min_items: int = 1) -> Optional[dict]:
+    """
+    Передаёт в API результаты журнала, которые ещё не отправлялись (не меньше min_items).
+    Записи считаются переданными, когда они доставлены или приняты в очередь отправки;
+    иначе (API не настроен, очередь переполнена) остаются в журнале до следующей попытки.
+    """
+    entries = journal.undelivered()
+    if not entries or len(entries) < min_items:
+        return None
+    result = api.send_results([entry['result'] for entry in entries])
+    if result.get('success') or result.get('queued'):
+        journal.mark_delivered([entry['id'] for entry in entries])
+        logger.info(
+            f"Передано результатов из журнала: {len(entries)} ({'ok' if result.get('success') else 'в очереди'})"
+        )
+    else:
+        logger.warning(f"Результаты журнала не переданы ({result.get('error')}), остаются в журнале: {len(entries)}")
+    return result
+
+
+def run_link(linker: CISLinkLinker, api: APIClient) -> bool:
+    """
+    Привязка товаров на уже авторизованном линкере и отправка результатов.
+    С журналом результаты отправляются частями по ходу работы, а остаток прерванного
+    запуска досылается в начале. Возвращает False, если не удалось выбрать
+    дистрибьюторов или открыть список товаров, а также если очередь отправки
+    переполнена и результаты не приняты (с журналом они остаются в нём).
+    """
+    journal = open_link_journal()
+    try:
+        if journal:
+            linker.attach_journal(journal)
+            flush_journal(journal, api)
+            linker.on_progress = lambda: flush_journal(journal, api, CONFIG['journal_flush_items'])
+        if not linker.select_all_distributors():
+            logger.error("Не удалось выбрать всех дистрибьюторов")
+            return False
+        if not linker.open_unlinked_page():
+            logger.error("Не удалось открыть страницу непривязанных товаров")
+            return False
+        linker.run_linking()
+        summarize(linker.results)
+        logger.info(
+            f"Перезапусков браузера: {linker.recycles}, пик памяти браузера: {linker.peak_rss / 1024 / 1024:.0f} МБ"
+        )
+        logger.info(f"Темп запросов: {linker.pacer.summary()}")
+        if journal:
+            result = flush_journal(journal, api)
+            if result is None:
+                result = api.drain()
+            journal.finish_run()
+        elif linker.results:
+            result = api.send_results(linker.results)
+        else:
+            result = api.drain()
+        logger.info(f"Результат отправки: {result}")
+        return result.get('error') != 'outbox_full'
+    finally:
+        linker.on_progress = None
+        if journal:
+            linker.journal = None
+            journal.close()
+
+
 def main():
     logger.info("Агент привязки товаров CISLink v1.2")
     if not all([CONFIG['cislink_login'], CONFIG['cislink_password']]):
         logger.error("Не заданы CISLINK_LOGIN / CISLINK_PASSWORD")
         exit(1)
 
-    linker = CISLinkLinker()
+    linker = CISLinkLinker(resolution_cache=open_resolution_cache())
+    api = APIClient()
+    session_store = open_session_store()
+    get_profile().start('link_products_agent')
     try:
         linker.init_browser()
-        if not linker.login():
+        if not restore_session(session_store, linker) and not linker.login():
             logger.error("Авторизация не удалась")
             exit(1)
-        if not linker.select_all_distributors():
-            logger.error("Не удалось выбрать всех дистрибьюторов")
-            exit(1)
-        if not linker.open_unlinked_page():
-            logger.error("Не удалось открыть страницу непривязанных товаров")
+        ok = run_link(linker, api)
+        save_session(session_store, linker)
+        if not ok:
             exit(1)
-        linker.run_linking()
-        summarize(linker.results)
     finally:
         linker.close()
+        api.close()
+        if linker.resolution_cache:
+            linker.resolution_cache.close()
+        if session_store:
+            session_store.close()
+        get_profile().report()
 
 
 if __name__ == '__main__':